@@ -0,0 +1,186 @@
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+# Graph caps managedDevices pages at 1000 records
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 1000
+
+OPERATING_SYSTEMS = [("Windows", "10.0.22631.4317"), ("Windows", "10.0.19045.5011"), ("iOS", "17.6.1"), ("Android", "14"), ("macOS", "14.6.1")]
+COMPLIANCE_STATES = ["compliant", "compliant", "compliant", "noncompliant", "inGracePeriod", "unknown"]
+MANUFACTURERS = ["Dell Inc.", "HP", "Lenovo", "Microsoft Corporation", "Apple", "Samsung"]
+APP_NAMES = ["Microsoft Edge", "Google Chrome", "Mozilla Firefox", "7-Zip", "Notepad++", "Zoom", "Slack", "Microsoft Teams", "Adobe Acrobat Reader", "VLC media player"]
+
+def synthetic_device(index):
+    # Deterministic per index, so any page can be generated on its own
+    rng = random.Random(index)
+    operating_system, os_version = OPERATING_SYSTEMS[index % len(OPERATING_SYSTEMS)]
+    return {
+        "id": f"00000000-0000-4000-8000-{index:012d}",
+        "deviceName": f"BENCH-{index:07d}",
+        "userPrincipalName": f"user{index % 5000}@contoso.example",
+        "operatingSystem": operating_system,
+        "osVersion": os_version,
+        "complianceState": COMPLIANCE_STATES[rng.randrange(len(COMPLIANCE_STATES))],
+        "managementAgent": "mdm",
+        "manufacturer": MANUFACTURERS[index % len(MANUFACTURERS)],
+        "model": f"Model {rng.randrange(40)}",
+        "serialNumber": f"SN{rng.randrange(10 ** 10):010d}",
+        "isEncrypted": rng.random() < 0.9,
+        "totalStorageSpaceInBytes": 256 * 1024 ** 3,
+        "freeStorageSpaceInBytes": rng.randrange(10, 200) * 1024 ** 3,
+        "enrolledDateTime": f"2024-{1 + index % 12:02d}-{1 + index % 28:02d}T08:00:00Z",
+        "lastSyncDateTime": f"2026-10-{1 + rng.randrange(17):02d}T{rng.randrange(24):02d}:00:00Z",
+        "azureADDeviceId": f"11111111-0000-4000-8000-{index:012d}",
+        "deviceCategoryDisplayName": "Unknown",
+        "configurationManagerClientEnabledFeatures": None
+    }
+
+def synthetic_app(index):
+    rng = random.Random(-index - 1)
+    return {
+        "id": f"app-{index:08d}",
+        "displayName": f"{APP_NAMES[index % len(APP_NAMES)]}",
+        "version": f"{rng.randrange(1, 130)}.{rng.randrange(10)}.{rng.randrange(1000)}",
+        "sizeInByte": rng.randrange(10 ** 6, 10 ** 9),
+        "deviceCount": rng.randrange(1, 5000),
+        "publisher": "Bench Publisher",
+        "platform": "windows"
+    }
+
+CONFIG_FIELDS = ("fleet_size", "page_size", "latency", "throttle_rate", "retry_after")
+
+COLLECTIONS = {
+    "deviceManagement/managedDevices": synthetic_device,
+    "deviceManagement/detectedApps": synthetic_app,
+}
+
+class MockGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers = {**(headers or {}), "Content-Encoding": "gzip"}
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/_bench/config":
+            # The runner changes fleet size, latency and throttling between runs
+            for name, value in json.loads(body).items():
+                if name in CONFIG_FIELDS:
+                    setattr(self.server, name, value)
+            return self.send_json(200, {name: getattr(self.server, name) for name in CONFIG_FIELDS})
+        if self.path.endswith("/oauth2/v2.0/token"):
+            # Client-credentials token endpoint: /{tenant}/oauth2/v2.0/token
+            self.server.count("token")
+            return self.send_json(200, {"token_type": "Bearer", "expires_in": 3599, "access_token": "bench-token"})
+        self.send_json(404, {"error": {"code": "NotFound", "message": "Unknown endpoint"}})
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/_bench/stats":
+            return self.send_json(200, server.stats())
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_rate and server.random() < server.throttle_rate:
+            server.count("throttled")
+            return self.send_json(429, {"error": {"code": "TooManyRequests", "message": "Too many requests"}},
+                                  {"Retry-After": f"{server.retry_after:g}"})
+
+        parts = urlsplit(self.path)
+        version, _, collection = parts.path.strip('/').partition('/')
+        make_record = COLLECTIONS.get(collection)
+        if version not in ("v1.0", "beta") or make_record is None:
+            return self.send_json(404, {"error": {"code": "ResourceNotFound", "message": f"Resource not found for the segment '{collection}'."}})
+
+        query = {key.lower(): values[-1] for key, values in parse_qs(parts.query).items()}
+        page_size = min(int(query.get("$top") or server.page_size), MAX_PAGE_SIZE)
+        offset = int(query.get("$skiptoken") or 0)
+        selected = [name.strip() for name in query.get("$select", "").split(',') if name.strip()]
+        end = min(offset + page_size, server.fleet_size)
+        records = [make_record(index) for index in range(offset, end)]
+        if selected:
+            records = [{"id": record["id"], **{name: record.get(name) for name in selected}} for record in records]
+
+        payload = {"@odata.context": f"{server.base_url}/{version}/$metadata#{collection}", "value": records}
+        if end < server.fleet_size:
+            next_query = {key: value for key, value in query.items() if key != "$skiptoken"}
+            next_query["$skiptoken"] = end
+            payload["@odata.nextLink"] = f"{server.base_url}{parts.path}?{urlencode(next_query, safe='$,')}"
+        self.send_json(200, payload)
+
+class MockGraphServer(ThreadingHTTPServer):
+    """Local stand-in for Graph and its token endpoint, serving synthetic Intune data.
+
+    fleet_size, page_size, latency (seconds per request), throttle_rate (share of GETs
+    answered with 429) and retry_after can be changed between runs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, fleet_size=1000, page_size=DEFAULT_PAGE_SIZE, latency=0.0, throttle_rate=0.0, retry_after=0.1, seed=0):
+        super().__init__((host, port), MockGraphHandler)
+        self.base_url = f"http://{host}:{self.server_address[1]}"
+        self.fleet_size = fleet_size
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.counters = {"requests": 0, "throttled": 0, "token": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are expected, anything else is worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Microsoft Graph serving synthetic Intune data.")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--fleet-size", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+    server = MockGraphServer(port=args.port, fleet_size=args.fleet_size, page_size=args.page_size, latency=args.latency,
+                             throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    # The first line is the base URL; bench/run.py reads it to find a port picked by the OS
+    print(server.base_url, flush=True)
+    server.serve_forever()
@@ -0,0 +1,204 @@
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+EMBEDDING_DIMENSIONS = 1536
+BENCH_ANSWER = ("Here is what the Graph result shows. Most devices are compliant; the noncompliant ones are "
+                "spread over every platform. Filter on complianceState eq 'noncompliant' to list them and "
+                "check lastSyncDateTime to find the ones that stopped checking in.")
+# Structured output the app asks for, by json_schema name
+STRUCTURED_OUTPUTS = {
+    "GraphAPIURL": {"base_url": "https://graph.microsoft.com/", "version": "v1.0",
+                    "endpoint": "deviceManagement/managedDevices", "parameters": ["$select=deviceName,operatingSystem,complianceState"]},
+}
+
+def _sample_from_schema(schema):
+    # A minimal valid instance for any other structured output request
+    schema_type = schema.get("type")
+    schema_type = next((item for item in schema_type if item != "null"), "null") if isinstance(schema_type, list) else schema_type
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        return {name: _sample_from_schema(prop) for name, prop in schema.get("properties", {}).items()}
+    return {"array": [], "string": "", "number": 0, "integer": 0, "boolean": False}.get(schema_type)
+
+def _words(text):
+    # Stream the answer a few characters at a time, like tokens
+    return [text[position:position + 4] for position in range(0, len(text), 4)]
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_event(self, data, event=None):
+        text = (f"event: {event}\n" if event else "") + f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        chunk = text.encode()
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def stream_text(self, make_event, event=None):
+        server = self.server
+        time.sleep(server.first_token_latency)
+        for word in _words(server.answer):
+            self.send_event(make_event(word), event)
+            if server.token_latency:
+                time.sleep(server.token_latency)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        self.server.count(f"GET {path.split('/')[2] if path.count('/') > 1 else path}")
+        if path == "/v1/models":
+            return self.send_json({"object": "list", "data": [{"id": "gpt-4o-2024-08-06", "object": "model", "created": 0, "owned_by": "bench"}]})
+        if path.startswith("/v1/threads/") and path.endswith("/runs"):
+            return self.send_json({"object": "list", "data": [], "has_more": False})
+        if path.startswith("/v1/threads/") and path.endswith("/messages"):
+            message = {"id": "msg_bench", "object": "thread.message", "role": "assistant",
+                       "content": [{"type": "text", "text": {"value": self.server.answer, "annotations": []}}]}
+            return self.send_json({"object": "list", "data": [message], "has_more": False})
+        if path.startswith("/v1/threads/"):
+            return self.send_json({"id": path.rsplit('/', 1)[1], "object": "thread", "created_at": int(time.time()), "metadata": {}})
+        if path.startswith("/v1/assistants"):
+            assistant = {"id": "asst_bench", "object": "assistant", "name": "Intune Copilot", "model": "gpt-4o-2024-08-06",
+                         "instructions": "", "tools": [{"type": "file_search"}], "created_at": 0}
+            return self.send_json(assistant if path.count('/') > 2 else {"object": "list", "data": [assistant], "has_more": False})
+        self.send_json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        request = self.read_json()
+        self.server.count(f"POST {path}" if not path.startswith("/v1/threads/") else f"POST /v1/threads/{{id}}/{path.rsplit('/', 1)[1]}")
+        if path == "/v1/chat/completions":
+            return self.chat_completion(request)
+        if path == "/v1/embeddings":
+            return self.embeddings(request)
+        if path == "/v1/threads":
+            return self.send_json({"id": f"thread_{uuid.uuid4().hex[:24]}", "object": "thread", "created_at": int(time.time()), "metadata": {}})
+        if path.startswith("/v1/threads/") and path.endswith("/runs"):
+            return self.run(path.split('/')[3], request)
+        self.send_json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+
+    def chat_completion(self, request):
+        server = self.server
+        model = request.get("model", "gpt-4o-2024-08-06")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        if request.get("stream"):
+            self.start_stream()
+            self.stream_text(lambda word: {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                                           "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+            return self.end_stream()
+
+        time.sleep(server.first_token_latency)
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]
+            content = json.dumps(STRUCTURED_OUTPUTS.get(json_schema["name"]) or _sample_from_schema(json_schema["schema"]))
+        else:
+            content = server.answer
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        self.send_json({
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4, "total_tokens": prompt_tokens + len(content) // 4}
+        })
+
+    def embeddings(self, request):
+        inputs = request.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        data = []
+        for position, text in enumerate(inputs):
+            # Same text, same vector
+            rng = np.random.default_rng(int.from_bytes(hashlib.sha256(str(text).encode()).digest()[:8], "little"))
+            vector = rng.standard_normal(EMBEDDING_DIMENSIONS)
+            data.append({"object": "embedding", "index": position, "embedding": (vector / np.linalg.norm(vector)).tolist()})
+        self.send_json({"object": "list", "data": data, "model": request.get("model"), "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def run(self, thread_id, request):
+        run_id = f"run_{uuid.uuid4().hex[:24]}"
+        run = {"id": run_id, "object": "thread.run", "created_at": int(time.time()), "thread_id": thread_id,
+               "assistant_id": request.get("assistant_id"), "status": "queued", "model": "gpt-4o-2024-08-06",
+               "instructions": request.get("instructions") or "", "tools": request.get("tools") or [], "usage": None}
+        self.start_stream()
+        self.send_event(run, "thread.run.created")
+        self.send_event({**run, "status": "in_progress"}, "thread.run.in_progress")
+        self.stream_text(lambda word: {"id": "msg_bench", "object": "thread.message.delta",
+                                       "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word, "annotations": []}}]}},
+                         "thread.message.delta")
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("additional_messages") or []) // 4
+        completion_tokens = len(self.server.answer) // 4
+        self.send_event({**run, "status": "completed",
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}},
+                        "thread.run.completed")
+        self.end_stream()
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """Local OpenAI-compatible endpoint: chat completions (streamed and structured), embeddings,
+    models, and just enough of threads, runs and assistants for chat_with_assistant.
+
+    first_token_latency and token_latency (seconds) shape how the answers stream.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_latency=0.05, token_latency=0.0, answer=BENCH_ANSWER):
+        super().__init__((host, port), MockOpenAIHandler)
+        self.base_url = f"http://{host}:{self.server_address[1]}/v1"
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer = answer
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are expected, anything else is worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible endpoint for offline benchmarks.")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    server = MockOpenAIServer(port=args.port, first_token_latency=args.first_token_latency, token_latency=args.token_latency)
+    print(server.base_url, flush=True)
+    server.serve_forever()
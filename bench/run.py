@@ -0,0 +1,224 @@
+"""Offline benchmark: drives the app's Graph and OpenAI code paths against local mock servers.
+
+    python -m bench.run --sizes 1000,10000,100000,500000 --json bench.json
+
+Nothing leaves the machine: Graph, its token endpoint and OpenAI are served by
+bench/mock_graph.py and bench/mock_openai.py on 127.0.0.1. They run as separate
+processes, so their CPU time and allocations don't count against the app.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import tempfile
+import subprocess
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out
+    resource = None
+
+# The app's caches must not touch (or be warmed by) the real .cache folder
+os.environ.setdefault("INTUNE_NINJA_CACHE_DIR", tempfile.mkdtemp(prefix="intune-ninja-bench-"))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import logging
+import numpy as np
+import requests
+import streamlit as st
+from openai import OpenAI
+from utils import ai_chat
+from utils.graph_api import call_graph_api, get_next_batch, get_graph_api_url, get_ms_graph_api
+from utils.graph_token import get_token_provider
+from utils.graph_cache import get_response_cache
+from utils.metrics import get_metrics
+
+BENCH_TENANT = "00000000-0000-0000-0000-000000000bench"
+QUESTIONS = [
+    "Which Windows 11 devices are not compliant?",
+    "List devices that have not synced in the last 30 days",
+    "How many devices per operating system?",
+    "Show the most installed apps",
+]
+
+class MockProcess:
+    """One of the mock servers in a child process; it prints its base URL on the first line."""
+
+    def __init__(self, module, *args):
+        self.process = subprocess.Popen([sys.executable, "-m", module, *args], stdout=subprocess.PIPE, text=True,
+                                        cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        self.base_url = self.process.stdout.readline().strip()
+        if not self.base_url:
+            raise RuntimeError(f"{module} did not start")
+
+    def configure(self, **settings):
+        requests.post(f"{self.base_url}/_bench/config", json=settings, timeout=10).raise_for_status()
+
+    def stats(self):
+        return requests.get(f"{self.base_url}/_bench/stats", timeout=10).json()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+def percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+def setup_session(graph, openai_server):
+    # There is no Streamlit session here, so the app reads its secrets from the environment
+    os.environ.update({
+        "LLM_MODEL": "gpt-4o-2024-08-06",
+        "LLM_API_KEY": "sk-bench",
+        "MS_GRAPH_TENANT_ID": BENCH_TENANT,
+        "MS_GRAPH_CLIENT_ID": "bench-client",
+        "MS_GRAPH_CLIENT_SECRET": "bench-secret",
+    })
+    # Same arguments as MSGraphAPI uses, so it picks up this provider pointed at the mock login endpoint
+    get_token_provider(BENCH_TENANT, "bench-client", "bench-secret").login_url = graph.base_url
+    ms_graph_api = get_ms_graph_api()
+    ms_graph_api.base_url = graph.base_url + "/"
+    ai_chat.client = OpenAI(api_key="sk-bench", base_url=openai_server.base_url, max_retries=0)
+    # Skip assistant and vector store setup, the run itself is what is measured
+    st.session_state.IntuneCopilotAssistant = ai_chat.client.beta.assistants.retrieve("asst_bench")
+    return ms_graph_api
+
+def bench_graph_url(runs, system_prompt):
+    samples = []
+    for run in range(runs):
+        started = time.perf_counter()
+        result = get_graph_api_url(ai_chat.client, QUESTIONS[run % len(QUESTIONS)], system_prompt, use_semantic_cache=False)
+        samples.append(time.perf_counter() - started)
+        if result is None:
+            raise RuntimeError("get_graph_api_url failed, see the log above")
+    return {"runs": runs, **percentiles(samples)}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+def bench_paging(graph, ms_graph_api, fleet_size, trace_memory=False):
+    graph.configure(fleet_size=fleet_size)
+    get_response_cache().clear()
+    url = f"{ms_graph_api.base_url}v1.0/deviceManagement/managedDevices"
+    samples = []
+    records = 0
+    throttled_before = graph.stats()["throttled"]
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    page_started = started
+    response = call_graph_api(url)
+    while True:
+        if response.startswith("Error"):
+            raise RuntimeError(response)
+        page = json.loads(response)
+        samples.append(time.perf_counter() - page_started)
+        records += len(page["data"])
+        if not page["next_link"]:
+            break
+        page_started = time.perf_counter()
+        response = get_next_batch(page["next_link"])
+    elapsed = time.perf_counter() - started
+    memory = {"peak_rss_mb": peak_rss_mb()}
+    if trace_memory:
+        memory["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        tracemalloc.stop()
+
+    return {
+        "fleet_size": fleet_size,
+        "records": records,
+        "pages": len(samples),
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed),
+        "throttled": graph.stats()["throttled"] - throttled_before,
+        **memory,
+        **{f"page_{name}": value for name, value in percentiles(samples).items()}
+    }
+
+def bench_chat(runs):
+    thread_id = ai_chat.client.beta.threads.create().id
+    history = []
+    samples = []
+    for run in range(runs):
+        question = QUESTIONS[run % len(QUESTIONS)]
+        started = time.perf_counter()
+        answer = ai_chat.chat_with_assistant(question, None, list(history), thread_id)
+        samples.append(time.perf_counter() - started)
+        if answer.startswith("An error occurred"):
+            raise RuntimeError(answer)
+        history.extend([{"role": "user", "content": question}, {"role": "assistant", "content": answer}])
+    first_token = get_metrics().snapshot()["stages"].get("assistant_first_token", {})
+    return {"runs": runs, **percentiles(samples),
+            "first_token_p50_ms": round(first_token.get("p50_seconds", 0) * 1000, 2),
+            "first_token_p95_ms": round(first_token.get("p95_seconds", 0) * 1000, 2)}
+
+def print_table(title, rows):
+    if not rows:
+        return
+    header = list(rows[0])
+    widths = [max(len(str(name)), *(len(str(row[name])) for row in rows)) for name in header]
+    print(f"\n{title}")
+    print("  ".join(str(name).rjust(width) for name, width in zip(header, widths)))
+    for row in rows:
+        print("  ".join(str(row[name]).rjust(width) for name, width in zip(header, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Intune Ninja against local mock Graph and OpenAI servers.")
+    parser.add_argument("--sizes", default="1000,10000,100000,500000", help="Comma separated fleet sizes (devices)")
+    parser.add_argument("--page-size", type=int, default=1000, help="Records per Graph page")
+    parser.add_argument("--graph-latency", type=float, default=0.02, help="Seconds the mock Graph waits per request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of Graph requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds before the mock OpenAI sends the first token")
+    parser.add_argument("--url-runs", type=int, default=20, help="get_graph_api_url calls")
+    parser.add_argument("--chat-runs", type=int, default=10, help="chat_with_assistant calls")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the Python heap peak per fleet size (tracemalloc, slows paging down)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    # The app logs every page and run at INFO; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+    graph = MockProcess("bench.mock_graph", "--page-size", str(args.page_size), "--latency", str(args.graph_latency),
+                        "--throttle-rate", str(args.throttle_rate), "--retry-after", str(args.retry_after))
+    openai_server = MockProcess("bench.mock_openai", "--first-token-latency", str(args.llm_latency))
+    with open(os.path.join(os.path.dirname(__file__), '..', 'prompts', 'system_prompt.md'), 'r') as file:
+        system_prompt = {"role": "system", "content": file.read().strip()}
+
+    try:
+        ms_graph_api = setup_session(graph, openai_server)
+        results = {
+            "settings": vars(args),
+            "graph_url": bench_graph_url(args.url_runs, system_prompt),
+            "paging": [bench_paging(graph, ms_graph_api, int(size), args.trace_memory) for size in args.sizes.split(',') if size.strip()],
+            "chat": bench_chat(args.chat_runs),
+        }
+    finally:
+        graph.stop()
+        openai_server.stop()
+    results["stages"] = {stage: {key: stats[key] for key in ("count", "errors", "p50_seconds", "p95_seconds", "attributes")}
+                         for stage, stats in get_metrics().snapshot()["stages"].items()}
+
+    print_table("get_graph_api_url", [results["graph_url"]])
+    print_table("call_graph_api + get_next_batch", results["paging"])
+    print_table("chat_with_assistant", [results["chat"]])
+    print_table("Stages (utils.metrics)", [{"stage": stage, "count": stats["count"], "errors": stats["errors"],
+                                            "p50_ms": round(stats["p50_seconds"] * 1000, 2), "p95_ms": round(stats["p95_seconds"] * 1000, 2)}
+                                           for stage, stats in results["stages"].items()])
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.json}")
+
+if __name__ == "__main__":
+    main()
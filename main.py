@@ -1,10 +1,22 @@
 import os
 import streamlit as st
-from utils.write_debug import write_debug, clear_debug_messages
+from utils.write_debug import write_debug, render_debug_log, clear_debug_messages
 from textwrap import dedent
-from utils.graph_api import call_graph_api, get_graph_api_url
+from utils.graph_api import call_graph_api, get_graph_api_url, iter_graph_pages, iter_graph_records, get_ms_graph_api, GraphAPIError
+from utils.graph_delta import DeltaSync, supports_delta, selected_properties
+from utils.graph_batch import lookup_per_record
+from utils.graph_api_async import fetch_many
+from utils.graph_validate import validate_graph_url, format_validation
+from utils.graph_throttle import get_graph_scheduler
+from utils.graph_cache import get_response_cache
+from utils.response_compact import compact_graph_response, message_budget
+from utils.map_reduce import interpret_map_reduce, needs_map_reduce
+from utils.analytics import ColumnStore, run_analysis, format_table, get_analysis_spec
+from utils.graph_export import GraphExport, EXPORT_FORMATS, export_file_name
+from utils.metrics import render_metrics_panel, export_metrics
 from utils.ai_chat import initialize_client, chat_with_assistant, check_client_status, update_client_status
 import json
+import sqlite3
 
 # Add this new function to parse the pasted secrets
 def parse_secrets(secrets_text):
@@ -92,17 +104,76 @@ def is_valid_openai_api_key(api_key):
     return api_key.startswith('sk-') or api_key.startswith('sk-proj-')
 
 def invoke_graph_api(url):
-    response = call_graph_api(st.session_state.graph_api_url)
+    # Check the URL against the local OpenAPI spec before spending a Graph round trip on it
+    validation = validate_graph_url(st.session_state.graph_api_url)
+    if not validation["valid"]:
+        write_debug(":negative_squared_cross_mark: URL failed local validation, not calling Graph.")
+        st.session_state.bad_request = True
+        st.session_state.metadata = format_validation(validation)
+        return "Local validation failed, the request was not sent to Graph:\n\n" + st.session_state.metadata
+    for warning in validation["warnings"]:
+        write_debug(f":grey_question: {warning}")
+
+    response = call_graph_api(st.session_state.graph_api_url, use_cache=st.session_state.get("use_response_cache", True))
     if "Error 400" in response:
+        st.session_state.bad_request = True
+        if validation["known"]:
+            write_debug(":negative_squared_cross_mark: Bad Request. Using the property list from the local spec.")
+            st.session_state.metadata = format_validation(validation)
+            return response
         write_debug(":negative_squared_cross_mark: Bad Request. Trying to get metadata instead.")
         #st.warning("Bad Request. Trying to get metadata instead.")
-        st.session_state.bad_request = True
         try:
             st.session_state.metadata = call_graph_api(st.session_state.graph_api_json["base_url"] + st.session_state.graph_api_json["version"] + "/" + st.session_state.graph_api_json["endpoint"] + "?$top=1")
         except:
             st.session_state.metadata = call_graph_api("https://graph.microsoft.com/" + st.session_state.graph_api_json["version"] + "/" + st.session_state.graph_api_json["endpoint"] + "?$top=1")
     return response
 
+# Only this many records of a multi-page result are shown in the response text area
+RESPONSE_PREVIEW_RECORDS = 100
+# Full exports are written here, relative to the working directory like prompts/ and files/
+EXPORT_DIR = "exports"
+# Records "Look up per record" fans out over, at 20 per $batch request
+PER_RECORD_LOOKUP_MAX_RECORDS = 1000
+# Upper bound for "Interpret all pages", which walks the pager while chunks are being summarised
+MAP_REDUCE_MAX_RECORDS = 50000
+
+def get_response_records():
+    # All fetched records if the pager or a delta sync ran, otherwise the current page
+    if st.session_state.get("graph_api_records") is not None:
+        return st.session_state.graph_api_records
+    try:
+        return json.loads(st.session_state.graph_api_response).get('data') or []
+    except (ValueError, AttributeError):
+        return []
+
+def get_response_next_link():
+    try:
+        return json.loads(st.session_state.graph_api_response).get('next_link')
+    except (ValueError, AttributeError):
+        return None
+
+def fetch_all_pages(url, max_records):
+    records = []
+    next_link = None
+    progress = st.empty()
+    try:
+        for page, next_link in iter_graph_pages(url, max_records=max_records):
+            records.extend(page)
+            progress.info(f":satellite: {len(records)} records fetched...")
+    except Exception as e:
+        write_debug(f":warning: Error fetching pages: {str(e)}")
+        st.error(f"Error fetching pages: {str(e)}")
+        return False
+    progress.empty()
+    st.session_state.graph_api_records = records
+    st.session_state.graph_api_response = json.dumps({
+        'data': records[:RESPONSE_PREVIEW_RECORDS],
+        'next_link': next_link,
+        'records_fetched': len(records)
+    }, indent=2)
+    return True
+
 st.title(":ninja: Intune Ninja", help="*a ninja tool for crafting Graph API calls and interpreting the results with AI*")
 
 # Configuration section
@@ -156,19 +227,29 @@ with st.sidebar:
             status.update(label="Please complete the configuration", state="running")
 
     st.session_state.debug_container = st.empty()
+    st.session_state.metrics_container = st.empty()
     st.divider()
-    st.subheader(f"OpenAI Client Status: " + (":white_check_mark:" if st.session_state.client_status == "ready" else ":x:"))
+    st.subheader(f"OpenAI Client Status: " + (":white_check_mark:" if st.session_state.client_status == "ready" else ":x:"),
+                 help=st.session_state.get("client_status_message"))
     
     # Add a button to manually refresh the client status
     if st.button("Refresh Client Status"):
-        update_client_status()
+        update_client_status(force=True)
+        # The header above was drawn with the old status
+        st.rerun()
+
+    if are_secrets_set():
+        graph_stats = get_graph_scheduler(st.session_state.user_secrets['MS_GRAPH_TENANT_ID']).stats()
+        st.caption(f"Graph requests: {graph_stats['requests']} · throttled: {graph_stats['throttled']} · retried: {graph_stats['retried']}")
+        cache_stats = get_response_cache().get_stats()
+        st.caption(f"Response cache hits: {cache_stats['hits']} · misses: {cache_stats['misses']} · revalidated: {cache_stats['revalidated']}")
     
 # Add this to the top of the file, after other initializations
 if 'graph_api_response' not in st.session_state:
     st.session_state.graph_api_response = ""
 
 def get_or_create_thread_id():
-    if "thread_id" not in st.session_state:
+    if not st.session_state.get("thread_id"):
         st.session_state.thread_id = client.beta.threads.create().id
     return st.session_state.thread_id
 
@@ -308,6 +389,8 @@ with col1:
                 key="graph_api_parameters",
                 # on_change=update_url
             )
+            st.checkbox(label="Use cached responses", value=True, key="use_response_cache",
+                        help="Repeat requests are served from the local response cache until their TTL expires")
             col_graph_submit_left, col_graph_submit_right = st.columns(2)
             with col_graph_submit_left:
                 update_url_button = st.form_submit_button(label="♻️ Update Graph API URL")
@@ -323,8 +406,31 @@ with col1:
                 # Update the session state with the potentially modified URL
                 # st.session_state.graph_api_url = updated_url
                 st.session_state.graph_api_response = invoke_graph_api(st.session_state.graph_api_url)
+                st.session_state.graph_api_records = None
                 st.rerun()
 
+        # Collections with a /delta function are synced locally instead of downloaded again,
+        # unless the query has options ($filter, $top, ...) the local copy can't honour
+        graph_endpoint = st.session_state.graph_api_json.get("endpoint", "")
+        graph_parameters = st.session_state.graph_api_json.get("parameters")
+        if supports_delta(graph_endpoint, graph_parameters) and st.button("🔄 Sync changes (delta query)"):
+            with st.spinner("Syncing changes..."):
+                try:
+                    delta_sync = DeltaSync(get_ms_graph_api(), graph_endpoint, st.session_state.graph_api_json["version"])
+                    delta_stats = delta_sync.sync()
+                    records = list(delta_sync.iter_items(selected_properties(graph_parameters)))
+                    st.session_state.graph_api_records = records
+                    st.session_state.graph_api_response = json.dumps({
+                        'data': records[:RESPONSE_PREVIEW_RECORDS],
+                        'next_link': None,
+                        'records_fetched': len(records),
+                        'delta_sync': delta_stats
+                    }, indent=2)
+                    st.rerun()
+                except (GraphAPIError, sqlite3.Error, ValueError) as e:
+                    # ValueError also covers JSON errors and failed Graph calls without a status code
+                    st.error(f"Delta sync failed: {str(e)}")
+
     # Display the Graph API response in a scrollable window and add an interpret button
     if st.session_state.get("graph_api_response"):
         st.subheader("Graph API Response")
@@ -341,11 +447,84 @@ with col1:
                 height=250,
                 key="graph_api_response_col1"
             )
+            analyze_button = st.form_submit_button(label="📊 Analyze locally", help="Count, group and compute percentiles over the fetched records on this machine, then interpret only the aggregated table")
+            if get_response_next_link():
+                st.checkbox("Interpret all pages (map-reduce)", key="interpret_all_pages",
+                            help=f"Summarise up to {MAP_REDUCE_MAX_RECORDS} records in parallel chunks instead of only the first page")
         
         if interpret_button:
             st.session_state.interpret_url = True
             st.rerun()
 
+        if analyze_button:
+            st.session_state.analyze_locally = True
+            st.rerun()
+
+        # Walk the remaining @odata.nextLink pages on demand
+        if get_response_next_link():
+            with st.form(key='graph_api_pages_form'):
+                max_records = st.number_input(label="Max records", min_value=1, value=10000, step=1000)
+                fetch_all_button = st.form_submit_button(label="⏬ Fetch all pages")
+
+            if fetch_all_button:
+                with st.spinner("Fetching all pages..."):
+                    if fetch_all_pages(st.session_state.graph_api_url, max_records):
+                        st.rerun()
+
+        # Stream the whole collection to a file instead of holding it in the session
+        if get_response_next_link() or st.session_state.get("graph_api_records"):
+            with st.form(key='graph_api_export_form'):
+                col_export_format, col_export_name = st.columns([1, 2])
+                with col_export_format:
+                    export_format = st.selectbox(label="Export format", options=EXPORT_FORMATS)
+                with col_export_name:
+                    export_name = st.text_input(label="File name", value="graph_export")
+                export_button = st.form_submit_button(label="💾 Export all pages")
+
+            if export_button:
+                export_path = os.path.join(EXPORT_DIR, export_file_name(export_name, export_format))
+                os.makedirs(EXPORT_DIR, exist_ok=True)
+                export_progress = st.empty()
+                try:
+                    graph_export = GraphExport(st.session_state.graph_api_url, export_path, export_format)
+                    if graph_export.resuming:
+                        st.info(f"Resuming the previous export after {graph_export.state['records']} records")
+                    export_state = graph_export.run(progress=lambda records, rate: export_progress.info(
+                        f":floppy_disk: {records} records exported ({rate:.0f} records/s)"))
+                    export_progress.success(f"Exported {export_state['records']} records to {os.path.abspath(export_path)}")
+                except Exception as e:
+                    export_progress.empty()
+                    st.error(f"Export stopped: {str(e)}. Export again to resume from the last saved page.")
+
+        # Fan a related request out over the fetched records, e.g. the primary users of each device
+        if any(isinstance(record, dict) and record.get('id') for record in get_response_records()):
+            with st.form(key='graph_api_lookup_form'):
+                lookup_path = st.text_input(label="Look up per record", placeholder="users",
+                                            help=f"GET {{endpoint}}/{{id}}/<this> for each of the first {PER_RECORD_LOOKUP_MAX_RECORDS} records, sent in $batch requests of 20")
+                lookup_all_pages = st.checkbox("Follow all pages", help="Send the lookups as concurrent requests that follow @odata.nextLink, instead of $batch requests that return the first page of each")
+                lookup_button = st.form_submit_button(label="🔎 Look up per record")
+
+            if lookup_button and lookup_path.strip():
+                with st.spinner("Looking up per record..."):
+                    try:
+                        records = get_response_records()
+                        fetch = (lambda urls: fetch_many(urls, all_pages=True)) if lookup_all_pages else None
+                        looked_up, failed = lookup_per_record(get_ms_graph_api(), records[:PER_RECORD_LOOKUP_MAX_RECORDS],
+                                                              st.session_state.graph_api_json["endpoint"], lookup_path,
+                                                              st.session_state.graph_api_json["version"], fetch)
+                        if failed:
+                            write_debug(f":warning: {failed} of {len(looked_up)} per-record lookups failed")
+                        records = looked_up + records[PER_RECORD_LOOKUP_MAX_RECORDS:]
+                        st.session_state.graph_api_records = records
+                        st.session_state.graph_api_response = json.dumps({
+                            'data': records[:RESPONSE_PREVIEW_RECORDS],
+                            'next_link': get_response_next_link(),
+                            'records_fetched': len(records)
+                        }, indent=2)
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(f"Lookup failed: {str(e)}")
+
 with col2:
     # Add a Clear button
     if st.button("Clear Everything"):
@@ -398,6 +577,8 @@ with col2:
 
     # Handle interpretation of API result
     if st.session_state.get("interpret_url", False):
+        # Reset the flag first so a failed or interrupted interpretation isn't repeated on every rerun
+        st.session_state.interpret_url = False
         with spinner_container:
             with st.spinner(":ninja: Intune Ninja is interpreting the Graph API Response..."):
                 # Always get the latest values from the session state
@@ -406,6 +587,11 @@ with col2:
                 #user_input = st.session_state.get("last_query", "")
                 thread_id = get_or_create_thread_id()
                 
+                # Results too large for one prompt, even compacted, are summarised in chunks
+                interpret_all_pages = st.session_state.get("interpret_all_pages", False) and get_response_next_link()
+                use_map_reduce = st.session_state.bad_request == False and (
+                    interpret_all_pages or needs_map_reduce(get_response_records(), graph_api_url, model=st.session_state.LLM_MODEL))
+
                 if st.session_state.bad_request == False:
                     st.session_state.interpretation_prompt = st.session_state.run_instructions
                 else:
@@ -429,8 +615,32 @@ with col2:
                         """
                     st.session_state.bad_request = False
 
-                ai_interpretation = chat_with_assistant(f"My query was: \"{user_input}\" and the response from the Graph API was: {dedent(st.session_state.graph_api_response)}", st.session_state.interpretation_prompt, [], thread_id)
-                
+                with conversation_container:
+                    with st.chat_message("assistant"):
+                        interpretation_placeholder = st.empty()
+                if use_map_reduce:
+                    records = iter_graph_records(graph_api_url, max_records=MAP_REDUCE_MAX_RECORDS) if interpret_all_pages else get_response_records()
+                    try:
+                        ai_interpretation = interpret_map_reduce(user_input, records, graph_api_url, model=st.session_state.LLM_MODEL,
+                                                                 placeholder=interpretation_placeholder, progress=st.empty(),
+                                                                 instructions=st.session_state.interpretation_prompt,
+                                                                 total=MAP_REDUCE_MAX_RECORDS if interpret_all_pages else None)
+                    except Exception as e:
+                        write_debug(f":warning: Map-reduce interpretation failed: {str(e)}")
+                        st.error(f"Could not interpret the Graph API result: {str(e)}")
+                        ai_interpretation = None
+                else:
+                    # A digest of the result instead of the raw JSON, as large as one assistant message allows
+                    graph_api_result = compact_graph_response(
+                        st.session_state.graph_api_response,
+                        records=st.session_state.get("graph_api_records"),
+                        url=graph_api_url,
+                        budget=message_budget(st.session_state.LLM_MODEL),
+                        model=st.session_state.LLM_MODEL
+                    )
+                    ai_interpretation = chat_with_assistant(f"My query was: \"{user_input}\" and the response from the Graph API was: {graph_api_result}", st.session_state.interpretation_prompt, [], thread_id, placeholder=interpretation_placeholder)
+
+            if ai_interpretation is not None:
                 st.session_state.messages.append({"role": "assistant", "content": ai_interpretation})
                 
                 print("Parsing AI response for new URL...")
@@ -445,29 +655,54 @@ with col2:
                 else:
                     print("No new URL found in the AI response.")
                     st.session_state.new_url = None
-        
-        # Reset the flag
-        st.session_state.interpret_url = False
-        st.rerun()
+                st.rerun()
+
+    # Aggregate the records locally; the LLM only picks what to compute and explains the result
+    if st.session_state.get("analyze_locally", False):
+        st.session_state.analyze_locally = False
+        with spinner_container:
+            with st.spinner(":bar_chart: Analyzing the records locally..."):
+                try:
+                    store = ColumnStore(get_response_records())
+                    analysis_spec = get_analysis_spec(client, user_input, store, st.session_state.LLM_MODEL)
+                    write_debug(f"Analysis spec: {analysis_spec}")
+                    header, rows, matched = run_analysis(store, analysis_spec)
+                    analysis_table = format_table(header, rows)
+                    with conversation_container:
+                        with st.chat_message("assistant"):
+                            st.markdown(analysis_table)
+                            analysis_placeholder = st.empty()
+                    analysis = chat_with_assistant(
+                        f"My query was: \"{user_input}\". This table was computed locally from {matched} of {store.size} fetched records "
+                        f"(spec: {json.dumps(analysis_spec)}). The numbers are exact, explain them without recomputing:\n\n{analysis_table}",
+                        st.session_state.run_instructions, [], get_or_create_thread_id(), placeholder=analysis_placeholder)
+                    # The table is shown with the answer but kept apart from the content synced to the thread
+                    st.session_state.messages.append({"role": "assistant", "content": analysis, "table": analysis_table})
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Local analysis failed: {str(e)}")
 
     # Display the conversation history in reverse order
     with conversation_container:
         for message in reversed(st.session_state.messages):
             with st.chat_message(message["role"]):
+                if message.get("table"):
+                    st.markdown(message["table"])
                 st.markdown(message["content"])
 
     # Handle new user input
     if prompt:
         st.session_state.messages.append({"role": "user", "content": prompt})
         
+        # The answer streams into this placeholder while the run is going
+        with conversation_container:
+            with st.chat_message("assistant"):
+                response_placeholder = st.empty()
+
         with spinner_container:
             with st.spinner("AI is thinking..."):
                 thread_id = get_or_create_thread_id()
-                full_response = chat_with_assistant(prompt, st.session_state.messages, thread_id)
-        
-        with conversation_container:
-            with st.chat_message("assistant"):
-                st.markdown(full_response)
+                full_response = chat_with_assistant(prompt, st.session_state.run_instructions, st.session_state.messages[:-1], thread_id, placeholder=response_placeholder)
         
         st.session_state.messages.append({"role": "assistant", "content": full_response})
         st.rerun()
@@ -484,6 +719,11 @@ st.markdown("""
 </script>
 """, unsafe_allow_html=True)
 
-# At the end of the file, add this to ensure debug info is always displayed
-write_debug("")
-update_client_status()
+# At the end of the file: draw the debug log once, after everything this run logged
+render_debug_log()
+# Same for the stage metrics; the export files are what a scraper or a later comparison reads
+render_metrics_panel()
+try:
+    export_metrics()
+except OSError as e:
+    write_debug(f":warning: Could not write the metrics export: {str(e)}")
@@ -0,0 +1,34 @@
+import math
+from utils.analytics import ColumnStore, run_analysis
+
+RECORDS = [
+    {"deviceName": "PC-1", "operatingSystem": "Windows", "storage": {"freeSpaceInGB": 10}, "isEncrypted": True},
+    {"deviceName": "PC-2", "operatingSystem": "Windows", "storage": {"freeSpaceInGB": 30}, "isEncrypted": False},
+    {"deviceName": "MAC-1", "operatingSystem": "macOS", "storage": {"freeSpaceInGB": 50}},
+    {"deviceName": "PHONE-1", "operatingSystem": "iOS", "storage": {"freeSpaceInGB": None}},
+]
+
+def test_column_store_types_and_missing_values():
+    store = ColumnStore(RECORDS)
+    assert store.size == 4
+    assert store.is_numeric("storage/freeSpaceInGB")
+    assert not store.is_numeric("isEncrypted")
+    assert list(store.columns["isEncrypted"]) == ["true", "false", "", ""]
+    assert list(store.missing("storage/freeSpaceInGB")) == [False, False, False, True]
+    assert store.column("OPERATINGSYSTEM") == "operatingSystem"
+
+def test_run_analysis_groups_filters_and_sorts():
+    spec = {"filters": [{"column": "deviceName", "op": "ne", "value": "pc-2"}], "group_by": ["operatingSystem"],
+            "metrics": [{"op": "count", "column": None}], "sort_by": "operatingSystem", "descending": False, "limit": None}
+    header, rows, matched = run_analysis(ColumnStore(RECORDS), spec)
+    assert header == ["operatingSystem", "count"]
+    assert rows == [["Windows", 1.0], ["iOS", 1.0], ["macOS", 1.0]]
+    assert matched == 3
+
+def test_groups_without_a_value_sort_last_in_both_directions():
+    for descending, expected in ((True, ["macOS", "Windows", "iOS"]), (False, ["Windows", "macOS", "iOS"])):
+        spec = {"filters": [], "group_by": ["operatingSystem"], "metrics": [{"op": "mean", "column": "storage/freeSpaceInGB"}],
+                "sort_by": None, "descending": descending, "limit": None}
+        header, rows, matched = run_analysis(ColumnStore(RECORDS), spec)
+        assert [row[0] for row in rows] == expected
+        assert math.isnan(rows[-1][1])
@@ -0,0 +1,12 @@
+from utils import cache_dir
+from utils.oai_assistant import AssistantRegistry
+
+def test_remove_is_persisted(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_dir, "CACHE_DIR", str(tmp_path))
+    registry = AssistantRegistry()
+    registry.put("key-a", {"assistant_id": "asst_a"})
+    registry.put("key-b", {"assistant_id": "asst_b"})
+    registry.remove("key-a")
+    reloaded = AssistantRegistry()
+    assert reloaded.get("key-a") == {}
+    assert reloaded.get("key-b") == {"assistant_id": "asst_b"}
@@ -0,0 +1,24 @@
+import time
+import threading
+from utils.ai_chat import ClientHealth
+
+class SlowClient:
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.models = self
+
+    def list(self):
+        self.calls += 1
+        self.release.wait(5)
+
+def test_forced_refresh_joins_the_running_check():
+    client = SlowClient()
+    health = ClientHealth(client)
+    health.refresh()
+    threading.Timer(0.05, client.release.set).start()
+    started = time.perf_counter()
+    health.refresh(wait=True)
+    assert time.perf_counter() - started >= 0.04
+    assert health.status == "ready"
+    assert client.calls == 1
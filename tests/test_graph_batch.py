@@ -0,0 +1,66 @@
+from utils import graph_batch
+from utils.graph_batch import GraphBatch, lookup_per_record, MISSING_RESPONSE_STATUS
+
+class FakeGraph:
+    base_url = "https://graph.microsoft.com/"
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.envelopes = []
+
+    def call_api(self, url, method="GET", data=None):
+        self.envelopes.append(data["requests"])
+        return {"responses": [response for request in data["requests"] for response in self.answer(request, len(self.envelopes))]}
+
+def test_retry_drops_dependencies_that_succeeded(monkeypatch):
+    monkeypatch.setattr(graph_batch.time, "sleep", lambda seconds: None)
+
+    def answer(request, call):
+        # The second request is throttled once, the first one succeeds straight away
+        if request["id"] == "2" and call == 1:
+            return [{"id": "2", "status": 429, "headers": {"Retry-After": "1"}}]
+        return [{"id": request["id"], "status": 200, "body": {"id": request["id"]}}]
+
+    graph = FakeGraph(answer)
+    batch = GraphBatch(graph)
+    first = batch.add("groups/1")
+    second = batch.add("groups/1/members", depends_on=[first])
+    batch.flush()
+    assert graph.envelopes[1] == [{"id": "2", "method": "GET", "url": "/groups/1/members"}]
+    assert batch.result(second) == {"id": "2"}
+
+def test_missing_response_is_recorded_as_a_failure():
+    graph = FakeGraph(lambda request, call: [] if request["id"] == "2" else [{"id": request["id"], "status": 200, "body": {}}])
+    batch = GraphBatch(graph)
+    batch.add("users/a")
+    missing = batch.add("users/b")
+    batch.flush()
+    assert batch.response(missing).status == MISSING_RESPONSE_STATUS
+    assert batch.response("99").status == MISSING_RESPONSE_STATUS
+
+def test_lookup_per_record():
+    def answer(request, call):
+        if request["url"].startswith("/deviceManagement/managedDevices/b/"):
+            return [{"id": request["id"], "status": 404, "body": {"error": {"code": "NotFound", "message": "Gone"}}}]
+        return [{"id": request["id"], "status": 200, "body": {"value": [{"userPrincipalName": "adele@contoso.com"}]}}]
+
+    records, failed = lookup_per_record(FakeGraph(answer), [{"id": "a"}, {"deviceName": "no id"}, {"id": "b"}], "deviceManagement/managedDevices", "users")
+    assert failed == 1
+    assert records == [{"id": "a", "users": [{"userPrincipalName": "adele@contoso.com"}]},
+                       {"deviceName": "no id"},
+                       {"id": "b", "users": {"error": "NotFound: Gone"}}]
+
+def test_retry_after_that_is_not_a_number(monkeypatch):
+    delays = []
+    monkeypatch.setattr(graph_batch.time, "sleep", delays.append)
+
+    def answer(request, call):
+        if call == 1:
+            return [{"id": request["id"], "status": 429, "headers": {"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"}}]
+        return [{"id": request["id"], "status": 200, "body": {}}]
+
+    batch = GraphBatch(FakeGraph(answer))
+    request = batch.add("users/a")
+    batch.flush()
+    assert batch.response(request).ok
+    assert delays == [1]
@@ -0,0 +1,10 @@
+from utils.graph_cache import canonicalize_url
+
+BASE = "https://graph.microsoft.com/v1.0/deviceManagement/managedDevices"
+
+def test_whitespace_is_only_collapsed_outside_quoted_literals():
+    assert canonicalize_url(BASE + "?$top=5\n&$filter=deviceName  eq   'PC  01'") == BASE + "?$filter=deviceName eq 'PC  01'&$top=5"
+    assert canonicalize_url(BASE + "?$filter=deviceName eq 'PC  01'") != canonicalize_url(BASE + "?$filter=deviceName eq 'PC 01'")
+    assert canonicalize_url(BASE + '?$search="displayName:John  Smith"') == BASE + '?$search="displayName:John  Smith"'
+    assert canonicalize_url(BASE + "?$filter=deviceName eq 'it''s  here'   and  isEncrypted eq true") == \
+        BASE + "?$filter=deviceName eq 'it''s  here' and isEncrypted eq true"
@@ -0,0 +1,25 @@
+from utils import cache_dir
+from utils.graph_delta import DeltaSync, supports_delta, selected_properties
+
+class FakeGraph:
+    tenant_id = "tenant"
+    base_url = "https://graph.microsoft.com/"
+
+    def call_api(self, url):
+        return {"value": [{"id": "1", "displayName": "Adele", "mail": "adele@contoso.com"},
+                          {"id": "2", "displayName": "Alex", "mail": "alex@contoso.com"}],
+                "@odata.deltaLink": f"{url}?$deltatoken=abc"}
+
+def test_delta_is_only_offered_for_options_it_can_honour():
+    assert supports_delta("users")
+    assert supports_delta("users", ["$select=id,displayName"])
+    assert not supports_delta("users", ["$filter=accountEnabled eq true"])
+    assert not supports_delta("users", ["$select=id", "$top=5"])
+    assert not supports_delta("deviceManagement/managedDevices")
+
+def test_select_is_applied_to_the_local_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_dir, "CACHE_DIR", str(tmp_path))
+    delta_sync = DeltaSync(FakeGraph(), "users")
+    assert delta_sync.sync()["upserted"] == 2
+    items = list(delta_sync.iter_items(selected_properties(["$select=displayName"])))
+    assert items == [{"id": "1", "displayName": "Adele"}, {"id": "2", "displayName": "Alex"}]
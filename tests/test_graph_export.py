@@ -0,0 +1,50 @@
+import csv
+import pytest
+from utils import graph_export
+from utils.graph_export import GraphExport, export_file_name, ROW_GROUP_SIZE
+
+URL = "https://graph.microsoft.com/beta/deviceManagement/managedDevices"
+
+def fake_pages(pages):
+    def iter_graph_pages(url, max_records=None):
+        for number, page in enumerate(pages):
+            yield page, f"{URL}?$skiptoken={number + 1}" if number + 1 < len(pages) else None
+    return iter_graph_pages
+
+def test_parquet_types_widen_instead_of_dropping_values(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    first = [{"id": str(index), "deviceName": f"PC-{index}", "joinType": "azureADJoined", "storage": 1, "notes": None}
+             for index in range(ROW_GROUP_SIZE)]
+    second = [{"id": "x", "deviceName": "PC-x", "joinType": "hybridAzureADJoined", "storage": 2.5, "notes": True}]
+    monkeypatch.setattr(graph_export, "iter_graph_pages", fake_pages([first, second]))
+    path = str(tmp_path / "devices.parquet")
+    GraphExport(URL, path, "parquet").run()
+
+    table = pq.read_table(path)
+    assert table.num_rows == ROW_GROUP_SIZE + 1
+    # joinType is beta only, it is not in the v1.0 spec
+    assert table.column("joinType")[-1].as_py() == "hybridAzureADJoined"
+    assert table.column("storage").to_pylist()[-2:] == [1.0, 2.5]
+    assert table.column("notes")[-1].as_py() is True
+
+def test_export_file_name_stays_in_the_folder():
+    assert export_file_name("../../etc/passwd", "csv") == "passwd.csv"
+    assert export_file_name("..", "ndjson") == "graph_export.ndjson"
+    assert export_file_name("my devices:2024", "parquet") == "my devices_2024.parquet"
+
+def test_keys_on_later_pages_become_columns(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    pages = [[{"id": "1", "deviceName": "PC-1"}], [{"id": "2", "deviceName": "PC-2", "lateProperty": 5}]]
+    monkeypatch.setattr(graph_export, "iter_graph_pages", fake_pages(pages))
+
+    csv_path = str(tmp_path / "devices.csv")
+    GraphExport(URL, csv_path, "csv").run()
+    with open(csv_path, encoding="utf-8", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["lateProperty"] for row in rows] == ["", "5"]
+
+    # One part per page, so the first part is rewritten with the new column
+    monkeypatch.setattr(graph_export, "ROW_GROUP_SIZE", 1)
+    parquet_path = str(tmp_path / "devices.parquet")
+    GraphExport(URL, parquet_path, "parquet").run()
+    assert pq.read_table(parquet_path).column("lateProperty").to_pylist() == [None, 5]
@@ -0,0 +1,43 @@
+import asyncio
+from utils import graph_throttle
+from utils.graph_throttle import GraphScheduler
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def test_async_503_is_retried_on_a_fresh_connection(monkeypatch):
+    monkeypatch.setattr(graph_throttle.logger, "warning", lambda message: None)
+    scheduler = GraphScheduler()
+    connections = []
+
+    async def send(fresh_connection):
+        connections.append(fresh_connection)
+        return FakeResponse(503, {"Retry-After": "0"}) if len(connections) == 1 else FakeResponse(200)
+
+    assert asyncio.run(scheduler.submit_async(send)).status_code == 200
+    assert connections == [False, True]
+    assert scheduler.stats()["retried"] == 1
+
+def test_async_requests_share_the_in_flight_slots():
+    scheduler = GraphScheduler(max_in_flight=2)
+    running, peak = 0, 0
+
+    async def send(fresh_connection):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return FakeResponse(200)
+
+    async def run():
+        # A sync caller holds one of the two slots the whole time
+        with scheduler.in_flight:
+            await asyncio.gather(*(scheduler.submit_async(send) for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 1
+    # Every slot is back
+    assert all(scheduler.in_flight.acquire(blocking=False) for _ in range(2))
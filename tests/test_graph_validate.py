@@ -0,0 +1,36 @@
+from utils.graph_validate import validate_graph_url
+
+GRAPH = "https://graph.microsoft.com/"
+
+def test_unknown_v1_property_is_an_error():
+    result = validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$select=deviceName,joinType")
+    assert not result["valid"]
+    assert any("joinType" in diagnostic for diagnostic in result["diagnostics"])
+
+def test_beta_select_properties_are_only_warnings():
+    result = validate_graph_url(GRAPH + "beta/deviceManagement/managedDevices?$select=deviceName,joinType,skuFamily")
+    assert result["valid"]
+    assert len(result["warnings"]) == 2
+
+def test_beta_filter_property_is_only_a_warning():
+    result = validate_graph_url(GRAPH + "beta/deviceManagement/managedDevices?$filter=joinType eq 'azureADJoined'")
+    assert result["valid"]
+    assert any("joinType" in warning for warning in result["warnings"])
+
+def test_typed_enum_literal_is_accepted():
+    result = validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$filter=complianceState eq microsoft.graph.complianceState'compliant'")
+    assert result["valid"], result["diagnostics"]
+
+def test_typed_enum_literal_value_is_checked():
+    result = validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$filter=complianceState eq microsoft.graph.complianceState'bogus'")
+    assert not result["valid"]
+    assert any("'bogus' is not a valid value" in diagnostic for diagnostic in result["diagnostics"])
+
+def test_expand_with_nested_options():
+    assert validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$expand=users($select=id,displayName)")["valid"]
+    assert not validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$expand=nope")["valid"]
+
+def test_in_and_not_before_a_parenthesis_are_operators():
+    for expression in ("deviceName in ('PC-001', 'PC-002')", "not(deviceName eq 'PC-001')", "not (startswith(deviceName, 'PC'))"):
+        result = validate_graph_url(GRAPH + "v1.0/deviceManagement/managedDevices?$filter=" + expression)
+        assert result["valid"], (expression, result["diagnostics"])
@@ -0,0 +1,46 @@
+import pytest
+from types import SimpleNamespace
+from utils import ai_chat
+from utils.map_reduce import interpret_map_reduce, iter_chunks, needs_map_reduce, MAX_CHUNKS
+
+class FakeCompletions:
+    def __init__(self):
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        if "Chunk 2 " in request["messages"][1]["content"]:
+            raise RuntimeError("rate limited")
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))]) for word in ("12 ", "devices")])
+
+def test_map_reduce_passes_errors_and_instructions_to_the_reducer(monkeypatch):
+    completions = FakeCompletions()
+    monkeypatch.setattr(ai_chat, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)), raising=False)
+    records = [{"id": str(index), "deviceName": f"PC-{index:05d}", "serialNumber": f"{index * 7919:012d}"} for index in range(3000)]
+
+    answer = interpret_map_reduce("How many devices?", records, budget=2000, model="gpt-4o", instructions="Answer in French.")
+    assert answer == "12 devices"
+    reduce_request = completions.requests[-1]
+    assert "Answer in French." in reduce_request["messages"][0]["content"]
+    assert "(chunk 2 could not be summarised: rate limited)" in reduce_request["messages"][1]["content"]
+    assert all(request["temperature"] <= 0.2 for request in completions.requests)
+
+def devices(count):
+    return [{"id": str(index), "deviceName": f"PC-{index:05d}", "serialNumber": f"{index * 7919:012d}"} for index in range(count)]
+
+def test_one_page_fits_one_prompt_and_large_results_use_few_chunks():
+    assert not needs_map_reduce(devices(1000), model="gpt-4o")
+    chunks = list(iter_chunks(devices(50000), budget=2000, model="gpt-4o"))
+    assert len(chunks) == MAX_CHUNKS
+    assert sum(len(chunk) for chunk in chunks) == 50000
+
+def test_pager_errors_are_raised(monkeypatch):
+    completions = FakeCompletions()
+    monkeypatch.setattr(ai_chat, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)), raising=False)
+
+    def pages():
+        yield from devices(200)
+        raise ValueError("Graph returned 503")
+
+    with pytest.raises(ValueError, match="503"):
+        interpret_map_reduce("How many devices?", pages(), model="gpt-4o")
@@ -0,0 +1,18 @@
+import os
+from utils.metrics import export_metrics, span
+
+def test_metrics_are_only_exported_when_they_changed(tmp_path):
+    with span("graph_call", bytes=10):
+        pass
+    paths = export_metrics(str(tmp_path))
+    modified = os.stat(paths["metrics.json"]).st_mtime_ns
+    os.remove(paths["metrics.prom"])
+
+    export_metrics(str(tmp_path))
+    assert not os.path.exists(paths["metrics.prom"])
+
+    with span("graph_call", bytes=10):
+        pass
+    export_metrics(str(tmp_path))
+    assert os.path.exists(paths["metrics.prom"])
+    assert os.stat(paths["metrics.json"]).st_mtime_ns >= modified
@@ -0,0 +1,30 @@
+from utils.response_compact import compact_records, count_tokens
+
+URL = "https://graph.microsoft.com/v1.0/deviceManagement/managedDevices?$select=deviceName,complianceState,osVersion"
+
+def make_devices(count):
+    return [{"id": f"device-{index:06d}", "deviceName": f"PC-{index:06d}", "complianceState": ["compliant", "noncompliant"][index % 2],
+             "osVersion": f"10.0.{19000 + index}", "managementAgent": "mdm", "serialNumber": f"SN{index * 7919:012d}"}
+            for index in range(count)]
+
+def test_output_stays_within_budget():
+    for count, budget in ((10, 6000), (2000, 2000), (5000, 300)):
+        text = compact_records(make_devices(count), URL, budget=budget)
+        assert count_tokens(text) <= budget
+
+def test_constant_and_dictionary_columns():
+    text = compact_records(make_devices(20), URL)
+    assert "Same for every record: managementAgent=mdm" in text
+    assert "complianceState: 0=compliant, 1=noncompliant" in text
+
+def test_unique_values_are_not_dictionary_encoded():
+    devices = [{"deviceName": f"PC-{index}", "ownerType": "abcdefghij"[index % 10]} for index in range(20)]
+    # Short values: the legend plus the codes would cost more than the values themselves
+    text = compact_records(devices, URL)
+    assert "ownerType:" not in text
+    assert "\ta\n" in text
+
+def test_rows_and_summaries_are_trimmed_to_a_small_budget():
+    text = compact_records(make_devices(500), URL, budget=150)
+    assert count_tokens(text) <= 150
+    assert "deviceName:" in text
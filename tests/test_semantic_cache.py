@@ -0,0 +1,29 @@
+import numpy as np
+from utils.semantic_cache import SemanticCache, literal_tokens
+
+def unit(seed, dimensions=8):
+    return np.random.default_rng(seed).standard_normal(dimensions)
+
+def test_entries_are_kept_per_fingerprint():
+    cache = SemanticCache(capacity=4)
+    cache.insert(unit(1), "prompt-a", "Which devices are not compliant?", {"url": "a"})
+    cache.insert(unit(2), "prompt-b", "Which devices are not compliant?", {"url": "b"})
+    # Switching prompts back and forth clears nothing
+    assert cache.get_exact("which devices are NOT compliant?", "prompt-a")["result"] == {"url": "a"}
+    assert cache.get_exact("Which devices are not compliant?", "prompt-b")["result"] == {"url": "b"}
+    assert cache.lookup(unit(1), "prompt-b", "Which devices are not compliant?") == []
+    assert cache.lookup(unit(1), "prompt-a", "Which devices are not compliant?")[0][0]["result"] == {"url": "a"}
+
+def test_semantic_match_needs_the_same_literals():
+    cache = SemanticCache(capacity=4)
+    cache.insert(unit(1), "prompt", "Which Windows 10 devices are not compliant?", {"url": "10"})
+    assert cache.lookup(unit(1), "prompt", "Which Windows 11 devices are not compliant?") == []
+    assert cache.lookup(unit(1), "prompt", "List the Windows 10 devices that are not compliant")[0][0]["result"] == {"url": "10"}
+
+def test_literal_tokens():
+    assert literal_tokens('Devices of user@contoso.com named "PC-001"') == {"user@contoso.com", "pc-001"}
+    assert literal_tokens("How many devices per operating system?") == set()
+
+def test_capitalisation_is_not_a_literal():
+    assert literal_tokens("list win 11 devices") == {"11"}
+    assert literal_tokens("List all Windows 11 devices") == {"11"}
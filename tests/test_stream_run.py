@@ -0,0 +1,24 @@
+import pytest
+from types import SimpleNamespace
+from utils import ai_chat
+from utils.thread_sync import ThreadSync
+
+class FailingRunStream:
+    def __iter__(self):
+        yield SimpleNamespace(event="thread.run.created", data=SimpleNamespace(id="run_1"))
+        yield SimpleNamespace(event="thread.run.failed", data=SimpleNamespace(last_error="server_error", incomplete_details=None))
+
+    def close(self):
+        pass
+
+def test_messages_count_as_posted_once_the_run_is_created(monkeypatch):
+    runs = SimpleNamespace(create=lambda **run_args: FailingRunStream())
+    monkeypatch.setattr(ai_chat, "client", SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs))), raising=False)
+    thread_sync = ThreadSync("thread_1")
+    question = {"role": "user", "content": "Which devices are not compliant?"}
+
+    with pytest.raises(ValueError):
+        ai_chat.stream_run("thread_1", "asst_1", "", additional_messages=[question],
+                           on_created=lambda: thread_sync.mark_posted(question))
+    # The failed run already added the question to the thread, so the retry must not post it again
+    assert thread_sync.pending([question]) == []
@@ -1,10 +1,15 @@
 import time
+import threading
 import streamlit as st
-from openai import OpenAI
+from openai import OpenAI, BadRequestError
 from utils.oai_assistant import Assistant
 import logging
 from textwrap import dedent
 from utils.write_debug import write_debug
+from utils.doc_search import search_docs, format_snippets
+from utils.thread_sync import get_thread_sync
+from utils.metrics import span, get_metrics
+from utils.headless import has_session, get_env_secret
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -14,6 +19,8 @@ logger = logging.getLogger(__name__)
 #     st.stop()
 
 def get_user_secret(key):
+    if not has_session():
+        return get_env_secret(key)
     if key == 'LLM_MODEL':
         model = st.session_state.LLM_MODEL
         print(f"get_user_secret returning LLM_MODEL: {model}")  # Add this line
@@ -23,16 +30,31 @@ def get_user_secret(key):
         return None
     return st.session_state.user_secrets.get(key)
 
+# Seconds a client status stays valid before the next check
+CLIENT_STATUS_TTL = 300
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    # One client (and its connection pool) per API key for the whole process, not one per rerun
+    return OpenAI(api_key=api_key)
+
 def initialize_client():
     global client
-    client = OpenAI(api_key=st.session_state.user_secrets['LLM_API_KEY'])
+    client = get_openai_client(st.session_state.user_secrets['LLM_API_KEY'])
     if not client:
         st.error("OpenAI client not initialized. Please refresh the page.")
         st.stop()
     else:
         return client
 
-def chat_with_ai(message, history, system_prompt):
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+def get_embedding(client, text, model=EMBEDDING_MODEL):
+    # Same normalisation as utils/llm.py:get_embedding, against the session's OpenAI client
+    text = text.replace("\n", " ")
+    return client.embeddings.create(input=[text], model=model).data[0].embedding
+
+def chat_with_ai(message, history, system_prompt, model=None):
     # if not client:
     #     client = AI_client()
     
@@ -41,30 +63,135 @@ def chat_with_ai(message, history, system_prompt):
         {"role": "user", "content": message}
     ]
     
-    model = st.session_state.get('LLM_MODEL', 'gpt-4o-2024-08-06')
+    # Worker threads have no session state, so they pass the model in
+    model = model or st.session_state.get('LLM_MODEL', 'gpt-4o-2024-08-06')
     print(f"Using model in chat_with_ai: {model}")  # Add this line
     
-    try:
+    with span("chat_completion") as attributes:
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.8,
+                stream=True,
+                max_tokens=1000,
+            )
+
+            partial_response = ""
+            for stream_response in response:
+                if stream_response.choices[0].delta.content is not None:
+                    partial_response += stream_response.choices[0].delta.content
+                    yield [(message, partial_response)]
+
+            attributes["chars"] = len(partial_response)
+            return [(message, partial_response)]
+        except Exception as e:
+            attributes["failed"] = True
+            st.error(f"Error in chat_with_ai: {str(e)}")
+            return [(message, f"Error: {str(e)}")]
+
+def complete(message, system_prompt, model, temperature=0, max_tokens=1000, on_text=None):
+    """One streamed chat completion for background work such as map-reduce.
+
+    Unlike chat_with_ai it raises instead of reporting in the UI, so it can run in worker
+    threads. on_text(partial_text) is called as the answer streams in.
+    """
+    with span("chat_completion") as attributes:
         response = client.chat.completions.create(
             model=model,
-            messages=messages,
-            temperature=0.8,
+            messages=[{"role": "system", "content": system_prompt['content']}, {"role": "user", "content": message}],
+            temperature=temperature,
             stream=True,
-            max_tokens=1000,
+            max_tokens=max_tokens,
         )
+        text = ""
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                text += chunk.choices[0].delta.content
+                if on_text is not None:
+                    on_text(text)
+        attributes["chars"] = len(text)
+        return text
 
-        partial_response = ""
-        for stream_response in response:
-            if stream_response.choices[0].delta.content is not None:
-                partial_response += stream_response.choices[0].delta.content
-                yield [(message, partial_response)]
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action")
+RUN_FAILURE_EVENTS = ("thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete")
 
-        return [(message, partial_response)]
-    except Exception as e:
-        st.error(f"Error in chat_with_ai: {str(e)}")
-        return [(message, f"Error: {str(e)}")]
+def cancel_active_run(thread_id):
+    # A run left behind by an interrupted rerun; nobody is waiting for its answer anymore
+    runs = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
+    if not runs.data or runs.data[0].status not in ACTIVE_RUN_STATUSES:
+        return
+    run = runs.data[0]
+    logger.info(f"Cancelling active run. Run ID: {run.id}")
+    if run.status != "cancelling":
+        run = client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+    while run.status in ACTIVE_RUN_STATUSES + ("cancelling",):
+        time.sleep(0.5)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    logger.info(f"Active run ended. Status: {run.status}")
+
+def stream_run(thread_id, assistant_id, instructions, placeholder=None, additional_messages=None, model=None, additional_instructions=None, on_created=None):
+    """Run the assistant on a thread and consume the run's event stream.
+
+    Text deltas are rendered into the placeholder as they arrive. Returns the full answer.
+    model and additional_instructions apply to this run only, they are not stored on the thread.
+    on_created() is called once the run exists, which is when additional_messages are on the thread.
+    """
+    text = ""
+    run_args = dict(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        tools=[{"type": "file_search"}],
+        instructions=instructions,
+        additional_messages=additional_messages or [],
+        stream=True
+    )
+    if model:
+        run_args["model"] = model
+    if additional_instructions:
+        run_args["additional_instructions"] = additional_instructions
+    started = time.perf_counter()
+    with span("assistant_run") as attributes:
+        try:
+            stream = client.beta.threads.runs.create(**run_args)
+        except BadRequestError as e:
+            if "active run" not in str(e).lower():
+                raise
+            cancel_active_run(thread_id)
+            stream = client.beta.threads.runs.create(**run_args)
+        for event in stream:
+            if event.event == "thread.run.created":
+                logger.info(f"Created run. ID: {event.data.id}")
+                if on_created is not None:
+                    on_created()
+            elif event.event == "thread.message.delta":
+                for part in event.data.delta.content or []:
+                    if part.type == "text" and part.text and part.text.value:
+                        if not text:
+                            get_metrics().observe("assistant_first_token", time.perf_counter() - started)
+                        text += part.text.value
+                if placeholder is not None:
+                    placeholder.markdown(text + "▌")
+            elif event.event == "thread.run.requires_action":
+                # Only file_search is enabled and it runs server side, so there are no tool outputs to submit
+                stream.close()
+                client.beta.threads.runs.cancel(thread_id=thread_id, run_id=event.data.id)
+                raise ValueError(f"Run requires action ({event.data.required_action.type}), which is not supported")
+            elif event.event in RUN_FAILURE_EVENTS:
+                stream.close()
+                raise ValueError(f"Run {event.event.rsplit('.', 1)[1]}. Error: {event.data.last_error or event.data.incomplete_details}")
+            elif event.event == "error":
+                stream.close()
+                raise ValueError(f"Run stream error: {event.data.message}")
+            elif event.event == "thread.run.completed":
+                logger.info(f"Run completed. ID: {event.data.id}")
+                if event.data.usage:
+                    attributes["tokens"] = event.data.usage.total_tokens
+    if placeholder is not None:
+        placeholder.markdown(text)
+    return text
 
-def chat_with_assistant(message: str, run_instructions: str, history: list, thread_id: str = None):
+def chat_with_assistant(message: str, run_instructions: str, history: list, thread_id: str = None, placeholder=None):
     # if not client:
     #     client = AI_client()
     
@@ -73,55 +200,59 @@ def chat_with_assistant(message: str, run_instructions: str, history: list, thre
         logger.info(f"Starting chat_with_assistant. Message: {message[:50]}...")
 
         # Try to use the existing thread_id, create a new one if it doesn't exist
-        try:
-            if thread_id:
-                # Check if the thread exists
-                thread = client.beta.threads.retrieve(thread_id)
-                logger.info(f"Using existing thread. ID: {thread_id}")
-                
-                # Check for any active runs on this thread
-                runs = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
-                if runs.data and runs.data[0].status in ['queued', 'in_progress', 'requires_action']:
-                    logger.info(f"Waiting for active run to complete. Run ID: {runs.data[0].id}")
-                    while runs.data[0].status in ['queued', 'in_progress', 'requires_action']:
-                        time.sleep(1)
-                        runs.data[0] = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=runs.data[0].id)
-                    logger.info(f"Active run completed. Status: {runs.data[0].status}")
-            else:
+        # A thread is only checked once per session, after that it is known to exist
+        if not thread_id or not get_thread_sync(thread_id).verified:
+            try:
+                if thread_id:
+                    # Check if the thread exists
+                    client.beta.threads.retrieve(thread_id)
+                    logger.info(f"Using existing thread. ID: {thread_id}")
+                else:
+                    thread_id = client.beta.threads.create().id
+                    logger.info(f"Created new thread. ID: {thread_id}")
+            except Exception as e:
+                logger.warning(f"Error retrieving thread: {str(e)}. Creating a new one.")
                 thread_id = client.beta.threads.create().id
+                st.session_state.thread_id = thread_id
                 logger.info(f"Created new thread. ID: {thread_id}")
-        except Exception as e:
-            logger.warning(f"Error retrieving thread: {str(e)}. Creating a new one.")
-            thread_id = client.beta.threads.create().id
-            logger.info(f"Created new thread. ID: {thread_id}")
-
-        for msg in history:
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role=msg["role"],
-                content=msg["content"]
-            )
-        logger.info(f"Added {len(history)} messages from history")
+            get_thread_sync(thread_id).verified = True
+        thread_sync = get_thread_sync(thread_id)
 
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message
-        )
-        logger.info("Added user message to thread")
+        # Only the history that isn't on the thread yet goes along with the run
+        pending = thread_sync.pending(history)
+        logger.info(f"Posting {len(pending)} of {len(history)} messages from history")
+
+        # Local retrieval first, so the answer doesn't depend on a hosted file_search round trip.
+        # The snippets go with this run only, so they don't pile up in the thread's history.
+        user_message = {"role": "user", "content": message}
+        snippets = search_docs(message[:1000])
+        doc_instructions = None
+        if snippets:
+            doc_instructions = f"Relevant documentation for the user's latest message:\n{format_snippets(snippets)}"
+            logger.info(f"Added {len(snippets)} documentation snippets to the run")
+        additional_messages = [{"role": msg["role"], "content": msg["content"]} for msg in pending]
+        additional_messages.append(user_message)
 
         if 'IntuneCopilotAssistant' not in st.session_state:
             with st.spinner("Preparing assistant..."):
-                st.session_state.IntuneCopilotAssistant = Assistant(client).retrieve_assistant()
+                with span("retrieve_assistant") as attributes:
+                    assistant = Assistant(client)
+                    st.session_state.IntuneCopilotAssistant = assistant.retrieve_assistant()
+                    attributes["registry_hit"] = assistant.from_registry
             if st.session_state.IntuneCopilotAssistant is None:
                 raise ValueError("Failed to retrieve or create the Intune Copilot assistant")
             logger.info(f"Retrieved assistant. ID: {st.session_state.IntuneCopilotAssistant.id}")
 
         # with st.spinner("Processing your request..."):
-        run = client.beta.threads.runs.create(
+        full_response = stream_run(
             thread_id=thread_id,
             assistant_id=st.session_state.IntuneCopilotAssistant.id,
-            tools=[{"type": "file_search"}],
+            placeholder=placeholder,
+            additional_messages=additional_messages,
+            model=get_user_secret('LLM_MODEL'),
+            additional_instructions=doc_instructions,
+            # A run that fails later still leaves these messages on the thread
+            on_created=lambda: thread_sync.mark_posted(*pending, user_message),
             # instructions="Please be concise and to the point. Stick to the context of Intune and Graph API. Politely decline to answer out of scope questions. It's okay to use humor."
             instructions=run_instructions if run_instructions else 
             """
@@ -138,19 +269,12 @@ def chat_with_assistant(message: str, run_instructions: str, history: list, thre
             - Windows 11 is listed as osVersion "10.0.22000" or higher. The correct query to get Windows 11 devices is `deviceManagement/managedDevices?$filter=operatingSystem eq 'Windows' and startsWith(osVersion, '10.0.22')`.
             """
         )
-        logger.info(f"Created run. ID: {run.id}")
-
-        while run.status != "completed":
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
-            logger.info(f"Run status: {run.status}")
-            if run.status == "failed":
-                raise Exception(f"Run failed. Error: {run.last_error}")
-            time.sleep(0.5)
+        if full_response:
+            thread_sync.mark_posted({"role": "assistant", "content": full_response})
+            return full_response
 
-        messages = client.beta.threads.messages.list(thread_id=thread_id)
+        # Nothing was streamed as text, so read the answer from the thread
+        messages = client.beta.threads.messages.list(thread_id=thread_id, limit=1)
         logger.info(f"Retrieved messages. Count: {len(messages.data)}")
 
         if not messages.data:
@@ -199,13 +323,58 @@ def check_client_status(client):
     try:
         # Attempt a simple API call to check if the client is working
         client.models.list()
-        return "ready" #, "Client is ready and connected."
+        return "ready", "Client is ready and connected."
     except Exception as e:
         return "error", f"Error: {str(e)}"
 
+class ClientHealth:
+    """Cached status of one OpenAI client.
+
+    Reading the status never waits on the network, except for the very first check.
+    Once it is older than the TTL, a background thread checks again and the
+    previous status is handed out meanwhile.
+    """
+
+    def __init__(self, client, ttl=CLIENT_STATUS_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.status = "unknown"
+        self.message = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def get_status(self):
+        if not self.checked_at:
+            self.refresh(wait=True)
+        elif time.time() - self.checked_at > self.ttl:
+            self.refresh()
+        return self.status
+
+    def refresh(self, wait=False):
+        # Concurrent refreshes are coalesced into one check; waiting joins the one already running
+        with self._lock:
+            if self._checker is None or not self._checker.is_alive():
+                self._checker = threading.Thread(target=self._check, daemon=True)
+                self._checker.start()
+            checker = self._checker
+        if wait:
+            checker.join()
+
+    def _check(self):
+        self.status, self.message = check_client_status(self.client)
+        self.checked_at = time.time()
+
+@st.cache_resource(show_spinner=False)
+def get_client_health(api_key):
+    return ClientHealth(get_openai_client(api_key))
+
 # Add this function to check and update client status
-def update_client_status():
-    status = check_client_status(client)
-    st.session_state.client_status = status
-    #st.session_state.client_status_message = message
+def update_client_status(force=False):
+    # Only reads the cached status; force (the refresh button) checks right away
+    health = get_client_health(st.session_state.user_secrets['LLM_API_KEY'])
+    if force:
+        health.refresh(wait=True)
+    st.session_state.client_status = health.get_status()
+    st.session_state.client_status_message = health.message
 
@@ -0,0 +1,240 @@
+import json
+import numpy as np
+from utils.response_compact import flatten_record
+
+METRIC_OPS = ("count", "distinct", "sum", "mean", "min", "max", "median", "percentile")
+FILTER_OPS = ("eq", "ne", "gt", "ge", "lt", "le", "contains", "startswith")
+DEFAULT_LIMIT = 50
+
+# What the LLM fills in; run_analysis does the arithmetic
+ANALYSIS_SPEC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "filters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "column": {"type": "string"},
+                    "op": {"type": "string", "enum": list(FILTER_OPS)},
+                    "value": {"type": ["string", "number", "boolean"]}
+                },
+                "required": ["column", "op", "value"]
+            }
+        },
+        "group_by": {"type": "array", "items": {"type": "string"}, "description": "Columns to group on, empty for one overall row."},
+        "metrics": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "op": {"type": "string", "enum": list(METRIC_OPS)},
+                    "column": {"type": ["string", "null"], "description": "Null for count of records."},
+                    "percentile": {"type": ["number", "null"], "description": "0-100, only for op percentile."}
+                },
+                "required": ["op", "column", "percentile"]
+            }
+        },
+        "sort_by": {"type": ["string", "null"], "description": "A group_by column or a metric label like 'count' or 'mean(bootTimeInMs)'."},
+        "descending": {"type": "boolean"},
+        "limit": {"type": ["integer", "null"]}
+    },
+    "required": ["filters", "group_by", "metrics", "sort_by", "descending", "limit"]
+}
+
+class ColumnStore:
+    """Fetched Graph records as columns: float64 arrays (NaN = missing) for numeric
+    properties, unicode arrays ('' = missing) for everything else."""
+
+    def __init__(self, records):
+        rows = [flatten_record(record) for record in records if isinstance(record, dict)]
+        self.size = len(rows)
+        names = []
+        for row in rows:
+            names.extend(name for name in row if name not in names)
+        self.columns = {}
+        for name in names:
+            values = [row.get(name) for row in rows]
+            present = [value for value in values if value is not None]
+            if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+                self.columns[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            else:
+                self.columns[name] = np.array(["" if value is None else str(value).lower() if isinstance(value, bool) else str(value) for value in values], dtype=str)
+
+    def is_numeric(self, name):
+        return self.columns[name].dtype == np.float64
+
+    def missing(self, name):
+        column = self.columns[name]
+        return np.isnan(column) if self.is_numeric(name) else column == ""
+
+    def column(self, name):
+        # Graph property names are case-insensitive, so are the spec's
+        if name in self.columns:
+            return name
+        for column in self.columns:
+            if column.lower() == name.lower():
+                return column
+        raise ValueError(f"Unknown column '{name}'. Available: {', '.join(self.columns)}")
+
+    def describe(self):
+        # Column list for the LLM prompt
+        return "\n".join(f"- {name} ({'number' if self.is_numeric(name) else 'text'}, {int((~self.missing(name)).sum())} set)" for name in self.columns)
+
+def _filter_mask(store, filters):
+    mask = np.ones(store.size, dtype=bool)
+    for condition in filters or []:
+        name = store.column(condition["column"])
+        op, value = condition["op"], condition["value"]
+        column = store.columns[name]
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter op '{op}'")
+        if store.is_numeric(name) and op not in ("contains", "startswith"):
+            value = float(value)
+        else:
+            column = np.char.lower(column.astype(str))
+            value = str(value).lower()
+        if op == "eq":
+            mask &= column == value
+        elif op == "ne":
+            mask &= column != value
+        elif op == "gt":
+            mask &= column > value
+        elif op == "ge":
+            mask &= column >= value
+        elif op == "lt":
+            mask &= column < value
+        elif op == "le":
+            mask &= column <= value
+        elif op == "contains":
+            mask &= np.char.find(column.astype(str), value) >= 0
+        else:
+            mask &= np.char.startswith(column.astype(str), value)
+    return mask
+
+def _metric_label(metric):
+    if metric["op"] == "count" and not metric.get("column"):
+        return "count"
+    if metric["op"] == "percentile":
+        return f"p{metric.get('percentile') or 50:g}({metric['column']})"
+    return f"{metric['op']}({metric['column']})"
+
+def _grouped_metric(metric, store, mask, group_ids, group_count):
+    op = metric["op"]
+    if op not in METRIC_OPS:
+        raise ValueError(f"Unsupported metric op '{op}'")
+    if op == "count" and not metric.get("column"):
+        return np.bincount(group_ids, minlength=group_count).astype(np.float64)
+    name = store.column(metric["column"])
+    valid = ~store.missing(name)[mask]
+    if op == "count":
+        return np.bincount(group_ids[valid], minlength=group_count).astype(np.float64)
+    column = store.columns[name][mask]
+    if op == "distinct":
+        # Unique (group, value) pairs, then count them per group
+        _, value_codes = np.unique(column[valid], return_inverse=True)
+        pairs = np.unique(np.stack([group_ids[valid], value_codes.ravel()]), axis=1)
+        return np.bincount(pairs[0], minlength=group_count).astype(np.float64)
+    if not store.is_numeric(name):
+        raise ValueError(f"'{op}' needs a numeric column, '{name}' is text")
+
+    counts = np.bincount(group_ids[valid], minlength=group_count)
+    if op in ("sum", "mean"):
+        sums = np.bincount(group_ids[valid], weights=column[valid], minlength=group_count)
+        if op == "sum":
+            return sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    # Order statistics: one sort, then index into each group's slice
+    values = column[valid][np.lexsort((column[valid], group_ids[valid]))]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = np.full(group_count, np.nan)
+    present = counts > 0
+    if op == "min":
+        result[present] = values[starts[present]]
+    elif op == "max":
+        result[present] = values[starts[present] + counts[present] - 1]
+    else:
+        # Linear interpolation between the closest ranks, like np.percentile
+        q = 50 if op == "median" else float(metric.get("percentile") or 50)
+        position = starts[present] + (counts[present] - 1) * q / 100
+        low, high = np.floor(position).astype(np.int64), np.ceil(position).astype(np.int64)
+        result[present] = values[low] + (values[high] - values[low]) * (position - low)
+    return result
+
+def run_analysis(store, spec):
+    """Evaluate an analysis spec (filters, group_by, metrics, sort_by, limit) over a ColumnStore.
+
+    Returns (header, rows, matched) where rows are lists of values in header order.
+    """
+    mask = _filter_mask(store, spec.get("filters"))
+    matched = int(mask.sum())
+    group_by = [store.column(name) for name in spec.get("group_by") or []]
+    metrics = spec.get("metrics") or [{"op": "count", "column": None}]
+
+    if group_by:
+        # One integer code per group value, then unique rows of codes are the groups
+        codes, labels = [], []
+        for name in group_by:
+            column = store.columns[name][mask]
+            uniques, inverse = np.unique(column, return_inverse=True)
+            labels.append(uniques)
+            codes.append(inverse.ravel())
+        group_codes, group_ids = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        group_ids = group_ids.ravel()
+        keys = [labels[position][group_codes[:, position]] for position in range(len(group_by))]
+    else:
+        group_ids = np.zeros(matched, dtype=np.int64)
+        keys = []
+    group_count = len(keys[0]) if keys else 1
+
+    header = group_by + [_metric_label(metric) for metric in metrics]
+    columns = keys + [_grouped_metric(metric, store, mask, group_ids, group_count) for metric in metrics]
+
+    sort_by = spec.get("sort_by") or (header[len(group_by)] if metrics else None)
+    if sort_by:
+        matches = [position for position, label in enumerate(header) if label.lower() == sort_by.lower()]
+        if not matches:
+            raise ValueError(f"Can't sort by '{sort_by}'. Available: {', '.join(header)}")
+        values, descending = columns[matches[0]], spec.get("descending", True)
+        if values.dtype == np.float64:
+            # Groups without a value (NaN) go last in either direction
+            order = np.lexsort((-values if descending else values, np.isnan(values)))
+        else:
+            order = np.argsort(values, kind='stable')
+            if descending:
+                order = order[::-1]
+    else:
+        order = np.arange(group_count)
+    order = order[:spec.get("limit") or DEFAULT_LIMIT]
+
+    rows = [[column[position].item() if hasattr(column[position], 'item') else column[position] for column in columns] for position in order]
+    return header, rows, matched
+
+def format_table(header, rows):
+    def cell(value):
+        if isinstance(value, float):
+            return "" if np.isnan(value) else f"{value:.6g}"
+        return str(value) if value != "" else "(not set)"
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    lines.extend("| " + " | ".join(cell(value) for value in row) + " |" for row in rows)
+    return "\n".join(lines)
+
+def get_analysis_spec(client, question, store, model):
+    # The LLM only decides what to compute; the numbers come from run_analysis
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You turn a question about Microsoft Graph records into an aggregation spec. "
+                                          "Only use the columns listed. Use filters for conditions in the question, group_by for 'per'/'by', "
+                                          "and percentile/median/mean for distributions."},
+            {"role": "user", "content": f"Question: {question}\n\nColumns of the {store.size} records:\n{store.describe()}"}
+        ],
+        timeout=60,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "AnalysisSpec", "description": "An aggregation over fetched Graph records.", "schema": ANALYSIS_SPEC_SCHEMA}
+        }
+    )
+    return json.loads(response.choices[0].message.content)
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.ai_chat import get_user_secret
+from utils.graph_api import get_graph_api_url, iter_graph_pages, GraphAPIError
+from utils.graph_validate import validate_graph_url
+from utils.analytics import ColumnStore, run_analysis, get_analysis_spec
+from utils.metrics import export_metrics
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RECORDS = 10000
+SYSTEM_PROMPT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prompts', 'system_prompt.md')
+
+def load_queries(path):
+    # One JSON object per line: {"question": ..., "id": ..., "url": ..., "max_records": ..., "analysis": spec or "auto"}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            query = json.loads(line)
+            if isinstance(query, str):
+                query = {"question": query}
+            if not query.get("question") and not query.get("url"):
+                raise ValueError(f"Line {line_number}: a query needs a 'question' or a 'url'")
+            query.setdefault("id", line_number)
+            yield query
+
+def run_query(client, query, system_prompt, max_records=DEFAULT_MAX_RECORDS, include_records=True):
+    """NL -> URL -> Graph (-> local aggregation) for one query. Never raises, errors go in the result."""
+    question = query.get("question", "")
+    result = {"id": query["id"], "question": question, "url": query.get("url"), "status": "ok"}
+    timings = {}
+    started = time.perf_counter()
+    try:
+        if not result["url"]:
+            generated = get_graph_api_url(client, question, system_prompt)
+            timings["generate_url"] = round(time.perf_counter() - started, 3)
+            if generated is None:
+                raise ValueError("Could not generate a Graph API URL")
+            result["url"] = generated["url"]
+
+        validation = validate_graph_url(result["url"])
+        if not validation["valid"]:
+            result["status"] = "invalid_url"
+            result["error"] = "; ".join(validation["diagnostics"])
+            return result
+
+        graph_started = time.perf_counter()
+        records, pages = [], 0
+        for page, _ in iter_graph_pages(result["url"], max_records=query.get("max_records") or max_records):
+            records.extend(page)
+            pages += 1
+        timings["graph"] = round(time.perf_counter() - graph_started, 3)
+        result["records"] = len(records)
+        result["pages"] = pages
+
+        spec = query.get("analysis")
+        if spec:
+            analysis_started = time.perf_counter()
+            store = ColumnStore(records)
+            if spec == "auto":
+                spec = get_analysis_spec(client, question, store, get_user_secret('LLM_MODEL'))
+            header, rows, matched = run_analysis(store, spec)
+            result["aggregate"] = {"spec": spec, "header": header, "rows": rows, "matched": matched}
+            timings["analysis"] = round(time.perf_counter() - analysis_started, 3)
+        elif include_records:
+            result["data"] = records
+    except GraphAPIError as e:
+        result["status"] = "error"
+        result["status_code"] = e.status_code
+        result["error"] = str(e)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    finally:
+        timings["total"] = round(time.perf_counter() - started, 3)
+        result["timings"] = timings
+    return result
+
+def run_batch(client, queries, output, system_prompt, workers=DEFAULT_WORKERS, max_records=DEFAULT_MAX_RECORDS, include_records=True):
+    # Results are written as they finish, so a long run can be followed with tail -f
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_query, client, query, system_prompt, max_records, include_records) for query in queries]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            failed += result["status"] != "ok"
+            output.write(json.dumps(result, default=str) + "\n")
+            output.flush()
+            print(f"[{done}/{len(futures)}] {result['id']}: {result['status']} "
+                  f"({result.get('records', 0)} records, {result['timings']['total']}s)", file=sys.stderr)
+    return failed
+
+if __name__ == "__main__":
+    # Headless batch run: python -m utils.batch questions.jsonl results.jsonl [--workers 8]
+    # Secrets (LLM_API_KEY, MS_GRAPH_TENANT_ID, MS_GRAPH_CLIENT_ID, MS_GRAPH_CLIENT_SECRET, LLM_MODEL) come from the environment or .env
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    parser = argparse.ArgumentParser(description="Run natural-language Graph queries from a JSONL file without the UI.")
+    parser.add_argument("input", help="JSONL file, one query per line")
+    parser.add_argument("output", help="JSONL file the results are written to ('-' for stdout)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Queries run at the same time")
+    parser.add_argument("--max-records", type=int, default=DEFAULT_MAX_RECORDS, help="Records fetched per query, unless the query sets max_records")
+    parser.add_argument("--model", help="Overrides LLM_MODEL")
+    parser.add_argument("--summary-only", action="store_true", help="Leave the records out of the output, only counts, aggregates and timings")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.model:
+        os.environ["LLM_MODEL"] = args.model
+    client = OpenAI(api_key=os.environ["LLM_API_KEY"]) if os.environ.get("LLM_API_KEY") else None
+    with open(SYSTEM_PROMPT_FILE, 'r') as file:
+        system_prompt = {"role": "system", "content": file.read().strip()}
+
+    queries = list(load_queries(args.input))
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        failed = run_batch(client, queries, output, system_prompt, args.workers, args.max_records, not args.summary_only)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    export_metrics()
+    print(f"{len(queries) - failed} of {len(queries)} queries succeeded", file=sys.stderr)
+    sys.exit(1 if failed else 0)
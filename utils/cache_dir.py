@@ -0,0 +1,9 @@
+import os
+
+# Everything the app persists locally (delta stores, caches, indexes) lives under .cache
+CACHE_DIR = os.environ.get("INTUNE_NINJA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache'))
+
+def get_cache_path(*parts):
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+import streamlit as st
+from utils.cache_dir import get_cache_path
+from utils.spec_index import SPEC_FILE, get_spec_index, normalize_template
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files', 'graph_api_docs')
+INDEX_DIR = os.path.dirname(get_cache_path("doc_index", "chunks.json"))
+
+logger = logging.getLogger(__name__)
+
+MAX_CHUNK_CHARS = 1500
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Weight of BM25 against embedding similarity in hybrid search
+HYBRID_ALPHA = 0.5
+
+STOPWORDS = {"the", "a", "an", "and", "or", "of", "to", "in", "is", "are", "for", "on", "with", "by", "be",
+             "this", "that", "it", "as", "at", "from", "can", "you", "your", "if", "not", "use", "all"}
+
+def tokenize(text):
+    # Identifiers like managedDevices also index as 'managed' and 'devices'
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9]+", text):
+        lowered = word.lower()
+        if lowered not in STOPWORDS:
+            tokens.append(lowered)
+        parts = re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+", word)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts if part.lower() not in STOPWORDS)
+    return tokens
+
+def _chunk_markdown(name, text):
+    # Drop the front matter, then cut on headings and keep sections under MAX_CHUNK_CHARS
+    text = re.sub(r"\A---\n.*?\n---\n", "", text, flags=re.DOTALL)
+    chunks = []
+    title = name
+    for section in re.split(r"\n(?=#{1,3} )", text):
+        heading = section.split('\n', 1)[0].lstrip('#').strip() if section.startswith('#') else title
+        if section.startswith('# '):
+            title = heading
+        current = ""
+        for paragraph in section.split('\n\n'):
+            if current and len(current) + len(paragraph) > MAX_CHUNK_CHARS:
+                chunks.append({"source": name, "title": heading, "text": current.strip()})
+                current = ""
+            current += paragraph + "\n\n"
+        if current.strip():
+            chunks.append({"source": name, "title": heading, "text": current.strip()})
+    return chunks
+
+def _chunk_operations(spec_file):
+    # One chunk per OpenAPI operation, with the properties of the entity it returns
+    with open(spec_file, 'r', encoding='utf-8') as file:
+        spec = json.load(file)
+    index = get_spec_index()
+    chunks = []
+    for raw_path, item in spec.get('paths', {}).items():
+        operation_info = index.get_path(normalize_template(raw_path)) or {}
+        properties = index.get_properties(operation_info["entity"]) if operation_info.get("entity") else {}
+        for method, operation in item.items():
+            if method not in ('get', 'post', 'patch', 'put', 'delete'):
+                continue
+            lines = [f"{method.upper()} {raw_path}", operation.get('summary', ''), operation.get('description', '')]
+            if method == 'get' and operation_info.get("query_options"):
+                lines.append(f"Query options: {', '.join(operation_info['query_options'])}")
+            if method == 'get' and properties:
+                lines.append(f"Properties of {operation_info['entity']}: {', '.join(sorted(properties))}")
+            chunks.append({"source": os.path.basename(spec_file), "title": f"{method.upper()} {raw_path}", "text": '\n'.join(line for line in lines if line)})
+    return chunks
+
+def _sources_hash():
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(DOCS_DIR)):
+        if name.endswith('.md') or os.path.join(DOCS_DIR, name) == SPEC_FILE:
+            with open(os.path.join(DOCS_DIR, name), 'rb') as file:
+                digest.update(name.encode() + file.read())
+    return digest.hexdigest()
+
+def build_doc_index(client=None, embedding_model=None):
+    """Chunk the docs, then write a BM25 index (and optionally embeddings) as .npy files.
+
+    Postings are stored term-major in CSR form (indptr, doc ids, term frequencies) so
+    they can be memory-mapped and scored with a handful of vectorised numpy operations.
+    """
+    chunks = []
+    for name in sorted(os.listdir(DOCS_DIR)):
+        if name.endswith('.md'):
+            with open(os.path.join(DOCS_DIR, name), 'r', encoding='utf-8') as file:
+                chunks.extend(_chunk_markdown(name, file.read()))
+    chunks.extend(_chunk_operations(SPEC_FILE))
+
+    vocabulary = {}
+    postings = {}
+    doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+    for doc_id, chunk in enumerate(chunks):
+        tokens = tokenize(f"{chunk['title']} {chunk['text']}")
+        doc_lengths[doc_id] = len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term_id = vocabulary.setdefault(token, len(vocabulary))
+            postings.setdefault(term_id, []).append((doc_id, count))
+
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    for term_id in range(len(vocabulary)):
+        indptr[term_id + 1] = indptr[term_id] + len(postings[term_id])
+    doc_ids = np.fromiter((doc_id for term_id in range(len(vocabulary)) for doc_id, _ in postings[term_id]), dtype=np.int32, count=indptr[-1])
+    term_freqs = np.fromiter((count for term_id in range(len(vocabulary)) for _, count in postings[term_id]), dtype=np.float32, count=indptr[-1])
+    document_freqs = np.diff(indptr).astype(np.float32)
+    idf = np.log(1 + (len(chunks) - document_freqs + 0.5) / (document_freqs + 0.5)).astype(np.float32)
+
+    np.save(os.path.join(INDEX_DIR, "indptr.npy"), indptr)
+    np.save(os.path.join(INDEX_DIR, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(INDEX_DIR, "term_freqs.npy"), term_freqs)
+    np.save(os.path.join(INDEX_DIR, "doc_lengths.npy"), doc_lengths)
+    np.save(os.path.join(INDEX_DIR, "idf.npy"), idf)
+
+    meta = {"sources_hash": _sources_hash(), "chunks": len(chunks), "embedding_model": None}
+    embeddings_file = os.path.join(INDEX_DIR, "embeddings.npy")
+    if client is not None and embedding_model:
+        vectors = []
+        for start in range(0, len(chunks), 256):
+            batch = [f"{chunk['title']}\n{chunk['text']}".replace("\n", " ") for chunk in chunks[start:start + 256]]
+            vectors.extend(item.embedding for item in client.embeddings.create(input=batch, model=embedding_model).data)
+        embeddings = np.asarray(vectors, dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.save(embeddings_file, embeddings)
+        meta["embedding_model"] = embedding_model
+    elif os.path.exists(embeddings_file):
+        os.remove(embeddings_file)
+
+    with open(os.path.join(INDEX_DIR, "chunks.json"), 'w', encoding='utf-8') as file:
+        json.dump(chunks, file)
+    with open(os.path.join(INDEX_DIR, "vocabulary.json"), 'w', encoding='utf-8') as file:
+        json.dump(vocabulary, file)
+    # Written last: its presence marks a complete build
+    with open(os.path.join(INDEX_DIR, "meta.json"), 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+    return meta
+
+class DocIndex:
+    def __init__(self):
+        with open(os.path.join(INDEX_DIR, "meta.json"), 'r', encoding='utf-8') as file:
+            self.meta = json.load(file)
+        with open(os.path.join(INDEX_DIR, "chunks.json"), 'r', encoding='utf-8') as file:
+            self.chunks = json.load(file)
+        with open(os.path.join(INDEX_DIR, "vocabulary.json"), 'r', encoding='utf-8') as file:
+            self.vocabulary = json.load(file)
+        load = lambda name: np.load(os.path.join(INDEX_DIR, name), mmap_mode='r')
+        self.indptr = load("indptr.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.term_freqs = load("term_freqs.npy")
+        self.doc_lengths = load("doc_lengths.npy")
+        self.idf = load("idf.npy")
+        self.average_length = float(np.mean(self.doc_lengths)) if len(self.doc_lengths) else 0.0
+        self.embeddings = load("embeddings.npy") if self.meta.get("embedding_model") else None
+
+    @property
+    def embedding_model(self):
+        return self.meta.get("embedding_model")
+
+    def bm25(self, query):
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.average_length)
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=5, query_vector=None):
+        scores = self.bm25(query)
+        if self.embeddings is not None and query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            similarity = self.embeddings @ vector
+            # Min-max both signals so they can be blended
+            scale = lambda values: (values - values.min()) / ((values.max() - values.min()) or 1.0)
+            scores = HYBRID_ALPHA * scale(scores) + (1 - HYBRID_ALPHA) * scale(similarity)
+        k = min(k, len(scores))
+        if k == 0 or not scores.any():
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.chunks[doc_id], score=float(scores[doc_id])) for doc_id in top if scores[doc_id] > 0]
+
+_build_lock = threading.Lock()
+
+def is_doc_index_current():
+    try:
+        with open(os.path.join(INDEX_DIR, "meta.json"), 'r', encoding='utf-8') as file:
+            return json.load(file).get("sources_hash") == _sources_hash()
+    except (OSError, ValueError):
+        return False
+
+@st.cache_resource(show_spinner=False)
+def get_doc_index():
+    # BM25-only builds take well under a second; embeddings come from the build step
+    with _build_lock:
+        if not is_doc_index_current():
+            build_doc_index()
+    return DocIndex()
+
+def format_snippets(results, max_chars=600):
+    return "\n\n".join(f"[{result['source']} - {result['title']}]\n{result['text'][:max_chars]}" for result in results)
+
+def search_docs(query, k=4, query_vector=None):
+    try:
+        return get_doc_index().search(query, k=k, query_vector=query_vector)
+    except Exception as e:
+        # Retrieval only adds context, a broken index must not break the request
+        logger.warning(f"Local doc search failed: {str(e)}")
+        return []
+
+if __name__ == "__main__":
+    # Build step: python -m utils.doc_search [--embed]
+    # --embed also stores chunk embeddings, using LLM_API_KEY from the environment or .env
+    client = None
+    embedding_model = None
+    if "--embed" in sys.argv:
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        from utils.ai_chat import EMBEDDING_MODEL
+        load_dotenv()
+        client = OpenAI(api_key=os.environ["LLM_API_KEY"])
+        embedding_model = EMBEDDING_MODEL
+    meta = build_doc_index(client, embedding_model)
+    print(f"Indexed {meta['chunks']} chunks into {INDEX_DIR} (embeddings: {meta['embedding_model'] or 'none'})")
@@ -1,14 +1,38 @@
 import streamlit as st
-import requests
 import json
+import requests
 from requests.exceptions import HTTPError
-from utils.ai_chat import get_user_secret
+import copy
+import threading
+from utils.ai_chat import get_user_secret, get_embedding, EMBEDDING_MODEL
 from utils.write_debug import write_debug
+from utils.graph_token import get_token_provider
+from utils.graph_session import get_graph_session, DEFAULT_POOL_SIZE
+from utils.graph_throttle import get_graph_scheduler
+from utils.graph_cache import get_response_cache
+from utils.graph_validate import validate_graph_url
+from utils.semantic_cache import get_semantic_cache, cache_fingerprint
+from utils.doc_search import search_docs, format_snippets, get_doc_index
+from utils.metrics import span
+from utils.headless import has_session
 
 global client
 
+class GraphAPIError(ValueError):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _wire_bytes(response):
+    # Bytes as received, before gzip decoding: Content-Length, else what urllib3 read off the socket
+    try:
+        return int(response.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        raw = getattr(response, 'raw', None)
+        return raw.tell() if hasattr(raw, 'tell') else len(response.content or b"")
+
 class MSGraphAPI:
-    def __init__(self):
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
         write_debug(":clock1: Calling MS Graph API...")
         self.client_id = get_user_secret('MS_GRAPH_CLIENT_ID')
         self.client_secret = get_user_secret('MS_GRAPH_CLIENT_SECRET')
@@ -20,32 +44,17 @@ class MSGraphAPI:
 
         self.base_url = "https://graph.microsoft.com/"
         self.version = any(version for version in ['v1.0', 'beta'])
-        if 'graph_token' not in st.session_state:
-            write_debug(":clock130: Attempting to get access token...")
-            self.token = self.get_access_token()
-            st.session_state.graph_token = self.token
-        else:
-            write_debug(":clock130: Using existing access token...")
-            self.token = st.session_state.graph_token
+        # The token provider is shared by all sessions, so most of them never hit the login endpoint
+        write_debug(":clock130: Getting access token...")
+        self.token_provider = get_token_provider(self.tenant_id, self.client_id, self.client_secret)
+        self.token = self.get_access_token()
+        self.session = get_graph_session(self.tenant_id, pool_size)
+        self.scheduler = get_graph_scheduler(self.tenant_id)
 
     def get_access_token(self):
-        url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        body = {
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "scope": "https://graph.microsoft.com/.default",
-            "grant_type": "client_credentials"
-        }
         try:
-            write_debug(f":satellite: Sending request to {url}")
-            response = requests.post(url, headers=headers, data=body)
-            write_debug(f":satellite: Response status code: {response.status_code}")
-            response.raise_for_status()
-            token = response.json().get("access_token")
-            write_debug(":white_check_mark: Successfully obtained access token")
+            token = self.token_provider.get_token()
+            write_debug(":white_check_mark: Access token ready")
             return token
         except HTTPError as e:
             st.error(f"HTTP Error: {e}")
@@ -58,38 +67,88 @@ class MSGraphAPI:
             st.error(f"Error initializing Microsoft Graph client: {str(e)}. Please check your Microsoft Graph credentials.")
             raise ValueError(f"Error initializing Microsoft Graph client: {str(e)}. Please check your Microsoft Graph credentials.")
 
-    def call_api(self, request, method='GET', data=None):
+    def call_api(self, request, method='GET', data=None, use_cache=False):
+        with span("call_api", pages=1) as attributes:
+            return self._call_api(request, method, data, use_cache, attributes)
+
+    def _call_api(self, request, method, data, use_cache, attributes):
         url = f"{request}" if request.startswith(self.base_url) else f"{self.base_url}/{request}"
+        # Ask the provider on every call, it refreshes the token before it expires
+        self.token = self.token_provider.get_token()
         headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
         }
+
+        cache = get_response_cache() if use_cache and method == 'GET' else None
+        cached = cache.get(self.tenant_id, url) if cache else None
+        if cached and cached.fresh:
+            write_debug(":zap: Served from the response cache")
+            attributes["cache_hit"] = True
+            return cached.body
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+
+        def send(fresh_connection):
+            # A plain requests call opens a new connection instead of reusing a pooled one
+            sender = requests if fresh_connection else self.session
+            return sender.request(method, url, headers=headers, json=data if method in ('POST', 'PATCH') else None)
+
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data)
-            elif method == 'PATCH':
-                response = requests.patch(url, headers=headers, json=data)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
-            else:
+            if method not in ('GET', 'POST', 'PATCH', 'DELETE'):
                 raise ValueError("Unsupported HTTP method")
 
+            response = self.scheduler.submit(send)
+            attributes["bytes"] = _wire_bytes(response)
+            if cached and response.status_code == 304:
+                write_debug(":zap: Cached response revalidated (304 Not Modified)")
+                cache.revalidated(self.tenant_id, url)
+                attributes["cache_revalidated"] = True
+                return cached.body
+            attributes["cache_miss"] = cache is not None
             response.raise_for_status()
-            return response.json()
+            if response.status_code == 204 or not response.content:
+                return {}
+            body = response.json()
+            attributes["records"] = len(body.get('value') or []) if isinstance(body, dict) else 0
+            if cache:
+                cache.put(self.tenant_id, url, body, response.headers.get('ETag'))
+            return body
         except HTTPError as e:
             if e.response.status_code == 400:
-                raise ValueError("Error 400: Bad Request. Please check your request parameters and try again.\n\nFull Error: " + str(e))
-            raise ValueError(f"HTTP Error: {e}")
+                raise GraphAPIError("Error 400: Bad Request. Please check your request parameters and try again.\n\nFull Error: " + str(e), e.response.status_code)
+            raise GraphAPIError(f"HTTP Error: {e}", e.response.status_code)
         except Exception as e:
             raise ValueError(f"Error calling Microsoft Graph API: {str(e)}")
 
-def call_graph_api(api_url):
-    ms_graph_api = MSGraphAPI()
+# Headless runs share one client per set of Graph credentials, since there is no session to keep it in
+_headless_clients = {}
+_headless_clients_lock = threading.Lock()
+
+def get_ms_graph_api():
+    # Reuse the client for the whole session unless the Graph secrets change
+    credentials = tuple(get_user_secret(key) for key in ['MS_GRAPH_TENANT_ID', 'MS_GRAPH_CLIENT_ID', 'MS_GRAPH_CLIENT_SECRET'])
+    if not has_session():
+        with _headless_clients_lock:
+            if credentials not in _headless_clients:
+                ms_graph_api = MSGraphAPI()
+                if not hasattr(ms_graph_api, 'session'):
+                    raise ValueError("Set MS_GRAPH_TENANT_ID, MS_GRAPH_CLIENT_ID and MS_GRAPH_CLIENT_SECRET in the environment or .env")
+                _headless_clients[credentials] = ms_graph_api
+            return _headless_clients[credentials]
+    if st.session_state.get('ms_graph_api_credentials') != credentials or 'ms_graph_api' not in st.session_state:
+        ms_graph_api = MSGraphAPI()
+        if not hasattr(ms_graph_api, 'session'):
+            return ms_graph_api
+        st.session_state.ms_graph_api = ms_graph_api
+        st.session_state.ms_graph_api_credentials = credentials
+    return st.session_state.ms_graph_api
+
+def call_graph_api(api_url, use_cache=True):
+    ms_graph_api = get_ms_graph_api()
     write_debug(f":satellite: Calling API: {api_url}")
     try:
-        api_response = ms_graph_api.call_api(api_url)
+        api_response = ms_graph_api.call_api(api_url, use_cache=use_cache)
     except Exception as e:
         write_debug(f":warning: Error calling API: {str(e)}")
         return f"Error calling API: {str(e)}"
@@ -106,7 +165,7 @@ def call_graph_api(api_url):
     return json.dumps(result, indent=2)
 
 def get_next_batch(next_link):
-    ms_graph_api = MSGraphAPI()
+    ms_graph_api = get_ms_graph_api()
     try:
         write_debug(f":satellite: Calling next batch: {next_link}")
         api_response = ms_graph_api.call_api(next_link)
@@ -125,7 +184,48 @@ def get_next_batch(next_link):
         write_debug(f":warning: Error retrieving next batch: {str(e)}")
         return f"Error retrieving next batch: {str(e)}"
 
-def get_graph_api_url(client, message, system_prompt):
+def iter_graph_pages(api_url, max_pages=None, max_records=None):
+    # Follow @odata.nextLink page by page, only one page is held in memory at a time.
+    # Yields (records, next_link) so callers can stop and resume from next_link later.
+    ms_graph_api = get_ms_graph_api()
+    next_link = api_url
+    pages = 0
+    records = 0
+    while next_link:
+        write_debug(f":satellite: Fetching page {pages + 1}: {next_link}")
+        api_response = ms_graph_api.call_api(next_link)
+        if 'value' in api_response:
+            page = api_response['value']
+        else:
+            # Single entity responses have no 'value' collection
+            page = [{k: v for k, v in api_response.items() if not k.startswith('@odata')}]
+        next_link = api_response.get('@odata.nextLink')
+
+        if max_records is not None and records + len(page) > max_records:
+            # A trimmed page can't be resumed from its nextLink without skipping records
+            page = page[:max_records - records]
+            next_link = None
+
+        pages += 1
+        records += len(page)
+        yield page, next_link
+
+        if (max_pages is not None and pages >= max_pages) or (max_records is not None and records >= max_records):
+            break
+    write_debug(f":white_check_mark: Fetched {records} records in {pages} pages")
+
+def iter_graph_records(api_url, max_pages=None, max_records=None):
+    for page, _ in iter_graph_pages(api_url, max_pages=max_pages, max_records=max_records):
+        yield from page
+
+def get_graph_api_url(client, message, system_prompt, use_semantic_cache=True):
+    with span("get_graph_api_url") as attributes:
+        result = _get_graph_api_url(client, message, system_prompt, use_semantic_cache, attributes)
+        # Errors are reported through write_debug and a None result, so count them here
+        attributes["failed"] = result is None
+        return result
+
+def _get_graph_api_url(client, message, system_prompt, use_semantic_cache, attributes):
     messages = [
         {"role": "system", "content": system_prompt["content"]},
         {"role": "user", "content": message}
@@ -135,6 +235,35 @@ def get_graph_api_url(client, message, system_prompt):
         model = get_user_secret('LLM_MODEL')
         # print(f"Using model in get_graph_api_url: {model}")  # Debug print
 
+        # Near-identical queries get the URL generated earlier instead of a new completion
+        semantic_cache = get_semantic_cache() if use_semantic_cache else None
+        fingerprint = cache_fingerprint(system_prompt["content"], model, EMBEDDING_MODEL)
+        query_vector = None
+        if semantic_cache:
+            cached = semantic_cache.get_exact(message, fingerprint)
+            if cached is None:
+                try:
+                    query_vector = get_embedding(client, message)
+                    matches = semantic_cache.lookup(query_vector, fingerprint, message)
+                    if matches:
+                        cached, score = matches[0]
+                        write_debug(f":zap: Semantic cache hit ({score:.3f}) for \"{cached['query']}\"")
+                except Exception as e:
+                    write_debug(f":warning: Semantic cache lookup failed: {str(e)}")
+            else:
+                write_debug(f":zap: Semantic cache hit (exact) for \"{cached['query']}\"")
+            attributes["cache_hit"] = cached is not None
+            if cached:
+                return copy.deepcopy(cached["result"])
+
+        # Ground the completion in the local docs; the query embedding is reused when the index has matching vectors
+        doc_vector = query_vector if query_vector is not None and get_doc_index().embedding_model == EMBEDDING_MODEL else None
+        snippets = search_docs(message, query_vector=doc_vector)
+        if snippets:
+            write_debug(f":books: Added {len(snippets)} documentation snippets to the prompt")
+            attributes["doc_snippets"] = len(snippets)
+            messages[0]["content"] += f"\n\nRelevant documentation:\n{format_snippets(snippets)}"
+
         response = client.chat.completions.create(
             model=model,
             messages=messages,
@@ -161,6 +290,8 @@ def get_graph_api_url(client, message, system_prompt):
             }
         )
 
+        if response.usage:
+            attributes["tokens"] = response.usage.total_tokens
         content = response.choices[0].message.content
         content_json = json.loads(content)
 
@@ -172,7 +303,11 @@ def get_graph_api_url(client, message, system_prompt):
 
         write_debug(f"Generated URL: {url}")
         write_debug(f"Generated URL in JSON: {content_json}")
-        return {"url": url, "json": content_json}
+        result = {"url": url, "json": content_json}
+        # Only URLs that pass local validation are worth handing out again
+        if query_vector is not None and validate_graph_url(url)["valid"]:
+            semantic_cache.insert(query_vector, fingerprint, message, copy.deepcopy(result))
+        return result
     except Exception as e:
         write_debug(f"Error in get_graph_api_url: {str(e)}")
         return None
\ No newline at end of file
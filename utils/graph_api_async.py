@@ -0,0 +1,129 @@
+import asyncio
+import httpx
+from utils.ai_chat import get_user_secret
+from utils.write_debug import write_debug
+from utils.graph_token import get_token_provider
+from utils.graph_session import DEFAULT_POOL_SIZE
+from utils.graph_throttle import get_graph_scheduler
+from utils.graph_api import GraphAPIError
+
+DEFAULT_MAX_CONCURRENCY = 8
+CLIENT_HEADERS = {"Accept-Encoding": "gzip, deflate", "Accept": "application/json"}
+CLIENT_TIMEOUT = 60
+
+class AsyncMSGraphAPI:
+    """asyncio counterpart of MSGraphAPI with the same call_api and paging surface.
+
+    Use it as an async context manager so the httpx client is bound to the running loop.
+    Requests share the tenant's token provider and throttling scheduler (rate, in-flight
+    slots and retries) with MSGraphAPI.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, pool_size=DEFAULT_POOL_SIZE):
+        self.client_id = get_user_secret('MS_GRAPH_CLIENT_ID')
+        self.client_secret = get_user_secret('MS_GRAPH_CLIENT_SECRET')
+        self.tenant_id = get_user_secret('MS_GRAPH_TENANT_ID')
+
+        if not all([self.client_id, self.client_secret, self.tenant_id]):
+            raise ValueError("One or more required secrets are missing. Please check your configuration.")
+
+        self.base_url = "https://graph.microsoft.com/"
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.token_provider = get_token_provider(self.tenant_id, self.client_id, self.client_secret)
+        self.scheduler = get_graph_scheduler(self.tenant_id)
+        self.client = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            headers=CLIENT_HEADERS,
+            timeout=CLIENT_TIMEOUT
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.client = None
+
+    async def call_api(self, request, method='GET', data=None):
+        url = f"{request}" if request.startswith(self.base_url) else f"{self.base_url}/{request}"
+        # The provider only blocks when the token has actually expired
+        token = await asyncio.to_thread(self.token_provider.get_token)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+        async def send(fresh_connection):
+            body = data if method in ('POST', 'PATCH') else None
+            async with self.semaphore:
+                if not fresh_connection:
+                    return await self.client.request(method, url, headers=headers, json=body)
+                # Graph asks for 503 retries to go over a new connection rather than a pooled one
+                async with httpx.AsyncClient(headers=CLIENT_HEADERS, timeout=CLIENT_TIMEOUT) as client:
+                    return await client.request(method, url, headers=headers, json=body)
+
+        try:
+            response = await self.scheduler.submit_async(send)
+        except httpx.HTTPError as e:
+            raise ValueError(f"Error calling Microsoft Graph API: {str(e)}")
+
+        if response.status_code == 400:
+            raise GraphAPIError(f"Error 400: Bad Request. Please check your request parameters and try again.\n\nFull Error: {response.text}", 400)
+        if response.is_error:
+            raise GraphAPIError(f"HTTP Error: {response.status_code} {response.reason_phrase} for url: {url}", response.status_code)
+        if response.status_code == 204 or not response.content:
+            return {}
+        return response.json()
+
+    async def iter_pages(self, api_url, max_pages=None, max_records=None):
+        # Same contract as graph_api.iter_graph_pages: yields (records, next_link)
+        next_link = api_url
+        pages = 0
+        records = 0
+        while next_link:
+            api_response = await self.call_api(next_link)
+            if 'value' in api_response:
+                page = api_response['value']
+            else:
+                page = [{k: v for k, v in api_response.items() if not k.startswith('@odata')}]
+            next_link = api_response.get('@odata.nextLink')
+
+            if max_records is not None and records + len(page) > max_records:
+                page = page[:max_records - records]
+                next_link = None
+
+            pages += 1
+            records += len(page)
+            yield page, next_link
+
+            if (max_pages is not None and pages >= max_pages) or (max_records is not None and records >= max_records):
+                break
+
+    async def get_all(self, api_url, max_pages=None, max_records=None):
+        records = []
+        async for page, _ in self.iter_pages(api_url, max_pages=max_pages, max_records=max_records):
+            records.extend(page)
+        return records
+
+    async def gather(self, urls, all_pages=False, max_records=None):
+        # Failed requests come back as exceptions in their slot instead of cancelling the rest
+        if all_pages:
+            tasks = [self.get_all(url, max_records=max_records) for url in urls]
+        else:
+            tasks = [self.call_api(url) for url in urls]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+def fetch_many(urls, all_pages=False, max_records=None, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    # Sync facade for the Streamlit script: total time is about that of the slowest request
+    async def run():
+        async with AsyncMSGraphAPI(max_concurrency=max_concurrency) as api:
+            return await api.gather(urls, all_pages=all_pages, max_records=max_records)
+
+    write_debug(f":satellite: Fetching {len(urls)} Graph requests concurrently")
+    results = asyncio.run(run())
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    write_debug(f":white_check_mark: {len(urls) - failed} of {len(urls)} concurrent requests succeeded")
+    return results
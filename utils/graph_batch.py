@@ -0,0 +1,188 @@
+import time
+from utils.write_debug import write_debug
+from utils.graph_throttle import parse_retry_after
+
+# Graph accepts at most 20 sub-requests per $batch call
+MAX_BATCH_SIZE = 20
+MAX_BATCH_RETRIES = 3
+# Status recorded for a sub-request Graph left out of the $batch response
+MISSING_RESPONSE_STATUS = 502
+
+class BatchResponse:
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def error_message(self):
+        if isinstance(self.body, dict) and 'error' in self.body:
+            return f"{self.body['error'].get('code')}: {self.body['error'].get('message')}"
+        return str(self.body)
+
+def _missing_response(request_id):
+    return BatchResponse(MISSING_RESPONSE_STATUS, {"error": {"code": "missingBatchResponse", "message": f"No response for batch request {request_id}"}})
+
+class GraphBatch:
+    """Queue Graph requests and send them as JSON $batch envelopes.
+
+    add() returns a request id, flush() sends everything that is queued and result()
+    hands the body of one sub-request back to its caller. Requests linked with depends_on
+    are always kept in the same envelope, as Graph requires.
+    """
+
+    def __init__(self, ms_graph_api, version="v1.0"):
+        self.ms_graph_api = ms_graph_api
+        self.version = version
+        self.batch_url = f"{ms_graph_api.base_url}{version}/$batch"
+        self.pending = []
+        self.responses = {}
+        self._next_id = 1
+
+    def add(self, url, method="GET", body=None, depends_on=None):
+        request_id = str(self._next_id)
+        self._next_id += 1
+
+        request = {"id": request_id, "method": method, "url": self._relative_url(url)}
+        if body is not None:
+            request["body"] = body
+            request["headers"] = {"Content-Type": "application/json"}
+        if depends_on:
+            request["dependsOn"] = [str(dependency) for dependency in depends_on]
+        self.pending.append(request)
+        return request_id
+
+    def _relative_url(self, url):
+        # Sub-request URLs are relative to the version of the $batch endpoint
+        prefix = f"{self.ms_graph_api.base_url}{self.version}"
+        if url.startswith(self.ms_graph_api.base_url):
+            if not url.startswith(prefix + "/"):
+                raise ValueError(f"Cannot add {url} to a {self.version} batch")
+            url = url[len(prefix):]
+        return "/" + url.lstrip("/")
+
+    def _envelopes(self, requests):
+        # Group requests that are linked through dependsOn, then pack the groups into envelopes
+        group_of = {}
+        groups = []
+        for request in requests:
+            linked = {group_of[dependency] for dependency in request.get("dependsOn", []) if dependency in group_of}
+            if linked:
+                target = min(linked)
+                for index in linked - {target}:
+                    for moved in groups[index]:
+                        group_of[moved["id"]] = target
+                    groups[target].extend(groups[index])
+                    groups[index] = []
+            else:
+                target = len(groups)
+                groups.append([])
+            groups[target].append(request)
+            group_of[request["id"]] = target
+
+        envelope = []
+        for group in groups:
+            if not group:
+                continue
+            if len(group) > MAX_BATCH_SIZE:
+                raise ValueError(f"A dependsOn chain of {len(group)} requests does not fit in one $batch envelope of {MAX_BATCH_SIZE}")
+            if len(envelope) + len(group) > MAX_BATCH_SIZE:
+                yield envelope
+                envelope = []
+            envelope.extend(group)
+        if envelope:
+            yield envelope
+
+    def flush(self):
+        queue = self.pending
+        self.pending = []
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            throttled = []
+            retry_after = 0
+            for envelope in self._envelopes(queue):
+                write_debug(f":package: Sending $batch with {len(envelope)} requests")
+                response = self.ms_graph_api.call_api(self.batch_url, method="POST", data={"requests": envelope})
+                by_id = {request["id"]: request for request in envelope}
+                results = {item["id"]: BatchResponse(int(item.get("status", 0)), item.get("body"), item.get("headers")) for item in response.get("responses", [])}
+                retry_ids = set()
+                if attempt < MAX_BATCH_RETRIES:
+                    retry_ids = {request_id for request_id, result in results.items() if result.status == 429}
+                    # 424 means a dependency failed: retry it only when that dependency was throttled
+                    for request_id in sorted(results, key=int):
+                        if results[request_id].status == 424 and retry_ids.intersection(by_id[request_id].get("dependsOn", [])):
+                            retry_ids.add(request_id)
+                for request_id, request in by_id.items():
+                    result = results.get(request_id) or _missing_response(request_id)
+                    if request_id in retry_ids:
+                        throttled.append(request)
+                        delay = parse_retry_after(result.headers.get("Retry-After"))
+                        retry_after = max(retry_after, 1 if delay is None else delay)
+                    else:
+                        self.responses[request_id] = result
+            if not throttled:
+                break
+            write_debug(f":hourglass: {len(throttled)} batched requests throttled, retrying in {retry_after}s")
+            time.sleep(retry_after)
+            # Dependencies that already succeeded are not in the retry, so Graph must not wait for them
+            retry_ids = {request["id"] for request in throttled}
+            queue = []
+            for request in sorted(throttled, key=lambda request: int(request["id"])):
+                depends_on = [dependency for dependency in request.get("dependsOn", []) if dependency in retry_ids]
+                request = {key: value for key, value in request.items() if key != "dependsOn"}
+                if depends_on:
+                    request["dependsOn"] = depends_on
+                queue.append(request)
+        return self.responses
+
+    def response(self, request_id):
+        request_id = str(request_id)
+        if request_id not in self.responses:
+            self.flush()
+        return self.responses.setdefault(request_id, _missing_response(request_id))
+
+    def result(self, request_id):
+        response = self.response(request_id)
+        if not response.ok:
+            raise ValueError(f"Error {response.status}: {response.error_message()}")
+        return response.body
+
+def batch_get(ms_graph_api, urls, version="v1.0"):
+    # Fan out GET requests (for example one per device) in as few round trips as possible
+    batch = GraphBatch(ms_graph_api, version)
+    request_ids = [batch.add(url) for url in urls]
+    batch.flush()
+    return [batch.response(request_id) for request_id in request_ids]
+
+def lookup_per_record(ms_graph_api, records, endpoint, path, version="v1.0", fetch=None):
+    """GET {endpoint}/{id}/{path} for every record, e.g. the users of each device.
+
+    The requests go out in $batch envelopes, which only return the first page of each
+    result. fetch(urls) can be used instead, returning per URL the list of records or an
+    exception (graph_api_async.fetch_many with all_pages=True follows every page).
+    Returns copies of the records with the result under path, the way $expand would put
+    it, and the number of lookups that failed (those get {"error": ...} instead).
+    Records without an id are returned unchanged, in their original positions.
+    """
+    path = path.strip('/')
+    with_id = [record for record in records if isinstance(record, dict) and record.get('id')]
+    urls = [f"{ms_graph_api.base_url}{version}/{endpoint.strip('/')}/{record['id']}/{path}" for record in with_id]
+    results = iter(fetch(urls) if fetch else batch_get(ms_graph_api, urls, version))
+    looked_up, failed = [], 0
+    for record in records:
+        if not (isinstance(record, dict) and record.get('id')):
+            looked_up.append(record)
+            continue
+        result = next(results)
+        if isinstance(result, Exception) or (isinstance(result, BatchResponse) and not result.ok):
+            value = {"error": str(result) if isinstance(result, Exception) else result.error_message()}
+            failed += 1
+        elif isinstance(result, BatchResponse):
+            body = result.body if isinstance(result.body, dict) else {}
+            value = body.get('value', {key: item for key, item in body.items() if not key.startswith('@odata')})
+        else:
+            value = result
+        looked_up.append({**record, path: value})
+    return looked_up, failed
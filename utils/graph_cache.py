@@ -0,0 +1,162 @@
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import streamlit as st
+from utils.cache_dir import get_cache_path
+
+MAX_CACHE_BYTES = 100 * 1024 * 1024
+DEFAULT_TTL = 600
+
+# Seconds a cached response stays fresh, by endpoint prefix (longest match wins)
+ENDPOINT_TTLS = {
+    "deviceManagement/managedDevices": 300,
+    "deviceManagement/detectedApps": 3600,
+    "deviceManagement/userExperienceAnalytics": 3600,
+    "deviceManagement/deviceCompliancePolicies": 1800,
+    "deviceManagement/deviceConfigurations": 1800,
+    "users": 900,
+    "groups": 900,
+}
+
+# 'OData strings' (quotes doubled inside) and "search terms" keep their whitespace
+QUOTED_LITERAL = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")")
+
+def _collapse_whitespace(option):
+    # Odd parts of the split are the quoted literals
+    parts = QUOTED_LITERAL.split(option)
+    return ''.join(part if number % 2 else re.sub(r'\s+', ' ', part) for number, part in enumerate(parts)).strip()
+
+def canonicalize_url(url):
+    # The parameters text area joins options with "\n&", so strip that and sort the options
+    url = url.strip()
+    base, _, query = url.partition('?')
+    parts = urlsplit(base)
+    path = parts.path.rstrip('/')
+    options = []
+    for option in query.replace('\n', '&').split('&'):
+        option = _collapse_whitespace(option)
+        if option:
+            key, _, value = option.partition('=')
+            options.append((key.strip().lower(), value.strip()))
+    options.sort(key=lambda option: option[0])
+    canonical = f"{parts.scheme.lower()}://{parts.netloc.lower()}{path}"
+    if options:
+        canonical += '?' + '&'.join(f"{key}={value}" for key, value in options)
+    return canonical
+
+def get_ttl(canonical_url):
+    path = urlsplit(canonical_url).path.strip('/')
+    # Drop the API version
+    path = path.split('/', 1)[1] if '/' in path else ''
+    matches = [prefix for prefix in ENDPOINT_TTLS if path == prefix or path.startswith(prefix + '/')]
+    return ENDPOINT_TTLS[max(matches, key=len)] if matches else DEFAULT_TTL
+
+class CacheEntry:
+    def __init__(self, body, etag, expires_at):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+class GraphResponseCache:
+    """Size-bounded, on-disk LRU cache of Graph GET responses.
+
+    Entries are keyed on tenant + canonical URL and expire after a per-endpoint TTL.
+    Expired entries with an ETag are kept so the caller can revalidate them with If-None-Match.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.db_path = get_cache_path("graph_responses.sqlite")
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, url TEXT, body BLOB, etag TEXT,
+                expires_at REAL, last_access REAL, size INTEGER)""")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _key(self, tenant_id, url):
+        return hashlib.sha256(f"{tenant_id}|{canonicalize_url(url)}".encode()).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, tenant_id, url):
+        key = self._key(tenant_id, url)
+        with self._connect() as db:
+            row = db.execute("SELECT body, etag, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            entry = CacheEntry(json.loads(zlib.decompress(row[0])), row[1], row[2])
+            if not entry.fresh and not entry.etag:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count("misses")
+                return None
+            db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._count("hits" if entry.fresh else "misses")
+        return entry
+
+    def put(self, tenant_id, url, body, etag=None):
+        canonical = canonicalize_url(url)
+        data = zlib.compress(json.dumps(body).encode())
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO responses (key, url, body, etag, expires_at, last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (self._key(tenant_id, url), canonical, data, etag, now + get_ttl(canonical), now, len(data)))
+            self._evict(db)
+
+    def revalidated(self, tenant_id, url):
+        # A 304 Not Modified: the cached body is good for another TTL
+        canonical = canonicalize_url(url)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                       (now + get_ttl(canonical), now, self._key(tenant_id, url)))
+        self._count("revalidated")
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count("evictions")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM responses")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return GraphResponseCache()
@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from utils.cache_dir import get_cache_path
+from utils.graph_api import GraphAPIError
+from utils.write_debug import write_debug
+
+# Graph collections that expose a /delta function. Intune's managedDevices does not,
+# but its Entra ID counterpart 'devices' does.
+DELTA_ENDPOINTS = {'users', 'groups', 'devices', 'applications', 'servicePrincipals', 'directoryRoles', 'administrativeUnits'}
+# Query options the local copy can't honour; $select is applied to it when reading
+UNSUPPORTED_OPTIONS = {'$filter', '$search', '$orderby', '$top', '$skip', '$expand', '$count'}
+
+_db_lock = threading.Lock()
+
+def _query_options(parameters):
+    # ["$select=id,displayName", "$top=5"] -> {"$select": "id,displayName", "$top": "5"}
+    options = {}
+    for parameter in parameters or []:
+        name, _, value = parameter.lstrip('?&').partition('=')
+        options[name.strip().lower()] = value.strip()
+    return options
+
+def supports_delta(endpoint, parameters=None):
+    return endpoint.strip('/').split('?')[0] in DELTA_ENDPOINTS and not UNSUPPORTED_OPTIONS & set(_query_options(parameters))
+
+def selected_properties(parameters):
+    select = _query_options(parameters).get('$select')
+    return [name.strip() for name in select.split(',') if name.strip()] if select else None
+
+class DeltaSync:
+    """Keep a local copy of a Graph collection up to date with delta queries.
+
+    The first sync downloads the full collection through /delta and stores the
+    @odata.deltaLink. Later syncs only fetch what changed since then and apply the
+    changes (including @removed items) to the local SQLite store.
+    """
+
+    def __init__(self, ms_graph_api, endpoint, version="v1.0"):
+        self.ms_graph_api = ms_graph_api
+        self.endpoint = endpoint.strip('/')
+        self.version = version
+        self.key = f"{version}/{self.endpoint}"
+        self.db_path = get_cache_path("delta", f"{ms_graph_api.tenant_id}.sqlite")
+        with _db_lock, self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS items (endpoint TEXT, id TEXT, data TEXT, PRIMARY KEY (endpoint, id))")
+            db.execute("CREATE TABLE IF NOT EXISTS delta_links (endpoint TEXT PRIMARY KEY, delta_link TEXT, synced_at TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get_delta_link(self):
+        with self._connect() as db:
+            row = db.execute("SELECT delta_link FROM delta_links WHERE endpoint = ?", (self.key,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, full=False):
+        delta_link = None if full else self.get_delta_link()
+        if delta_link is None:
+            write_debug(f":arrows_counterclockwise: Full delta sync of {self.key}")
+            return self._run(f"{self.ms_graph_api.base_url}{self.key}/delta", full=True)
+
+        write_debug(f":arrows_counterclockwise: Incremental delta sync of {self.key}")
+        try:
+            return self._run(delta_link, full=False)
+        except GraphAPIError as e:
+            # 410 Gone: the delta token expired and Graph wants a full resync
+            if e.status_code != 410:
+                raise
+            write_debug(":warning: Delta token expired, starting a full resync")
+            return self._run(f"{self.ms_graph_api.base_url}{self.key}/delta", full=True)
+
+    def _run(self, url, full):
+        stats = {"upserted": 0, "removed": 0, "pages": 0}
+        seen = set()
+        next_link = url
+        delta_link = None
+        while next_link:
+            api_response = self.ms_graph_api.call_api(next_link)
+            stats["pages"] += 1
+            with _db_lock, self._connect() as db:
+                for item in api_response.get('value', []):
+                    if '@removed' in item:
+                        db.execute("DELETE FROM items WHERE endpoint = ? AND id = ?", (self.key, item['id']))
+                        stats["removed"] += 1
+                        continue
+                    row = db.execute("SELECT data FROM items WHERE endpoint = ? AND id = ?", (self.key, item['id'])).fetchone()
+                    # Delta responses can carry only the changed properties, so merge into what we have
+                    data = json.loads(row[0]) if row and not full else {}
+                    data.update({k: v for k, v in item.items() if not k.startswith('@odata')})
+                    db.execute("INSERT OR REPLACE INTO items (endpoint, id, data) VALUES (?, ?, ?)", (self.key, item['id'], json.dumps(data)))
+                    seen.add(item['id'])
+                    stats["upserted"] += 1
+            next_link = api_response.get('@odata.nextLink')
+            delta_link = api_response.get('@odata.deltaLink', delta_link)
+
+        with _db_lock, self._connect() as db:
+            if full:
+                # Anything not returned by a full sync no longer exists
+                stale = [row[0] for row in db.execute("SELECT id FROM items WHERE endpoint = ?", (self.key,)) if row[0] not in seen]
+                db.executemany("DELETE FROM items WHERE endpoint = ? AND id = ?", [(self.key, item_id) for item_id in stale])
+                stats["removed"] += len(stale)
+            if delta_link:
+                db.execute("INSERT OR REPLACE INTO delta_links (endpoint, delta_link, synced_at) VALUES (?, ?, ?)",
+                           (self.key, delta_link, datetime.now(timezone.utc).isoformat()))
+        stats["total"] = self.count()
+        write_debug(f":white_check_mark: Delta sync done: {stats}")
+        return stats
+
+    def count(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM items WHERE endpoint = ?", (self.key,)).fetchone()[0]
+
+    def iter_items(self, select=None):
+        # The full items are stored; select narrows them down the way $select would
+        with self._connect() as db:
+            for (data,) in db.execute("SELECT data FROM items WHERE endpoint = ? ORDER BY id", (self.key,)):
+                item = json.loads(data)
+                yield {name: item.get(name) for name in ['id'] + [name for name in select if name != 'id']} if select else item
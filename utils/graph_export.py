@@ -0,0 +1,234 @@
+import os
+import re
+import csv
+import json
+import time
+from utils.graph_api import iter_graph_pages
+from utils.graph_validate import validate_graph_url, referenced_properties
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_TYPES = {"null": pa.null(), "bool": pa.bool_(), "int": pa.int64(), "float": pa.float64(), "string": pa.string()}
+except ImportError:
+    pa = None
+
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+# Parquet output is a folder of part files, one row group each, so every part is complete on its own
+ROW_GROUP_SIZE = 10000
+
+def export_file_name(name, export_format):
+    # Only a plain file name, so the export can't land outside the export folder
+    name = re.sub(r'[^A-Za-z0-9._ -]', '_', os.path.basename(name.strip())).strip('. ')
+    return f"{name or 'graph_export'}.{export_format}"
+
+def _scalar(value):
+    # Nested objects and collections go into CSV and Parquet cells as JSON
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+def _new_columns(columns, page):
+    # Keys of the page that aren't columns yet (beta properties, properties missing from the spec)
+    added = []
+    for record in page:
+        added.extend(key for key in record if key not in columns and key not in added and not key.startswith('@odata'))
+    return added
+
+def _export_columns(url, page):
+    # $select if there is one, else the entity's properties from the local spec plus whatever
+    # else the first page has; keys that first show up on later pages are added as they come
+    selected = [name for name in referenced_properties(url) if '/' not in name]
+    if 'select=' in url.lower() and selected:
+        return selected
+    columns = list(validate_graph_url(url)["properties"])
+    return columns + _new_columns(columns, page)
+
+def _value_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    return "string"
+
+def _widen(value_type, other):
+    # null < bool, int < float < string: a column only ever moves to a type that holds both
+    if value_type == other or other == "null":
+        return value_type
+    if value_type == "null":
+        return other
+    if {value_type, other} == {"int", "float"}:
+        return "float"
+    return "string"
+
+def _coerce(value, value_type):
+    # value_type has been widened to fit value, so nothing is lost here
+    if value is None:
+        return None
+    if value_type == "string":
+        return value if isinstance(value, str) else json.dumps(value)
+    if value_type == "float":
+        return float(value)
+    return value
+
+class GraphExport:
+    """Streams every page of a Graph collection to disk as NDJSON, CSV or Parquet.
+
+    Only one page (or one Parquet row group) is held in memory. After each flushed page the
+    next link, record count and file size go to a state file next to the output, so an
+    interrupted export resumes where it stopped.
+    """
+
+    def __init__(self, url, path, export_format="ndjson"):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Export format must be one of {', '.join(EXPORT_FORMATS)}")
+        if export_format == "parquet" and pa is None:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+        self.url = url
+        self.path = path
+        self.export_format = export_format
+        self.state_path = f"{path}.export-state.json"
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            # Only resume the same export
+            if state.get("url") == self.url and state.get("format") == self.export_format and not state.get("done"):
+                return state
+        except (OSError, ValueError):
+            pass
+        return {"url": self.url, "format": self.export_format, "next_link": None, "records": 0,
+                "bytes": 0, "parts": 0, "columns": None, "types": None, "done": False}
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def resuming(self):
+        return self.state["next_link"] is not None
+
+    def _open_text(self):
+        # Drop whatever was written after the last saved page, then append
+        mode = 'r+' if self.resuming and os.path.exists(self.path) else 'w'
+        file = open(self.path, mode, encoding='utf-8', newline='')
+        file.truncate(self.state["bytes"] if mode == 'r+' else 0)
+        file.seek(0, os.SEEK_END)
+        return file
+
+    def _part_path(self, part):
+        return os.path.join(self.path, f"part-{part:05d}.parquet")
+
+    def _widen_csv(self, file):
+        # A column was added: rewrite the file under the wider header, earlier rows get empty cells
+        columns = self.state["columns"]
+        file.close()
+        tmp_path = self.path + ".tmp"
+        with open(self.path, 'r', encoding='utf-8', newline='') as source, open(tmp_path, 'w', encoding='utf-8', newline='') as target:
+            reader, writer = csv.reader(source), csv.writer(target)
+            next(reader, None)
+            writer.writerow(columns)
+            writer.writerows(row + [""] * (len(columns) - len(row)) for row in reader)
+        os.replace(tmp_path, self.path)
+        file = open(self.path, 'a', encoding='utf-8', newline='')
+        self.state["bytes"] = file.tell()
+        self._save_state()
+        return file
+
+    def _write_part(self, rows):
+        # Column types come from the data and only widen (int to float, mixed to string), and
+        # columns are only added. When either happens, the earlier parts are rewritten, so all
+        # parts read back as one dataset.
+        columns = self.state["columns"]
+        previous = self.state.get("types") or {}
+        types = {column: previous.get(column, "null") for column in columns}
+        for row in rows:
+            for column in columns:
+                types[column] = _widen(types[column], _value_type(row.get(column)))
+        schema = pa.schema([(column, PARQUET_TYPES[types[column]]) for column in columns])
+        if types != previous:
+            for part in range(self.state["parts"]):
+                table = pq.read_table(self._part_path(part))
+                for column in columns:
+                    if column not in table.column_names:
+                        table = table.append_column(column, pa.nulls(table.num_rows, PARQUET_TYPES[types[column]]))
+                table = table.select(columns).cast(schema, safe=False)
+                pq.write_table(table, self._part_path(part) + ".tmp")
+                os.replace(self._part_path(part) + ".tmp", self._part_path(part))
+        table = pa.Table.from_pylist([{column: _coerce(row.get(column), types[column]) for column in columns} for row in rows], schema=schema)
+        os.makedirs(self.path, exist_ok=True)
+        pq.write_table(table, self._part_path(self.state["parts"]))
+        self.state["types"] = types
+        self.state["parts"] += 1
+
+    def run(self, max_records=None, progress=None):
+        """Export until the last page (or max_records). progress(records, records_per_second) is called per page."""
+        start_url = self.state["next_link"] or self.url
+        exported_before = self.state["records"]
+        started = time.time()
+        file = self._open_text() if self.export_format != "parquet" else None
+        if self.export_format == "parquet" and not self.resuming and os.path.isdir(self.path):
+            # A fresh export: parts of an older one would otherwise mix in
+            for name in os.listdir(self.path):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(self.path, name))
+        writer = None
+        pending_rows = []
+        try:
+            remaining = None if max_records is None else max(0, max_records - exported_before)
+            for page, next_link in iter_graph_pages(start_url, max_records=remaining):
+                if self.state["columns"] is None:
+                    self.state["columns"] = _export_columns(self.url, page)
+                else:
+                    added = _new_columns(self.state["columns"], page)
+                    if added:
+                        self.state["columns"] = self.state["columns"] + added
+                        if self.export_format == "csv":
+                            file = self._widen_csv(file)
+                            writer = None
+                columns = self.state["columns"]
+
+                if self.export_format == "ndjson":
+                    for record in page:
+                        file.write(json.dumps(record) + "\n")
+                elif self.export_format == "csv":
+                    writer = writer or csv.writer(file)
+                    if self.state["bytes"] == 0 and file.tell() == 0:
+                        writer.writerow(columns)
+                    writer.writerows([_scalar(record.get(column)) for column in columns] for record in page)
+                else:
+                    pending_rows.extend({column: _scalar(record.get(column)) for column in columns} for record in page)
+
+                self.state["records"] += len(page)
+                if self.export_format == "parquet":
+                    # A resume point exists only once the buffered rows are on disk
+                    if len(pending_rows) >= ROW_GROUP_SIZE or next_link is None:
+                        self._write_part(pending_rows)
+                        pending_rows = []
+                        self.state["next_link"] = next_link
+                        self._save_state()
+                else:
+                    file.flush()
+                    self.state["bytes"] = file.tell()
+                    self.state["next_link"] = next_link
+                    self._save_state()
+
+                if progress is not None:
+                    elapsed = max(time.time() - started, 1e-6)
+                    progress(self.state["records"], (self.state["records"] - exported_before) / elapsed)
+
+            if pending_rows:
+                self._write_part(pending_rows)
+            self.state["done"] = True
+            self.state["next_link"] = None
+            self._save_state()
+        finally:
+            if file is not None:
+                file.close()
+        return self.state
@@ -0,0 +1,23 @@
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+@st.cache_resource(show_spinner=False)
+def get_graph_session(tenant_id, pool_size=DEFAULT_POOL_SIZE):
+    """Long-lived keep-alive session for one tenant, shared by all Streamlit sessions.
+
+    urllib3 connection pools are thread-safe, so the same session can serve concurrent
+    reruns and worker threads. Graph returns gzip when asked, which shrinks large pages a lot.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        "Accept": "application/json"
+    })
+    return session
@@ -0,0 +1,146 @@
+import time
+import random
+import asyncio
+import threading
+import logging
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Statuses Graph uses for throttling and temporary unavailability
+RETRY_STATUS_CODES = (429, 503, 504)
+
+DEFAULT_RATE = 20           # requests per second per tenant
+DEFAULT_BURST = 40
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0          # seconds, doubled on every retry without Retry-After
+BACKOFF_MAX = 60.0
+# How often an async request checks for a free in-flight slot
+IN_FLIGHT_POLL = 0.01
+
+def parse_retry_after(value):
+    # Seconds from a Retry-After header, None when it is missing or not a number
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        # Takes a token and returns 0, or returns how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        # A Retry-After applies to the whole tenant, not only to the request that got it
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class GraphScheduler:
+    """Per-tenant gate in front of every Graph request.
+
+    Requests go through a token bucket and a bounded in-flight count. 429/503/504 are
+    retried after Retry-After, or an exponential backoff with jitter when there is none.
+    submit_async does the same for asyncio callers without blocking the event loop.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_retries=DEFAULT_MAX_RETRIES):
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.counters = {"requests": 0, "throttled": 0, "retried": 0, "gave_up": 0}
+        self._counters_lock = threading.Lock()
+
+    def count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def retry_delay(self, response, attempt):
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return retry_after
+        # Full jitter keeps concurrent retries from hitting Graph at the same moment
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def _next_retry(self, response, attempt):
+        # None when the response is final, otherwise the delay before the next attempt
+        if response.status_code not in RETRY_STATUS_CODES:
+            return None
+        self.count("throttled")
+        if attempt == self.max_retries:
+            self.count("gave_up")
+            return None
+        delay = self.retry_delay(response, attempt)
+        if response.status_code == 429:
+            self.bucket.pause(delay)
+        logger.warning(f"Graph returned {response.status_code}, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+        self.count("retried")
+        return delay
+
+    def submit(self, send):
+        # send(fresh_connection) performs the HTTP request and returns the response.
+        # Graph asks for 503 retries to go over a new connection, so we tell send when to do that.
+        fresh_connection = False
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with self.in_flight:
+                self.count("requests")
+                response = send(fresh_connection)
+            delay = self._next_retry(response, attempt)
+            if delay is None:
+                return response
+            fresh_connection = response.status_code == 503
+            time.sleep(delay)
+
+    async def submit_async(self, send):
+        # Same as submit with an async send; the in-flight slots are shared with the sync callers,
+        # so they are polled instead of waited on, which would block the event loop
+        fresh_connection = False
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire_async()
+            while not self.in_flight.acquire(blocking=False):
+                await asyncio.sleep(IN_FLIGHT_POLL)
+            try:
+                self.count("requests")
+                response = await send(fresh_connection)
+            finally:
+                self.in_flight.release()
+            delay = self._next_retry(response, attempt)
+            if delay is None:
+                return response
+            fresh_connection = response.status_code == 503
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self.counters)
+
+@st.cache_resource(show_spinner=False)
+def get_graph_scheduler(tenant_id):
+    # One scheduler per tenant, shared by every session in the process
+    return GraphScheduler()
@@ -0,0 +1,98 @@
+import time
+import threading
+import logging
+import requests
+import streamlit as st
+from utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+GRAPH_SCOPE = "https://graph.microsoft.com/.default"
+LOGIN_URL = "https://login.microsoftonline.com"
+
+# Refresh the token this many seconds before it actually expires
+REFRESH_MARGIN = 300
+
+class GraphTokenProvider:
+    """Client-credentials token for one (tenant, client_id, scope), shared by every session.
+
+    The token is refreshed in a background thread once it gets within REFRESH_MARGIN
+    seconds of expiry, and concurrent refreshes are coalesced into a single request.
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, scope=GRAPH_SCOPE, login_url=LOGIN_URL):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.login_url = login_url
+        self.token = None
+        self.expires_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get_token(self):
+        now = time.time()
+        if self.token and now < self.expires_at - REFRESH_MARGIN:
+            return self.token
+
+        if self.token and now < self.expires_at:
+            # Still valid: hand it out and refresh behind the caller's back
+            self._refresh_in_background()
+            return self.token
+
+        # Expired or never fetched: the first caller fetches, the others wait for its result
+        with self._lock:
+            if self.token and time.time() < self.expires_at:
+                return self.token
+            self._fetch_token()
+            return self.token
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                if time.time() < self.expires_at - REFRESH_MARGIN:
+                    return
+                self._fetch_token()
+        except Exception as e:
+            # The current token is still valid, the next caller will retry
+            logger.warning(f"Background token refresh failed: {str(e)}")
+        finally:
+            self._refreshing = False
+
+    def _fetch_token(self):
+        url = f"{self.login_url}/{self.tenant_id}/oauth2/v2.0/token"
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        body = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": self.scope,
+            "grant_type": "client_credentials"
+        }
+        logger.info(f"Requesting access token from {url}")
+        with span("token_fetch"):
+            response = requests.post(url, headers=headers, data=body, timeout=30)
+            response.raise_for_status()
+            payload = response.json()
+        self.token = payload.get("access_token")
+        self.expires_at = time.time() + int(payload.get("expires_in", 3599))
+        logger.info(f"Obtained access token, expires in {payload.get('expires_in')}s")
+
+    def invalidate(self):
+        with self._lock:
+            self.token = None
+            self.expires_at = 0
+
+@st.cache_resource(show_spinner=False)
+def get_token_provider(tenant_id, client_id, client_secret, scope=GRAPH_SCOPE):
+    # st.cache_resource keeps one provider per argument set for the whole process
+    return GraphTokenProvider(tenant_id, client_id, client_secret, scope)
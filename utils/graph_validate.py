@@ -0,0 +1,216 @@
+import re
+import difflib
+from urllib.parse import urlsplit, unquote
+from utils.spec_index import get_spec_index
+
+GRAPH_HOST = "graph.microsoft.com"
+VERSIONS = ("v1.0", "beta")
+
+QUERY_OPTIONS = ("$filter", "$select", "$orderby", "$top", "$skip", "$expand", "$count", "$search", "$skiptoken", "$format")
+# Always accepted by Graph even when the spec doesn't list them for an operation
+IMPLICIT_QUERY_OPTIONS = ("$skiptoken", "$format")
+
+FILTER_OPERATORS = {"eq", "ne", "gt", "ge", "lt", "le", "and", "or", "not", "in", "has"}
+FILTER_FUNCTIONS = {"startswith", "endswith", "contains", "tolower", "toupper", "trim", "length", "indexof",
+                    "substring", "concat", "year", "month", "day", "hour", "minute", "second", "date", "time",
+                    "now", "any", "all", "cast", "isof"}
+FILTER_LITERALS = {"true", "false", "null"}
+
+FILTER_TOKEN = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+  | (?P<guid>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})
+  | (?P<datetime>\d{4}-\d{2}-\d{2}(?:T[\d:.]+(?:Z|[+-]\d{2}:\d{2})?)?)
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_][\w.]*(?:/[A-Za-z_][\w.]*)*)
+  | (?P<punct>[(),:])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE)
+
+def _split_query(query):
+    # Same tolerance as the parameters text area: options joined with "\n&"
+    options = {}
+    for option in query.replace('\n', '&').split('&'):
+        option = option.strip()
+        if option:
+            key, _, value = option.partition('=')
+            options[key.strip()] = unquote(value.strip())
+    return options
+
+def _suggest(name, properties):
+    matches = difflib.get_close_matches(name, properties, n=3, cutoff=0.6)
+    return f" Did you mean {', '.join(matches)}?" if matches else ""
+
+def _check_property(name, properties, option, diagnostics):
+    # Graph matches property names case-insensitively
+    root = name.split('/')[0]
+    by_lower_name = {prop.lower(): prop for prop in properties}
+    if root.lower() not in by_lower_name:
+        diagnostics.append(f"{option}: '{root}' is not a property of this entity.{_suggest(root, properties)}")
+        return None
+    return properties[by_lower_name[root.lower()]]
+
+def _check_filter(expression, properties, index, diagnostics):
+    tokens = [(kind, value) for match in FILTER_TOKEN.finditer(expression)
+              for kind, value in match.groupdict().items() if value is not None and kind != 'space']
+    lambda_variables = set()
+    last_property_type = None
+    for position, (kind, value) in enumerate(tokens):
+        next_token = tokens[position + 1] if position + 1 < len(tokens) else (None, None)
+        if kind == 'other':
+            diagnostics.append(f"$filter: unexpected character '{value}'")
+        elif kind == 'name':
+            lowered = value.lower()
+            if lowered in FILTER_OPERATORS or lowered in FILTER_LITERALS:
+                # Also before a parenthesis: deviceName in ('a', 'b'), not(deviceName eq 'a')
+                continue
+            elif next_token == ('punct', '('):
+                # Lambdas are called on a collection property: deviceActionResults/any(...)
+                *collection, function = value.split('/')
+                if collection:
+                    _check_property(collection[0], properties, "$filter", diagnostics)
+                if function.lower() not in FILTER_FUNCTIONS:
+                    diagnostics.append(f"$filter: '{function}' is not a supported function")
+            elif next_token == ('punct', ':'):
+                # any(d: d/prop eq 'x') declares a lambda variable
+                lambda_variables.add(value)
+            elif next_token[0] == 'string' and '.' in value:
+                # Typed enum literal: complianceState eq microsoft.graph.complianceState'compliant'
+                last_property_type = f"enum:{value}"
+            elif value.split('/')[0] in lambda_variables:
+                continue
+            elif position > 0 and tokens[position - 1][0] == 'name' and tokens[position - 1][1].lower() not in FILTER_OPERATORS:
+                diagnostics.append(f"$filter: '{value}' is not a supported operator (use eq, ne, gt, ge, lt, le, and, or, not, in)")
+            else:
+                last_property_type = _check_property(value, properties, "$filter", diagnostics)
+        elif kind == 'string' and last_property_type and last_property_type.startswith('enum:'):
+            allowed = index.get_enum_values(last_property_type[len('enum:'):]) or []
+            literal = value[1:-1].replace("''", "'")
+            if allowed and literal not in allowed:
+                diagnostics.append(f"$filter: '{literal}' is not a valid value, expected one of {', '.join(allowed)}")
+
+def _split_expand(expand):
+    # Commas inside users($select=id,displayName) belong to the nested options
+    items, depth, current = [], 0, ""
+    for character in expand:
+        depth += (character == '(') - (character == ')')
+        if character == ',' and depth == 0:
+            items.append(current)
+            current = ""
+        else:
+            current += character
+    items.append(current)
+    return [item.strip() for item in items if item.strip()]
+
+def validate_graph_url(url):
+    """Check a Graph URL against the local OpenAPI index before it goes over the wire.
+
+    Returns a dict with 'valid', 'known' (the path is covered by the local spec),
+    'diagnostics' (errors), 'warnings', 'entity' and 'properties'.
+    """
+    result = {"valid": True, "known": False, "diagnostics": [], "warnings": [], "entity": None, "properties": {}}
+    diagnostics = result["diagnostics"]
+
+    base, _, query = url.strip().partition('?')
+    parts = urlsplit(base)
+    if parts.netloc.lower() != GRAPH_HOST:
+        diagnostics.append(f"The URL must start with https://{GRAPH_HOST}/")
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if not segments or segments[0] not in VERSIONS:
+        diagnostics.append(f"The API version must be one of {', '.join(VERSIONS)}")
+        result["valid"] = False
+        return result
+    version, path = segments[0], '/'.join(segments[1:])
+    if not path:
+        diagnostics.append("The URL has no endpoint after the API version")
+        result["valid"] = False
+        return result
+
+    options = _split_query(query)
+    for option in options:
+        if option.startswith('$') and option.lower() not in QUERY_OPTIONS:
+            diagnostics.append(f"'{option}' is not an OData query option")
+
+    index = get_spec_index()
+    # The local spec only describes part of the API surface; stay quiet about the rest
+    if segments[1] not in index.child_segments(""):
+        result["valid"] = not diagnostics
+        return result
+
+    operation = index.lookup(path)
+    if operation is None:
+        known_prefix = path
+        while known_prefix and index.resolve_path(known_prefix) is None:
+            known_prefix = known_prefix.rsplit('/', 1)[0] if '/' in known_prefix else ""
+        template = index.resolve_path(known_prefix) if known_prefix else ""
+        children = index.child_segments(template)
+        hint = f" Available under '{known_prefix or '/'}': {', '.join(children[:20])}." if children else ""
+        if version == "beta":
+            # The local spec is v1.0 and beta has more, so this can't be called an error
+            result["warnings"].append(f"'{path}' is not in the local v1.0 spec, it may only exist in beta.{hint}")
+            result["valid"] = not diagnostics
+            return result
+        diagnostics.append(f"'{path}' does not exist in Graph {version}.{hint}")
+        result["valid"] = False
+        return result
+
+    result["known"] = True
+    result["entity"] = operation["entity"]
+    properties = index.get_properties(operation["entity"]) if operation["entity"] else {}
+    result["properties"] = properties
+
+    for option in options:
+        lowered = option.lower()
+        if lowered in QUERY_OPTIONS and lowered not in IMPLICIT_QUERY_OPTIONS and lowered not in [o.lower() for o in operation["query_options"]]:
+            diagnostics.append(f"{option} is not supported on '{operation['path']}'")
+
+    if properties:
+        # The spec is v1.0; beta entities have more properties, so unknown ones there are only warnings
+        property_issues = result["warnings"] if version == "beta" else diagnostics
+        lowered_options = {key.lower(): value for key, value in options.items()}
+        for name in filter(None, (item.strip() for item in lowered_options.get("$select", "").split(','))):
+            _check_property(name, properties, "$select", property_issues)
+        for clause in filter(None, (item.strip() for item in lowered_options.get("$orderby", "").split(','))):
+            words = clause.split()
+            _check_property(words[0], properties, "$orderby", property_issues)
+            if len(words) > 1 and words[1].lower() not in ("asc", "desc"):
+                diagnostics.append(f"$orderby: '{words[1]}' should be asc or desc")
+        for item in _split_expand(lowered_options.get("$expand", "")):
+            _check_property(item.split('(')[0].strip(), properties, "$expand", property_issues)
+        if lowered_options.get("$filter"):
+            _check_filter(lowered_options["$filter"], properties, index, property_issues)
+
+    result["valid"] = not diagnostics
+    return result
+
+def referenced_properties(url):
+    # Property names the URL selects, filters or sorts on, in order of first appearance
+    options = {key.lower(): value for key, value in _split_query(url.partition('?')[2]).items()}
+    names = [item.strip() for item in options.get("$select", "").split(',')]
+    names += [clause.split()[0] for clause in options.get("$orderby", "").split(',') if clause.strip()]
+    tokens = [(kind, value) for match in FILTER_TOKEN.finditer(options.get("$filter", ""))
+              for kind, value in match.groupdict().items() if value is not None and kind != 'space']
+    lambda_variables = {value for position, (kind, value) in enumerate(tokens[:-1]) if kind == 'name' and tokens[position + 1] == ('punct', ':')}
+    for position, (kind, value) in enumerate(tokens):
+        next_token = tokens[position + 1] if position + 1 < len(tokens) else (None, None)
+        if kind != 'name' or value in lambda_variables or value.split('/')[0] in lambda_variables:
+            continue
+        if next_token == ('punct', '('):
+            # deviceActionResults/any(...) references the collection
+            if '/' in value:
+                names.append(value.split('/')[0])
+        elif value.lower() not in FILTER_OPERATORS | FILTER_LITERALS:
+            names.append(value)
+    seen = []
+    for name in names:
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+def format_validation(result):
+    # Text for the assistant prompt and the response pane, in place of the old '$top=1' metadata call
+    lines = [f"- {diagnostic}" for diagnostic in result["diagnostics"] + result["warnings"]]
+    if result["properties"]:
+        lines.append(f"\nProperties of {result['entity']}:")
+        lines.extend(f"- {name}: {prop_type}" for name, prop_type in sorted(result["properties"].items()))
+    return "\n".join(lines)
@@ -0,0 +1,14 @@
+import os
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+DEFAULT_LLM_MODEL = "gpt-4o-2024-08-06"
+
+def has_session():
+    # False under the batch CLI, the benchmark and in worker threads: there is no st.session_state to use
+    return get_script_run_ctx(suppress_warning=True) is not None
+
+def get_env_secret(key):
+    # Headless runs take their secrets from the environment (or a .env the entry point loaded)
+    if key == 'LLM_MODEL':
+        return os.environ.get('LLM_MODEL') or DEFAULT_LLM_MODEL
+    return os.environ.get(key)
@@ -0,0 +1,136 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from utils.ai_chat import complete
+from utils.write_debug import write_debug
+from utils.response_compact import compact_records, count_tokens, context_budget, message_budget, DEFAULT_TOKEN_BUDGET
+
+MAX_PARALLEL_CALLS = 6
+# Larger results get larger chunks rather than more LLM calls; one wave of parallel calls at most
+MAX_CHUNKS = MAX_PARALLEL_CALLS
+# Summaries are added up across chunks, so they should stick to the data
+MAP_TEMPERATURE = 0
+REDUCE_TEMPERATURE = 0.2
+# Records used to estimate how many fit in one chunk
+SAMPLE_SIZE = 100
+
+MAP_PROMPT = {"content": """\
+You summarise one chunk of a larger Microsoft Graph API result for an Intune administrator.
+Stick to facts from the data: counts, notable values, outliers and anything relevant to the user's question.
+Give exact numbers where you can, they will be added up with the summaries of the other chunks.
+Be brief, use bullet points, no introduction."""}
+
+REDUCE_PROMPT = {"content": """\
+You are an AI assistant specialized in Microsoft Intune, Entra ID and Windows 10/11.
+You get summaries of consecutive chunks of one Microsoft Graph API result. Combine them into one answer to the user's question:
+add up counts across chunks, point out the notable findings, and suggest follow-up Graph queries or filters where useful.
+Visualise the data in a table if possible, using markdown."""}
+
+def estimate_chunk_size(sample, url="", budget=DEFAULT_TOKEN_BUDGET, model=None):
+    # Tokens per record once compacted, measured on a sample without a budget cap
+    if not sample:
+        return 1
+    tokens = count_tokens(compact_records(sample, url, budget=10 ** 9, model=model), model)
+    return max(1, int(budget * 0.9 * len(sample) / tokens))
+
+def needs_map_reduce(records, url="", model=None):
+    # Only when the compacted records won't fit in the single message the assistant gets
+    return len(records) > estimate_chunk_size(records[:SAMPLE_SIZE], url, message_budget(model), model)
+
+def iter_chunks(records, url="", budget=DEFAULT_TOKEN_BUDGET, model=None, total=None):
+    # Works on a list or straight off the Graph pager: the sample is the first few records.
+    # With a known (or maximum) total, chunks grow so there are at most MAX_CHUNKS of them;
+    # compact_records then summarises the rows that don't fit in a chunk's table.
+    total = len(records) if total is None and hasattr(records, "__len__") else total
+    records = iter(records)
+    sample = list(islice(records, SAMPLE_SIZE))
+    chunk_size = estimate_chunk_size(sample, url, budget, model)
+    if total:
+        chunk_size = max(chunk_size, math.ceil(total / MAX_CHUNKS))
+    pending = sample
+    while True:
+        pending.extend(islice(records, max(0, chunk_size - len(pending))))
+        if not pending:
+            return
+        yield pending[:chunk_size]
+        pending = pending[chunk_size:]
+
+def summarise_chunk(question, chunk, number, url, budget, model):
+    digest = compact_records(chunk, url, budget, model)
+    message = f"User question: \"{question}\"\n\nChunk {number} ({len(chunk)} records) of the result of {url}:\n{digest}"
+    return complete(message, MAP_PROMPT, model, temperature=MAP_TEMPERATURE)
+
+def merge_summaries(question, group, model):
+    try:
+        return complete(f"User question: \"{question}\"\n\nMerge these partial summaries, keeping all numbers:\n\n" + "\n\n".join(group),
+                        MAP_PROMPT, model, temperature=MAP_TEMPERATURE)
+    except Exception as e:
+        # Keep the summaries as they are rather than losing them
+        write_debug(f":warning: Could not merge {len(group)} summaries: {str(e)}")
+        return "\n\n".join(group)
+
+def reduce_summaries(question, summaries, budget, model, placeholder=None, instructions=None):
+    # Too many partial summaries for one call: combine them in groups first
+    while len(summaries) > 1 and count_tokens("\n\n".join(summaries), model) > budget:
+        groups, group = [], []
+        for summary in summaries:
+            if group and count_tokens("\n\n".join(group + [summary]), model) > budget:
+                groups.append(group)
+                group = []
+            group.append(summary)
+        groups.append(group)
+        if len(groups) == len(summaries):
+            # Every summary is over budget on its own; merging further won't help
+            break
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS) as executor:
+            summaries = list(executor.map(lambda group: merge_summaries(question, group, model), groups))
+
+    message = f"My question was: \"{question}\"\n\n" + "\n\n".join(f"Summary of chunk {number}:\n{summary}" for number, summary in enumerate(summaries, 1))
+    # The user's run instructions apply to this answer like they do to a single-prompt interpretation
+    system_prompt = {"content": REDUCE_PROMPT["content"] + (f"\n\nAlso follow these instructions:\n{instructions}" if instructions else "")}
+    on_text = (lambda text: placeholder.markdown(text + "▌")) if placeholder is not None else None
+    answer = complete(message, system_prompt, model, temperature=REDUCE_TEMPERATURE, on_text=on_text)
+    if placeholder is not None:
+        placeholder.markdown(answer)
+    return answer
+
+def interpret_map_reduce(question, records, url="", model=None, budget=None, placeholder=None, progress=None, instructions=None, total=None):
+    """Interpret a result that is too large for one prompt.
+
+    Chunks of records, sized to the model's context window, are summarised concurrently
+    (at most MAX_PARALLEL_CALLS at a time), then the partial summaries are reduced into one
+    answer that streams into the placeholder. Chunks are submitted as they come off `records`,
+    so pager fetches overlap the LLM calls; `total` is the most records the pager will yield.
+    A chunk that fails is reported to the reducer with its error instead of being left out.
+    If `records` itself raises, queued chunks are cancelled and the error is raised.
+    """
+    budget = budget or context_budget(model)
+    futures = []
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_CALLS) as executor:
+        try:
+            for number, chunk in enumerate(iter_chunks(records, url, budget, model, total), 1):
+                futures.append(executor.submit(summarise_chunk, question, chunk, number, url, budget, model))
+                if progress is not None:
+                    progress.info(f":jigsaw: Summarising chunk {number}...")
+        except Exception:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if progress is not None:
+                progress.empty()
+            raise
+        summaries = []
+        for number, future in enumerate(futures, 1):
+            try:
+                summary = future.result()
+            except Exception as e:
+                write_debug(f":warning: Chunk {number} could not be summarised: {str(e)}")
+                summary = f"(chunk {number} could not be summarised: {str(e)})"
+            summaries.append(summary or f"(chunk {number} could not be summarised)")
+            if progress is not None:
+                progress.info(f":jigsaw: {number} of {len(futures)} chunks summarised")
+    if progress is not None:
+        progress.empty()
+    try:
+        return reduce_summaries(question, summaries, budget, model, placeholder, instructions)
+    except Exception as e:
+        write_debug(f":warning: Could not combine the chunk summaries: {str(e)}")
+        return f"An error occurred while combining the chunk summaries: {str(e)}"
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+import streamlit as st
+from utils.cache_dir import get_cache_path
+
+# Histogram bucket upper bounds in seconds, Prometheus style (+Inf is implied)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Durations kept per stage for the p50/p95 in the panel
+RECENT_SAMPLES = 1000
+METRIC_PREFIX = "intune_ninja"
+# Where export_metrics writes metrics.prom and metrics.json (e.g. for node_exporter's textfile collector)
+METRICS_DIR = os.environ.get("INTUNE_NINJA_METRICS_DIR")
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        # Numeric span attributes (tokens, bytes, pages, cache hits) summed over all spans
+        self.attributes = {}
+
+class MetricsRegistry:
+    """Latency histograms and attribute totals per stage, shared by all sessions.
+
+    Stages are timed with span(); numeric attributes set on a span (True counts as 1)
+    are added up per stage, so cache hits, tokens and bytes can be read next to the latency.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        # Bumped on every change, so exports can tell whether anything was recorded since
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, attributes=None, error=False):
+        with self._lock:
+            stats = self.stages.setdefault(stage, StageStats())
+            self.version += 1
+            stats.count += 1
+            stats.errors += int(error)
+            stats.total_seconds += seconds
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.recent.append(seconds)
+            for name, value in (attributes or {}).items():
+                if isinstance(value, (bool, int, float)):
+                    stats.attributes[name] = stats.attributes.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        # The caller can add attributes to the yielded dict while the span is open
+        started = time.perf_counter()
+        error = False
+        try:
+            yield attributes
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, attributes, error)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {stage: (stats.count, stats.errors, stats.total_seconds, list(stats.buckets), list(stats.recent), dict(stats.attributes))
+                      for stage, stats in self.stages.items()}
+        snapshot = {"started": self.started, "stages": {}}
+        for stage, (count, errors, total_seconds, buckets, recent, attributes) in sorted(stages.items()):
+            p50, p95 = np.percentile(recent, [50, 95]) if recent else (0.0, 0.0)
+            snapshot["stages"][stage] = {
+                "count": count,
+                "errors": errors,
+                "sum_seconds": round(total_seconds, 6),
+                "p50_seconds": round(float(p50), 6),
+                "p95_seconds": round(float(p95), 6),
+                "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], np.cumsum(buckets).tolist())),
+                "attributes": attributes
+            }
+        return snapshot
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Duration of each app stage.", f"# TYPE {name} histogram"]
+        for stage, stats in snapshot["stages"].items():
+            lines.extend(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}' for bound, count in stats["buckets"].items())
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum_seconds"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        lines.extend([f"# HELP {METRIC_PREFIX}_stage_errors_total Stage runs that raised.", f"# TYPE {METRIC_PREFIX}_stage_errors_total counter"])
+        lines.extend(f'{METRIC_PREFIX}_stage_errors_total{{stage="{stage}"}} {stats["errors"]}' for stage, stats in snapshot["stages"].items())
+        lines.extend([f"# HELP {METRIC_PREFIX}_stage_attribute_total Span attributes summed per stage.", f"# TYPE {METRIC_PREFIX}_stage_attribute_total counter"])
+        for stage, stats in snapshot["stages"].items():
+            lines.extend(f'{METRIC_PREFIX}_stage_attribute_total{{stage="{stage}",attribute="{attribute}"}} {value:g}'
+                         for attribute, value in sorted(stats["attributes"].items()))
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.started = time.time()
+            self.version += 1
+
+# A plain module-level instance rather than st.cache_resource: spans are also recorded
+# from worker threads (token refresh, map-reduce, exports) that have no script context
+_registry = MetricsRegistry()
+
+def get_metrics():
+    return _registry
+
+def span(stage, **attributes):
+    return _registry.span(stage, **attributes)
+
+# Registry version last written per export directory
+_exported_versions = {}
+
+def export_metrics(directory=METRICS_DIR):
+    # Written atomically, so a scraper never reads half a file, and only when something was
+    # recorded since the last export rather than on every rerun
+    version = _registry.version
+    changed = _exported_versions.get(directory) != version
+    paths = {}
+    for file_name, render in (("metrics.prom", _registry.to_prometheus), ("metrics.json", _registry.to_json)):
+        path = os.path.join(directory, file_name) if directory else get_cache_path("metrics", file_name)
+        if changed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", 'w', encoding='utf-8') as file:
+                file.write(render())
+            os.replace(path + ".tmp", path)
+        paths[file_name] = path
+    _exported_versions[directory] = version
+    return paths
+
+def render_metrics_panel():
+    # Drawn once per rerun, after the stages of this run have been recorded
+    snapshot = _registry.snapshot()
+    if 'metrics_container' not in st.session_state:
+        st.session_state.metrics_container = st.sidebar.empty()
+
+    with st.session_state.metrics_container.container():
+        with st.expander(f"Metrics ({len(snapshot['stages'])} stages)", expanded=False, icon="⏱️"):
+            if not snapshot["stages"]:
+                st.caption("Nothing recorded yet.")
+                return
+            st.dataframe([
+                {"stage": stage, "count": stats["count"], "errors": stats["errors"],
+                 "p50 (ms)": round(stats["p50_seconds"] * 1000, 1), "p95 (ms)": round(stats["p95_seconds"] * 1000, 1),
+                 **{attribute: round(value, 3) for attribute, value in stats["attributes"].items()}}
+                for stage, stats in snapshot["stages"].items()
+            ], hide_index=True)
+            col1, col2 = st.columns(2)
+            col1.download_button("Prometheus", _registry.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+            col2.download_button("JSON", _registry.to_json(), file_name="metrics.json", mime="application/json")
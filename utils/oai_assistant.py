@@ -1,14 +1,68 @@
 from openai import OpenAI
 import os, sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import yaml
+from utils.cache_dir import get_cache_path
+from utils.headless import has_session, get_env_secret
+
+# Uploads in flight at once; each holds one open file handle
+MAX_PARALLEL_UPLOADS = 4
 
 def get_user_secret(key):
+    if not has_session():
+        return get_env_secret(key)
     if 'user_secrets' not in st.session_state:
         st.error("User secrets not initialized. Please refresh the page.")
         return None
     return st.session_state.user_secrets.get(key)
 
+class AssistantRegistry:
+    """Assistant and vector store ids per API key, persisted in .cache and shared by all sessions.
+
+    Each entry also records what the assistant was set up with (instructions and docs
+    hashes), so a new session can trust it after a single retrieve call. The model is not
+    part of it: every run passes the session's model, so sessions on different models
+    share one assistant.
+    """
+
+    def __init__(self):
+        self.path = get_cache_path("assistant", "registry.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, key_hash):
+        with self._lock:
+            return dict(self.entries.get(key_hash) or {})
+
+    def _save(self):
+        # Called with the lock held
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def put(self, key_hash, entry):
+        with self._lock:
+            self.entries[key_hash] = entry
+            self._save()
+
+    def remove(self, key_hash):
+        with self._lock:
+            if self.entries.pop(key_hash, None) is not None:
+                self._save()
+
+@st.cache_resource(show_spinner=False)
+def get_assistant_registry():
+    return AssistantRegistry()
+
 class Assistant:
     def __init__(self, client):
         sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -20,6 +74,14 @@ class Assistant:
         self.uploads_path = os.sep.join(["files", "graph_api_docs"])
         self.assistant = None
         self.assistant_vector_store_id = None
+        # Set when retrieve_assistant took the registry fast path
+        self.from_registry = False
+        # Vector stores moved out of client.beta in newer SDKs
+        self.vector_stores = getattr(client.beta, 'vector_stores', None) or client.vector_stores
+        # One manifest per API key, since each key sees its own files and vector stores
+        self.key_hash = hashlib.sha256(str(client.api_key).encode()).hexdigest()[:12]
+        self.manifest_path = get_cache_path("assistant", f"vector_store_{self.key_hash}.json")
+        self.instructions_hash = hashlib.sha256(f"{self.assistant_name}\n{self.assistant_instructions}".encode()).hexdigest()
 
     def create_assistant(self):
         st.info("Creating new Intune Copilot assistant...")
@@ -35,7 +97,7 @@ class Assistant:
     def create_vector_store(self):
         st.info("Creating new vector store...")
         try:
-            vector_store = self.client.beta.vector_stores.create(
+            vector_store = self.vector_stores.create(
                 name=self.assistant_vector_store_name,
             )
             self.assistant_vector_store_id = vector_store.id
@@ -46,37 +108,156 @@ class Assistant:
             st.warning("Proceeding without a vector store. Some functionality may be limited.")
             return None
 
-    def upload_files(self):
-        st.info("Uploading files to vector store...")
+    def load_manifest(self):
+        # {"vector_store_id": ..., "files": {path: {"hash": ..., "file_id": ...}}}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"vector_store_id": None, "files": {}}
+
+    def save_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def local_files(self):
+        # Supported files in the uploads folder, with the sha256 of their content
         with open(os.path.join(os.curdir, "utils", "file_types.yml"), 'r') as file:
             file_types = yaml.safe_load(file)
 
-        supported_extensions = list(file_types.keys())
+        supported_extensions = tuple(file_types.keys())
+        hashes = {}
+        for name in sorted(os.listdir(self.uploads_path)):
+            if name.endswith(supported_extensions):
+                file_path = os.path.join(self.uploads_path, name)
+                with open(file_path, 'rb') as file:
+                    hashes[file_path.replace(os.sep, '/')] = hashlib.sha256(file.read()).hexdigest()
+        return hashes
+
+    def upload_file(self, file_path):
+        with open(file_path, 'rb') as file:
+            vector_store_file = self.vector_stores.files.upload_and_poll(
+                vector_store_id=self.assistant_vector_store_id,
+                file=file
+            )
+        if vector_store_file.status == "failed":
+            raise ValueError(f"Indexing {file_path} failed: {vector_store_file.last_error}")
+        return vector_store_file.id
+
+    def delete_file(self, file_id):
+        # Already gone is fine, the goal is that it isn't there anymore
+        try:
+            self.vector_stores.files.delete(file_id=file_id, vector_store_id=self.assistant_vector_store_id)
+        except Exception:
+            pass
+        try:
+            self.client.files.delete(file_id)
+        except Exception:
+            pass
+
+    def upload_files(self, local_files=None):
+        """Bring the vector store in line with the uploads folder.
+
+        Only new or changed files (by content hash) are uploaded, files that are no longer
+        in the folder are deleted, and the result is recorded in the local manifest.
+        """
+        manifest = self.load_manifest()
+        if manifest.get("vector_store_id") != self.assistant_vector_store_id:
+            # A different vector store: nothing we recorded is in it
+            manifest = {"vector_store_id": self.assistant_vector_store_id, "files": {}}
+
+        local_files = local_files if local_files is not None else self.local_files()
+        uploaded = manifest["files"]
+        stale = [path for path, entry in uploaded.items() if local_files.get(path) != entry["hash"]]
+        to_upload = [path for path, file_hash in local_files.items() if uploaded.get(path, {}).get("hash") != file_hash]
+
+        for path in stale:
+            self.delete_file(uploaded.pop(path)["file_id"])
 
-        files_to_upload = [os.path.join(self.uploads_path, f) for f in os.listdir(self.uploads_path) if f.endswith(tuple(supported_extensions))]
-        file_streams = [open(file_path, "rb") for file_path in files_to_upload]
-        
-        file_batch = self.client.beta.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=self.assistant_vector_store_id,
-            files=file_streams
+        if to_upload:
+            st.info(f"Uploading {len(to_upload)} new or changed files to the vector store...")
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL_UPLOADS) as executor:
+                futures = {path: executor.submit(self.upload_file, path) for path in to_upload}
+                for path, future in futures.items():
+                    try:
+                        uploaded[path] = {"hash": local_files[path], "file_id": future.result()}
+                    except Exception as e:
+                        st.warning(f"Failed to upload {path}: {str(e)}")
+        self.save_manifest(manifest)
+
+        in_sync = len(uploaded) == len(local_files)
+        st.info(f"Vector store {'in sync' if in_sync else 'partially synced'}: {len(to_upload)} uploaded, {len(stale)} removed, {len(uploaded)} files total")
+        return in_sync
+
+    def get_vector_store(self):
+        # Reuse the vector store from the manifest as long as it still exists
+        vector_store_id = self.load_manifest().get("vector_store_id")
+        if vector_store_id:
+            try:
+                self.vector_stores.retrieve(vector_store_id)
+                return vector_store_id
+            except Exception:
+                st.warning("The vector store in the manifest no longer exists.")
+        return self.create_vector_store()
+
+    def attach_vector_store(self):
+        tool_resources = getattr(self.assistant, 'tool_resources', None)
+        file_search = getattr(tool_resources, 'file_search', None) if tool_resources else None
+        if self.assistant_vector_store_id in (getattr(file_search, 'vector_store_ids', None) or []):
+            return
+        self.assistant = self.client.beta.assistants.update(
+            assistant_id=self.assistant.id,
+            tool_resources={"file_search": {"vector_store_ids": [self.assistant_vector_store_id]}}
         )
+        st.success(f"Vector store {self.assistant_vector_store_id} attached to the assistant.")
 
-        st.success(f"File upload status: {file_batch.status}")
-        st.info(f"File upload counts: {str(file_batch.file_counts)}")
+    def docs_hash(self, local_files):
+        return hashlib.sha256(json.dumps(local_files, sort_keys=True).encode()).hexdigest()
+
+    def retrieve_registered(self, docs_hash):
+        # Fast path: one retrieve call, as long as nothing the assistant was set up with has changed
+        entry = get_assistant_registry().get(self.key_hash)
+        if not entry or (entry.get("instructions_hash"), entry.get("docs_hash")) != (self.instructions_hash, docs_hash):
+            return None
+        try:
+            assistant = self.client.beta.assistants.retrieve(entry["assistant_id"])
+        except Exception:
+            get_assistant_registry().remove(self.key_hash)
+            return None
+        file_search = getattr(getattr(assistant, 'tool_resources', None), 'file_search', None)
+        if entry["vector_store_id"] not in (getattr(file_search, 'vector_store_ids', None) or []):
+            return None
+        self.assistant = assistant
+        self.assistant_vector_store_id = entry["vector_store_id"]
+        self.from_registry = True
+        return assistant
+
+    def register(self, docs_hash):
+        get_assistant_registry().put(self.key_hash, {
+            "assistant_id": self.assistant.id,
+            "vector_store_id": self.assistant_vector_store_id,
+            "instructions_hash": self.instructions_hash,
+            "docs_hash": docs_hash
+        })
 
     def retrieve_assistant(self):
         try:
             if self.assistant is not None:
                 return self.assistant
 
+            local_files = self.local_files()
+            docs_hash = self.docs_hash(local_files)
+            if self.retrieve_registered(docs_hash):
+                return self.assistant
+
             assistants_list = self.client.beta.assistants.list()
             self.assistant = next((assistant for assistant in assistants_list if assistant.name == self.assistant_name), None)
             
             if self.assistant is None:
                 st.info("Creating new Intune Copilot assistant...")
                 self.assistant = self.create_assistant()
-                self.assistant_vector_store_id = self.create_vector_store()
-                self.upload_files()
             else:
                 st.info(f"Intune Copilot assistant found. (id: {self.assistant.id})")
                 
@@ -95,14 +276,23 @@ class Assistant:
                     st.success("File search tool added to the assistant.")
                 else:
                     st.info("Assistant already has a file_search tool.")
-                
-                # Check if we have a vector store ID stored
-                if not hasattr(self, 'assistant_vector_store_id'):
-                    self.assistant_vector_store_id = self.create_vector_store()
-                    self.upload_files()
-                else:
-                    st.info(f"Using existing vector store. ID: {self.assistant_vector_store_id}")
-            
+
+                # The model is not updated here: each run passes its own
+                if self.assistant.instructions != self.assistant_instructions:
+                    st.info("Updating the assistant's instructions...")
+                    self.assistant = self.client.beta.assistants.update(
+                        assistant_id=self.assistant.id,
+                        instructions=self.assistant_instructions
+                    )
+
+            self.assistant_vector_store_id = self.get_vector_store()
+            if self.assistant_vector_store_id:
+                in_sync = self.upload_files(local_files)
+                self.attach_vector_store()
+                # Failed uploads are retried by the next session instead of taking the fast path
+                if in_sync:
+                    self.register(docs_hash)
+
             return self.assistant
 
         except Exception as e:
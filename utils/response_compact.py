@@ -0,0 +1,191 @@
+import json
+from collections import Counter
+from functools import lru_cache
+from utils.graph_validate import referenced_properties
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_TOKEN_BUDGET = 6000
+# Context windows in tokens, by model name prefix; unknown models are assumed to match gpt-4o
+CONTEXT_WINDOWS = {"gpt-4o": 128000, "gpt-4-turbo": 128000, "gpt-4.1": 1047576, "gpt-4": 8192, "gpt-3.5-turbo": 16385}
+DEFAULT_CONTEXT_WINDOW = 128000
+# Share of the context window records may take; instructions, history and the answer need the rest
+CONTEXT_SHARE = 0.75
+# Assistants API messages are capped at 256,000 characters, and a token is rarely more than 4 of them
+MESSAGE_TOKEN_LIMIT = 256000 // 4
+# Share of the budget the table may use; the header and summaries get the rest
+TABLE_SHARE = 0.8
+# Columns with at most this share of distinct values may be dictionary-encoded
+DICTIONARY_RATIO = 0.5
+TOP_VALUES = 3
+
+@lru_cache(maxsize=8)
+def _get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except (KeyError, ValueError):
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text, model=None):
+    # Without tiktoken, ~4 characters per token is close enough for JSON-ish text
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_get_encoding(model or "gpt-4o").encode(text, disallowed_special=()))
+
+def context_budget(model=None):
+    name = model or "gpt-4o"
+    prefix = max((prefix for prefix in CONTEXT_WINDOWS if name.startswith(prefix)), key=len, default=None)
+    return int(CONTEXT_WINDOWS.get(prefix, DEFAULT_CONTEXT_WINDOW) * CONTEXT_SHARE)
+
+def message_budget(model=None):
+    # Token budget for a digest that is posted to the assistant thread as one message
+    return min(context_budget(model), MESSAGE_TOKEN_LIMIT)
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+def flatten_record(record, prefix=""):
+    # Nested objects become 'parent/child' columns, the way Graph addresses them
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(flatten_record(value, f"{name}/"))
+        elif not _is_empty(value) and not key.startswith('@odata'):
+            flat[name] = json.dumps(value) if isinstance(value, list) else value
+    return flat
+
+def _cell(value):
+    text = str(value).lower() if isinstance(value, bool) else str(value)
+    return text.replace('\t', ' ').replace('\n', ' ')
+
+def _summarise(name, values, total):
+    present = [value for value in values if value is not None]
+    numbers = [value for value in present if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    if numbers and len(numbers) == len(present):
+        return f"{name}: {len(present)}/{total} set, min {min(numbers)}, max {max(numbers)}, mean {sum(numbers) / len(numbers):.4g}"
+    counts = Counter(_cell(value) for value in present)
+    top = ', '.join(f"{value[:60]} ({count})" for value, count in counts.most_common(TOP_VALUES))
+    return f"{name}: {len(present)}/{total} set, {len(counts)} distinct, top: {top}"
+
+def _encode_column(values, model):
+    # Dictionary-encode only when the legend plus the codes cost fewer tokens than the raw values
+    cells = [_cell(value) for value in values if value is not None]
+    raw_cost = count_tokens('\t'.join(cells), model) if cells else 0
+    distinct = Counter(cells)
+    if len(values) < 2 or len(distinct) > DICTIONARY_RATIO * len(values):
+        return raw_cost, None
+    # Most frequent value gets the shortest code
+    dictionary = {value: code for code, (value, _) in enumerate(distinct.most_common())}
+    legend = ", ".join(f"{code}={value}" for value, code in dictionary.items())
+    encoded_cost = count_tokens(legend, model) + count_tokens('\t'.join(str(dictionary[cell]) for cell in cells), model)
+    return (encoded_cost, dictionary) if encoded_cost < raw_cost else (raw_cost, None)
+
+def compact_records(records, url="", budget=DEFAULT_TOKEN_BUDGET, model=None):
+    """Render Graph records as a compact, token-budgeted table for the LLM.
+
+    Null and empty fields are dropped, constant columns are stated once, repetitive
+    columns are dictionary-encoded when that is cheaper, and the columns the query
+    referenced are kept first. Rows, then columns that don't fit the budget are
+    summarised instead.
+    """
+    rows = [flatten_record(record) for record in records if isinstance(record, dict)]
+    if not rows:
+        return "No records."
+    columns = []
+    for row in rows:
+        columns.extend(name for name in row if name not in columns)
+    values = {name: [row.get(name) for row in rows] for name in columns}
+
+    constant = {}
+    for name in columns:
+        distinct = {_cell(value) for value in values[name] if value is not None}
+        if len(rows) > 1 and len(distinct) == 1 and all(value is not None for value in values[name]):
+            constant[name] = next(iter(distinct))
+
+    referenced = [name for name in referenced_properties(url) if name in values]
+    for name in referenced_properties(url):
+        # $select=configurationManagerClientEnabledFeatures keeps all of its flattened columns
+        referenced.extend(column for column in columns if column.startswith(f"{name}/") and column not in referenced)
+    ordered = referenced + [name for name in columns if name not in referenced]
+    candidates = [name for name in ordered if name not in constant]
+    table_budget = budget * TABLE_SHARE
+
+    def layout(row_limit, keep_referenced=True):
+        # Columns and their dictionaries for the rows actually shown, legends included in the cost
+        kept, dictionaries, used = [], {}, 0
+        for name in candidates:
+            shown = values[name][:row_limit]
+            if all(value is None for value in shown):
+                continue
+            cost, dictionary = _encode_column(shown, model)
+            if (keep_referenced and name in referenced) or used + cost <= table_budget:
+                kept.append(name)
+                used += cost
+                if dictionary is not None:
+                    dictionaries[name] = dictionary
+        return kept, dictionaries, used
+
+    def build(row_limit, kept, dictionaries, summary_limit=None):
+        def render(name, value):
+            if value is None:
+                return ""
+            return str(dictionaries[name][_cell(value)]) if name in dictionaries else _cell(value)
+
+        lines = [f"Records: {len(rows)}" + (f" (table shows the first {row_limit})" if row_limit < len(rows) else "")]
+        if constant:
+            lines.append("Same for every record: " + ", ".join(f"{name}={value}" for name, value in constant.items()))
+        encoded = [name for name in kept if name in dictionaries]
+        if encoded:
+            lines.append("Codes used in the table:")
+            lines.extend(f"  {name}: " + ", ".join(f"{code}={value}" for value, code in dictionaries[name].items()) for name in encoded)
+        if kept:
+            lines.append("Table (tab separated, empty = not set):")
+            lines.append('\t'.join(kept))
+            lines.extend('\t'.join(render(name, row.get(name)) for name in kept) for row in rows[:row_limit])
+        summaries = [name for name in candidates if name not in kept] + (kept if row_limit < len(rows) else [])
+        if summaries:
+            lines.append("Summary over all records" + (" of the columns not in the table:" if row_limit == len(rows) else ":"))
+            lines.extend(f"  {_summarise(name, values[name], len(rows))}" for name in summaries[:summary_limit])
+            if summary_limit is not None and summary_limit < len(summaries):
+                lines.append(f"  ({len(summaries) - summary_limit} more columns left out)")
+        return '\n'.join(lines)
+
+    row_limit = len(rows)
+    kept, dictionaries, used = layout(row_limit)
+    if used > table_budget:
+        row_limit = max(1, int(row_limit * table_budget / used))
+        kept, dictionaries, used = layout(row_limit)
+    text = build(row_limit, kept, dictionaries)
+    # The estimate is per column; trim rows until the whole text really fits
+    while row_limit > 1 and count_tokens(text, model) > budget:
+        row_limit = max(1, row_limit * 3 // 4)
+        kept, dictionaries, used = layout(row_limit)
+        text = build(row_limit, kept, dictionaries)
+    if count_tokens(text, model) > budget:
+        # Not even one row of the referenced columns fits: summarise those too
+        kept, dictionaries, used = layout(row_limit, keep_referenced=False)
+        text = build(row_limit, kept, dictionaries)
+    summary_limit = len(candidates)
+    while summary_limit > 0 and count_tokens(text, model) > budget:
+        summary_limit = summary_limit * 3 // 4
+        text = build(row_limit, kept, dictionaries, summary_limit)
+    return text
+
+def compact_graph_response(response_text, records=None, url="", budget=DEFAULT_TOKEN_BUDGET, model=None):
+    # Errors and other non-JSON responses go through untouched
+    if records is None:
+        try:
+            response = json.loads(response_text)
+        except (TypeError, ValueError):
+            return response_text
+        if not isinstance(response, dict) or not isinstance(response.get('data'), list):
+            return response_text
+        records = response['data']
+        more = "\nMore pages are available that were not fetched." if response.get('next_link') else ""
+    else:
+        more = ""
+    return compact_records(records, url, budget, model) + more
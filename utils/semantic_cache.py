@@ -0,0 +1,121 @@
+import re
+import time
+import hashlib
+import threading
+import numpy as np
+import streamlit as st
+
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 2000
+# Quoted values, numbers and identifiers (PC-001, user@contoso.com, device_name); capitalisation doesn't count
+LITERAL_PATTERN = re.compile(r"\"[^\"]+\"|'[^']+'|\S*\d\S*|\S*\w[@_-]\w\S*")
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+def literal_tokens(query):
+    # "Windows 10" and "Windows 11" embed almost the same, but need different URLs
+    return frozenset(token.strip(".,;:!?()'\"").lower() for token in LITERAL_PATTERN.findall(query.strip()))
+
+def cache_fingerprint(*parts):
+    # Entries are only valid for the prompt/model combination that produced them
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:16]
+
+class SemanticCache:
+    """In-process cache from natural-language queries to generated Graph URLs.
+
+    Query embeddings live in one preallocated float32 matrix, so a lookup is a single
+    matrix-vector product followed by a top-k. Exact repeats skip the embedding entirely.
+    Every entry keeps the fingerprint (system prompt and model) it was generated with and
+    only matches lookups with the same one; a semantic match also needs the same literals.
+    """
+
+    def __init__(self, capacity=MAX_ENTRIES, threshold=SIMILARITY_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.vectors = None
+        self.entries = [None] * capacity
+        self.last_used = np.zeros(capacity)
+        # Fingerprint of each row as a small int, -1 for an empty row
+        self.fingerprint_ids = np.full(capacity, -1, dtype=np.int32)
+        self.fingerprints = {}
+        self.size = 0
+        self.exact = {}
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def _fingerprint_id(self, fingerprint):
+        return self.fingerprints.setdefault(fingerprint, len(self.fingerprints))
+
+    def get_exact(self, query, fingerprint):
+        with self._lock:
+            row = self.exact.get((fingerprint, normalize_query(query)))
+            if row is None:
+                return None
+            self.last_used[row] = time.time()
+            self.stats["exact_hits"] += 1
+            return self.entries[row]
+
+    def lookup(self, vector, fingerprint, query, k=3):
+        # Returns [(entry, score)] for the k best matches above the threshold
+        literals = literal_tokens(query)
+        with self._lock:
+            rows = np.flatnonzero(self.fingerprint_ids[:self.size] == self._fingerprint_id(fingerprint))
+            if len(rows) == 0:
+                self.stats["misses"] += 1
+                return []
+            vector = np.asarray(vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            scores = self.vectors[rows] @ vector
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            matches = [(rows[position], float(scores[position])) for position in top
+                       if scores[position] >= self.threshold and self.entries[rows[position]]["literals"] == literals]
+            if matches:
+                self.last_used[matches[0][0]] = time.time()
+                self.stats["semantic_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+            return [(self.entries[row], score) for row, score in matches]
+
+    def insert(self, vector, fingerprint, query, result):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+                self.vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self.size = 0
+                self.exact = {}
+                self.fingerprint_ids[:] = -1
+            if self.size < self.capacity:
+                row = self.size
+                self.size += 1
+            else:
+                # Evict the least recently used entry, whatever its fingerprint
+                row = int(np.argmin(self.last_used))
+                evicted = self.entries[row]
+                self.exact.pop((evicted["fingerprint"], normalize_query(evicted["query"])), None)
+                self.stats["evictions"] += 1
+            self.vectors[row] = vector
+            self.fingerprint_ids[row] = self._fingerprint_id(fingerprint)
+            self.entries[row] = {"query": query, "result": result, "fingerprint": fingerprint, "literals": literal_tokens(query)}
+            self.last_used[row] = time.time()
+            self.exact[(fingerprint, normalize_query(query))] = row
+
+    def invalidate(self):
+        with self._lock:
+            self.size = 0
+            self.entries = [None] * self.capacity
+            self.last_used[:] = 0
+            self.fingerprint_ids[:] = -1
+            self.exact = {}
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=self.size)
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    # One cache per process: every session benefits from the queries the others asked
+    return SemanticCache()
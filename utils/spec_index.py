@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+import streamlit as st
+from utils.cache_dir import get_cache_path
+
+SPEC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files', 'graph_api_docs', 'DeviceManagement.json')
+INDEX_FILE = get_cache_path("spec_index", "DeviceManagement.sqlite")
+
+# Bump when the layout of the index changes so old builds get recompiled
+INDEX_FORMAT = "1"
+
+SCHEMA_PREFIX = "#/components/schemas/"
+ID_SEGMENT = "{id}"
+
+def _spec_hash(spec_file):
+    with open(spec_file, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest() + "-" + INDEX_FORMAT
+
+def normalize_template(path):
+    # '/deviceManagement/managedDevices/{managedDevice-id}' -> 'deviceManagement/managedDevices/{id}'
+    return '/'.join(ID_SEGMENT if segment.startswith('{') else segment for segment in path.strip('/').split('/'))
+
+class _SpecCompiler:
+    def __init__(self, spec):
+        self.spec = spec
+        self.components = spec.get('components', {})
+        self.schemas = self.components.get('schemas', {})
+
+    def resolve(self, node):
+        # Follow a $ref into the components section
+        while isinstance(node, dict) and '$ref' in node:
+            section, name = node['$ref'].split('/')[-2:]
+            node = self.components.get(section, {}).get(name, {})
+        return node
+
+    def schema_name(self, node):
+        if not isinstance(node, dict):
+            return None
+        if '$ref' in node and node['$ref'].startswith(SCHEMA_PREFIX):
+            return node['$ref'][len(SCHEMA_PREFIX):]
+        for key in ('anyOf', 'oneOf', 'allOf'):
+            for option in node.get(key, []):
+                name = self.schema_name(option)
+                if name:
+                    return name
+        return None
+
+    def property_type(self, node):
+        name = self.schema_name(node)
+        if name:
+            schema = self.schemas.get(name, {})
+            return f"enum:{name}" if 'enum' in schema else name
+        if node.get('type') == 'array':
+            return f"Collection({self.property_type(node.get('items', {}))})"
+        if 'format' in node and node['format'] in ('date-time', 'date', 'duration', 'uuid', 'int32', 'int64', 'double', 'float'):
+            return node['format']
+        for key in ('anyOf', 'oneOf'):
+            for option in node.get(key, []):
+                if option.get('type'):
+                    return self.property_type(option)
+        return node.get('type', 'object')
+
+    def properties(self, name, seen=None):
+        # Flatten allOf inheritance (managedDevice -> entity) into one property map
+        seen = seen or set()
+        if name in seen:
+            return {}
+        seen.add(name)
+        schema = self.schemas.get(name, {})
+        properties = {}
+        for part in schema.get('allOf', []):
+            base = self.schema_name(part)
+            if base:
+                properties.update(self.properties(base, seen))
+            else:
+                properties.update({key: self.property_type(value) for key, value in part.get('properties', {}).items()})
+        properties.update({key: self.property_type(value) for key, value in schema.get('properties', {}).items()})
+        return properties
+
+    def response_entity(self, operation):
+        # Returns (entity schema name, is_collection) for a GET operation
+        responses = operation.get('responses', {})
+        response = self.resolve(responses.get('2XX') or responses.get('200') or {})
+        schema_node = response.get('content', {}).get('application/json', {}).get('schema', {})
+        name = self.schema_name(schema_node)
+        if name and name.endswith('CollectionResponse'):
+            items = self.schemas.get(name, {}).get('properties', {}).get('value', {}).get('items', {})
+            return self.schema_name(items), True
+        if schema_node.get('type') == 'array':
+            return self.schema_name(schema_node.get('items', {})), True
+        return name, False
+
+    def query_options(self, operation):
+        options = []
+        for parameter in operation.get('parameters', []):
+            parameter = self.resolve(parameter)
+            if parameter.get('in') == 'query':
+                options.append(parameter['name'])
+        return options
+
+    def compile(self, db):
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE paths (path TEXT PRIMARY KEY, methods TEXT, query_options TEXT, entity TEXT, collection INTEGER, summary TEXT)")
+        db.execute("CREATE TABLE prefixes (prefix TEXT PRIMARY KEY)")
+        db.execute("CREATE TABLE schemas (name TEXT PRIMARY KEY, kind TEXT, enum_values TEXT)")
+        db.execute("CREATE TABLE properties (entity TEXT, name TEXT, type TEXT, PRIMARY KEY (entity, name))")
+
+        entities = set()
+        prefixes = set()
+        for raw_path, item in self.spec.get('paths', {}).items():
+            path = normalize_template(raw_path)
+            segments = path.split('/')
+            prefixes.update('/'.join(segments[:i]) for i in range(1, len(segments) + 1))
+            methods = sorted(method.upper() for method in item if method in ('get', 'post', 'patch', 'put', 'delete'))
+            get = item.get('get', {})
+            entity, collection = self.response_entity(get) if get else (None, False)
+            if entity:
+                entities.add(entity)
+            db.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?, ?, ?)",
+                       (path, ','.join(methods), ','.join(self.query_options(get)), entity, int(collection), get.get('summary', '')))
+        db.executemany("INSERT INTO prefixes VALUES (?)", [(prefix,) for prefix in prefixes])
+
+        for name, schema in self.schemas.items():
+            if 'enum' in schema:
+                db.execute("INSERT INTO schemas VALUES (?, ?, ?)", (name, 'enum', json.dumps(schema['enum'])))
+                continue
+            db.execute("INSERT INTO schemas VALUES (?, ?, ?)", (name, 'entity' if name in entities else 'complex', None))
+            db.executemany("INSERT INTO properties VALUES (?, ?, ?)",
+                           [(name, prop, prop_type) for prop, prop_type in self.properties(name).items()])
+
+        db.execute("INSERT INTO meta VALUES ('version', ?)", (self.spec.get('info', {}).get('version', 'v1.0'),))
+
+def build_spec_index(spec_file=SPEC_FILE, index_file=INDEX_FILE):
+    with open(spec_file, 'r', encoding='utf-8') as file:
+        spec = json.load(file)
+    tmp_file = index_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    db = sqlite3.connect(tmp_file)
+    try:
+        with db:
+            _SpecCompiler(spec).compile(db)
+            db.execute("INSERT INTO meta VALUES ('source_hash', ?)", (_spec_hash(spec_file),))
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    os.replace(tmp_file, index_file)
+    return index_file
+
+class SpecIndex:
+    """Read-only view of the compiled DeviceManagement OpenAPI index.
+
+    The SQLite file is memory-mapped, and lookups are memoized, so repeated path and
+    property questions cost microseconds instead of parsing the 2 MB spec.
+    """
+
+    def __init__(self, index_file=INDEX_FILE):
+        self.db = sqlite3.connect(f"file:{index_file}?mode=ro", uri=True, check_same_thread=False)
+        self.db.execute("PRAGMA mmap_size = 67108864")
+        self._lock = threading.Lock()
+        self.version = self._query_one("SELECT value FROM meta WHERE key = 'version'")[0]
+
+    def _query_one(self, sql, args=()):
+        with self._lock:
+            return self.db.execute(sql, args).fetchone()
+
+    def _query_all(self, sql, args=()):
+        with self._lock:
+            return self.db.execute(sql, args).fetchall()
+
+    @lru_cache(maxsize=4096)
+    def resolve_path(self, path):
+        # Match a concrete path ('deviceManagement/managedDevices/abc/detectedApps') to its template
+        segments = []
+        for segment in path.strip('/').split('/'):
+            # Keys can also be written inline, e.g. managedDevices('abc')
+            match = re.fullmatch(r"([^(]+)\((.+)\)", segment)
+            segments.extend([match.group(1), match.group(2)] if match else [segment] if segment else [])
+
+        def walk(prefix, remaining):
+            if not remaining:
+                return prefix if self._query_one("SELECT 1 FROM paths WHERE path = ?", (prefix,)) else None
+            # Prefer a literal segment, fall back to treating it as a key
+            for candidate in (remaining[0], ID_SEGMENT):
+                next_prefix = f"{prefix}/{candidate}" if prefix else candidate
+                if self._query_one("SELECT 1 FROM prefixes WHERE prefix = ?", (next_prefix,)):
+                    result = walk(next_prefix, remaining[1:])
+                    if result:
+                        return result
+            return None
+
+        return walk("", segments) if segments else None
+
+    @lru_cache(maxsize=4096)
+    def get_path(self, template):
+        row = self._query_one("SELECT methods, query_options, entity, collection, summary FROM paths WHERE path = ?", (template,))
+        if row is None:
+            return None
+        return {
+            "path": template,
+            "methods": row[0].split(',') if row[0] else [],
+            "query_options": row[1].split(',') if row[1] else [],
+            "entity": row[2],
+            "collection": bool(row[3]),
+            "summary": row[4]
+        }
+
+    def lookup(self, path):
+        template = self.resolve_path(path)
+        return self.get_path(template) if template else None
+
+    @lru_cache(maxsize=1024)
+    def get_properties(self, entity):
+        return dict(self._query_all("SELECT name, type FROM properties WHERE entity = ?", (entity,)))
+
+    @lru_cache(maxsize=1024)
+    def get_enum_values(self, name):
+        row = self._query_one("SELECT enum_values FROM schemas WHERE name = ? AND kind = 'enum'", (name,))
+        return json.loads(row[0]) if row else None
+
+    def child_segments(self, template):
+        # Navigation suggestions: the next segments that exist under a path template
+        prefix = f"{template}/" if template else ""
+        rows = self._query_all("SELECT path FROM paths WHERE path LIKE ? ESCAPE '\\'", (prefix.replace('_', '\\_') + '%',))
+        return sorted({row[0][len(prefix):].split('/')[0] for row in rows})
+
+    def all_paths(self):
+        return [row[0] for row in self._query_all("SELECT path FROM paths ORDER BY path")]
+
+def is_index_current(spec_file=SPEC_FILE, index_file=INDEX_FILE):
+    if not os.path.exists(index_file):
+        return False
+    try:
+        db = sqlite3.connect(f"file:{index_file}?mode=ro", uri=True)
+        try:
+            row = db.execute("SELECT value FROM meta WHERE key = 'source_hash'").fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return False
+    return row is not None and row[0] == _spec_hash(spec_file)
+
+@st.cache_resource(show_spinner=False)
+def get_spec_index():
+    # Loaded on first use; compiled on the spot if the build step hasn't run yet
+    if not is_index_current():
+        build_spec_index()
+    return SpecIndex()
+
+if __name__ == "__main__":
+    # Build step: python -m utils.spec_index [spec.json]
+    spec_file = sys.argv[1] if len(sys.argv) > 1 else SPEC_FILE
+    print(f"Compiled {spec_file} into {build_spec_index(spec_file)}")
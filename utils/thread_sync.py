@@ -0,0 +1,40 @@
+import hashlib
+from collections import Counter
+import streamlit as st
+
+def message_hash(message):
+    return hashlib.sha256(f"{message['role']}\x00{message['content']}".encode()).hexdigest()
+
+class ThreadSync:
+    """Tracks which local chat messages are already on an assistant thread.
+
+    Posted messages are kept as a multiset of content hashes, so the same question
+    asked twice still counts twice, and only the difference gets posted next turn.
+    """
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.verified = False
+        self.posted = Counter()
+
+    def pending(self, history):
+        remaining = Counter(self.posted)
+        pending = []
+        for message in history:
+            key = message_hash(message)
+            if remaining[key] > 0:
+                remaining[key] -= 1
+            else:
+                pending.append(message)
+        return pending
+
+    def mark_posted(self, *messages):
+        self.posted.update(message_hash(message) for message in messages)
+
+def get_thread_sync(thread_id):
+    # Per session, per thread: a new thread starts with nothing posted
+    if 'thread_syncs' not in st.session_state:
+        st.session_state.thread_syncs = {}
+    if thread_id not in st.session_state.thread_syncs:
+        st.session_state.thread_syncs[thread_id] = ThreadSync(thread_id)
+    return st.session_state.thread_syncs[thread_id]
@@ -1,30 +1,73 @@
+import os
+import sys
+import time
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
 import streamlit as st
+from utils.headless import has_session
 
-def write_debug(message):
-    if 'debug_messages' not in st.session_state:
-        st.session_state.debug_messages = []
-    
-    st.session_state.debug_messages.append(message)
-    print(message)  # Keep console logging
-    
-    # Ensure the debug container is always created
+# Records kept per session; older ones fall off the end
+DEBUG_LOG_CAPACITY = 500
+DEBUG_PAGE_SIZE = 25
+# Set to a file path to also keep the log on disk (rotated at 5 MB, 3 backups)
+DEBUG_LOG_FILE = os.environ.get("INTUNE_NINJA_DEBUG_LOG")
+
+_file_logger = None
+
+def _get_file_logger():
+    global _file_logger
+    if _file_logger is None and DEBUG_LOG_FILE:
+        _file_logger = logging.getLogger("intune_ninja.debug")
+        _file_logger.setLevel(logging.DEBUG)
+        _file_logger.propagate = False
+        handler = RotatingFileHandler(DEBUG_LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(stage)s] %(message)s"))
+        _file_logger.addHandler(handler)
+    return _file_logger
+
+def _get_debug_log():
+    if 'debug_log' not in st.session_state:
+        st.session_state.debug_log = deque(maxlen=DEBUG_LOG_CAPACITY)
+    return st.session_state.debug_log
+
+def write_debug(message, stage=None, level=None):
+    # Only records the message; render_debug_log draws the sidebar once per rerun
+    if not message:
+        return
+    # The calling module is the stage unless one is given: graph_api, ai_chat, ...
+    stage = stage or sys._getframe(1).f_globals.get('__name__', '').rsplit('.', 1)[-1]
+    level = level or ("warning" if message.startswith((":warning:", ":negative_squared_cross_mark:")) else "info")
+    # Keep console logging; headless runs may be writing results to stdout
+    print(message, file=sys.stdout if has_session() else sys.stderr)
+
+    file_logger = _get_file_logger()
+    if file_logger:
+        file_logger.log(logging.WARNING if level == "warning" else logging.INFO, message, extra={"stage": stage})
+    # Worker threads and headless runs have no session to log into; the console and file sinks still have it
+    if has_session():
+        _get_debug_log().append({"time": time.time(), "stage": stage, "level": level, "message": message})
+
+def render_debug_log():
+    records = list(_get_debug_log())
     if 'debug_container' not in st.session_state:
         st.session_state.debug_container = st.sidebar.empty()
-    
-    # Update the debug info in the sidebar
-    with st.session_state.debug_container.container(height=None):
-        with st.expander("Debug Info", expanded=False, icon="🔎"):
-            # st.text_area("Debug Info", label_visibility="collapsed", value="\n".join(st.session_state.debug_messages), height=300)
-            # st.session_state.debug_messages.reverse()
-            for message in reversed(st.session_state.debug_messages):
-                if '$' in message:
-                    message = message.replace('$', '\$')
-                st.markdown(message)
+
+    with st.session_state.debug_container.container():
+        with st.expander(f"Debug Info ({len(records)})", expanded=False, icon="🔎"):
+            pages = max(1, -(-len(records) // DEBUG_PAGE_SIZE))
+            if st.session_state.get("debug_log_page", 1) > pages:
+                st.session_state.debug_log_page = pages
+            page = st.number_input("Page", min_value=1, max_value=pages, value=1, key="debug_log_page") if pages > 1 else 1
+            # Newest first, and only one page of markdown per rerun
+            newest_first = records[::-1][(page - 1) * DEBUG_PAGE_SIZE:page * DEBUG_PAGE_SIZE]
+            for record in newest_first:
+                message = record["message"].replace('$', '\\$')
+                st.markdown(f"`{time.strftime('%H:%M:%S', time.localtime(record['time']))}` `{record['stage']}` {message}")
 
 # Add this function to clear debug messages
 def clear_debug_messages():
-    if 'debug_messages' in st.session_state:
-        st.session_state.debug_messages = []
+    if 'debug_log' in st.session_state:
+        st.session_state.debug_log.clear()
     if 'debug_container' in st.session_state:
         st.session_state.debug_container.empty()
-